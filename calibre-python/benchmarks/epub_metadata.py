@@ -0,0 +1,57 @@
+"""Throughput of the EPUB metadata reader.
+
+Reads the metadata of copies of the sample EPUBs of `data/ebooks`, in this
+process only and in a pool of processes:
+
+    python calibre-python/benchmarks/epub_metadata.py --files 2000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from calibre.epub import read_epubs
+
+EBOOKS_DIR = Path(__file__).resolve().parents[2] / "data" / "ebooks"
+
+
+def run(paths, workers) -> float:
+    start = time.perf_counter()
+    for result in read_epubs(paths, workers=workers):
+        if result.error is not None:
+            raise RuntimeError(result.error)
+    return len(paths) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    samples = sorted(EBOOKS_DIR.glob("*.epub"))
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(args.files):
+            path = Path(tmp) / f"{i}.epub"
+            shutil.copy(samples[i % len(samples)], path)
+            paths.append(path)
+
+        results = {}
+        for name, workers in [("single_process", 0), ("process_pool", args.workers)]:
+            results[name] = round(run(paths, workers), 1)
+
+    print(
+        json.dumps(
+            {"files": args.files, "workers": args.workers, "files_per_s": results},
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
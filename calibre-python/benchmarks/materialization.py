@@ -0,0 +1,105 @@
+"""Throughput of the conversion of CalibreSql rows into books.
+
+Compares the validated path (InternalBookMetadata + BookMetadata pydantic models)
+with the BookRecord fast path, on synthetic rows so that no library is needed:
+
+    python calibre-python/benchmarks/materialization.py --rows 100000
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from calibre.converters import (
+    book_metadata_internal_to_external,
+    book_record_factory,
+    calibre_field_external_to_internals,
+)
+from calibre.objects import CalibreField, InternalBookMetadata, InternalCalibreField
+
+LIBRARY_PATH = Path("/library")
+FIELDS = [
+    CalibreField.authors,
+    CalibreField.cover,
+    CalibreField.formats,
+    CalibreField.series,
+    CalibreField.series_index,
+    CalibreField.timestamp,
+]
+
+
+def make_rows(internal_fields, nb_rows):
+    values = {
+        InternalCalibreField.title: "A title",
+        InternalCalibreField.path: "An Author/A title (1)",
+        InternalCalibreField.authors: "An Author & Another Author",
+        InternalCalibreField.series: "A series",
+        InternalCalibreField.series_index: 1.0,
+        InternalCalibreField.timestamp: "2024-05-14 09:31:14.123456+00:00",
+        InternalCalibreField.has_cover: 1,
+        InternalCalibreField.format_files: json.dumps(
+            [["EPUB", "A title - An Author"], ["PDF", "A title - An Author"]]
+        ),
+    }
+    return [
+        tuple(i if e == InternalCalibreField.id else values[e] for e in internal_fields)
+        for i in range(nb_rows)
+    ]
+
+
+def validated(internal_fields, rows):
+    res = []
+    for row in rows:
+        data = {field.value: row[idx] for idx, field in enumerate(internal_fields)}
+        internal = InternalBookMetadata.model_validate(data)
+        res.append(
+            book_metadata_internal_to_external(
+                internal=internal, library_path=LIBRARY_PATH, fields=FIELDS
+            )
+        )
+    return res
+
+
+def records(internal_fields, rows):
+    to_record = book_record_factory(
+        internal_fields=internal_fields, library_path=LIBRARY_PATH, fields=FIELDS
+    )
+    return [to_record(row) for row in rows]
+
+
+def metadata_from_records(internal_fields, rows):
+    return [e.to_book_metadata() for e in records(internal_fields, rows)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50_000)
+    args = parser.parse_args()
+
+    internal_fields = [InternalCalibreField.id, InternalCalibreField.title]
+    for field in FIELDS:
+        internal_fields.extend(calibre_field_external_to_internals(field))
+    internal_fields = list(dict.fromkeys(internal_fields))
+    rows = make_rows(internal_fields, args.rows)
+
+    assert validated(internal_fields, rows[:10]) == metadata_from_records(
+        internal_fields, rows[:10]
+    )
+
+    results = {}
+    for name, func in [
+        ("validated", validated),
+        ("records", records),
+        ("records_to_metadata", metadata_from_records),
+    ]:
+        start = time.perf_counter()
+        func(internal_fields, rows)
+        duration = time.perf_counter() - start
+        results[name] = round(args.rows / duration)
+
+    print(json.dumps({"rows": args.rows, "rows_per_second": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
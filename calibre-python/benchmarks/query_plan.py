@@ -0,0 +1,67 @@
+"""Per-call Python overhead of CalibreSql queries.
+
+Runs the same page query against an empty library, so that the measured time is
+the cost of building and executing the query rather than reading books, with the
+compiled query plans cached (the default) and with them compiled on every call:
+
+    python calibre-python/benchmarks/query_plan.py --calls 20000
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from calibre import (
+    CalibreField,
+    CalibreSql,
+    EqualityFilter,
+    InFilter,
+    OrderBy,
+    SearchParams,
+)
+from calibre.objects import InternalCalibreField
+
+PARAMS = SearchParams(
+    fields=list(CalibreField),
+    filters=[
+        InFilter(field=InternalCalibreField.series, values=["A series"]),
+        ~EqualityFilter.with_id(1),
+    ],
+    order_by=[OrderBy(field=InternalCalibreField.timestamp, descending=True)],
+    limit=60,
+)
+
+
+def run(library: CalibreSql, nb_calls: int, cached_plans: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(nb_calls):
+        if not cached_plans:
+            library._query_plans.clear()
+        # Not cached by the query cache, unlike list_books
+        library.list_records(params=PARAMS)
+    return (time.perf_counter() - start) / nb_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        library = CalibreSql.new_empty_library(Path(tmp) / "library")
+
+        results = {}
+        for name, cached_plans in [("compiled_each_call", False), ("cached", True)]:
+            run(library, 100, cached_plans)
+            results[name] = round(run(library, args.calls, cached_plans) * 1e6, 1)
+
+        library.close()
+        library.pool.close()
+
+    print(json.dumps({"calls": args.calls, "us_per_call": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
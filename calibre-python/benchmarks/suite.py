@@ -0,0 +1,187 @@
+"""Benchmark suite of the library queries, on generated libraries.
+
+Libraries of the requested sizes are generated once with `calibre.synthetic` and
+kept in the cache directory, then each case is timed on each of them with the
+query cache disabled. Results are printed as JSON, or written to `--output`, to
+compare them between commits:
+
+    python calibre-python/benchmarks/suite.py --books 10000 100000 --output run.json
+
+The home page case renders the page of the dashboard as its callbacks do, it is
+skipped when the dashboard dependencies are not installed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+from calibre import (
+    CalibreSql,
+    EqualityFilter,
+    FacetField,
+    FacetFilter,
+    FullTextFilter,
+    InFilter,
+    OrderBy,
+    QueryCache,
+    SearchParams,
+)
+from calibre.objects import CalibreField, InternalCalibreField
+from calibre.synthetic import generate_library
+
+DASHBOARD_DIR = Path(__file__).resolve().parents[2] / "dashboard"
+CACHE_DIR = Path(tempfile.gettempdir()) / "colibry" / "benchmarks"
+
+PAGE_SIZE = 60
+NEWEST_FIRST = [OrderBy(field=InternalCalibreField.timestamp, descending=True)]
+
+
+def library_path(nb_books: int, seed: int) -> Path:
+    """Generated library of `nb_books` books, reused by the next runs. The queries
+    never read the files of the books, so only metadata.db is generated."""
+    name = f"library-{nb_books}-seed{seed}"
+    path = CACHE_DIR / name
+    if not (path / "metadata.db").exists():
+        partial = CACHE_DIR / f"{name}.partial"
+        if partial.exists():
+            shutil.rmtree(partial)
+        print(f"Generating {name}...", file=sys.stderr)
+        generate_library(partial, nb_books, seed=seed, with_files=False)
+        partial.rename(path)
+    return path
+
+
+def time_case(run: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Durations of `repeat` runs of a case in ms, after a warm-up run."""
+    run()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": round(min(durations), 3),
+        "median_ms": round(statistics.median(durations), 3),
+        "mean_ms": round(statistics.mean(durations), 3),
+    }
+
+
+def library_cases(library: CalibreSql) -> Dict[str, Callable[[], object]]:
+    fields = list(CalibreField)
+    # Values picked from the library so that they match books at every size
+    facets = library.facets(fields=[FacetField.authors, FacetField.series])
+    top_author = facets[FacetField.authors][0].value
+    a_series = facets[FacetField.series][len(facets[FacetField.series]) // 2].value
+    middle_id = library.count_books() // 2
+    library.full_text_index.sync()
+
+    def page(filters=[]) -> Callable[[], object]:
+        params = SearchParams(
+            fields=fields, filters=filters, order_by=NEWEST_FIRST, limit=PAGE_SIZE
+        )
+        return lambda: library.list_page(params=params)
+
+    return {
+        "list_all": lambda: library.list_records(
+            params=SearchParams(fields=fields, order_by=NEWEST_FIRST)
+        ),
+        "list_first_page": page(),
+        "count": lambda: library.count_books(),
+        "filter_author": page(
+            [FacetFilter(field=FacetField.authors, values=[top_author])]
+        ),
+        "filter_series": page(
+            [InFilter(field=InternalCalibreField.series, values=[a_series])]
+        ),
+        "filter_full_text": page([FullTextFilter(query="garden")]),
+        "facets": lambda: library.facets(),
+        "facets_filtered": lambda: library.facets(
+            filters=[FacetFilter(field=FacetField.authors, values=[top_author])]
+        ),
+        "book_lookup": lambda: library.list_books(
+            params=SearchParams(
+                fields=fields, filters=[EqualityFilter.with_id(middle_id)]
+            )
+        ),
+    }
+
+
+def home_page_case(path: Path) -> Callable[[], object]:
+    """Render of the home page: its books, their count and the search facets."""
+    os.environ["COLIBRY_LIBRARY_PATH"] = str(path)
+    os.environ["COLIBRY_THUMBNAIL_WORKERS"] = "0"
+    sys.path.insert(0, str(DASHBOARD_DIR))
+    import app  # noqa: F401, registers the pages
+    from dash._utils import to_json
+    from core.library_store import LIBRARY_STORE
+    from pages import home
+
+    def render():
+        LIBRARY_STORE.library.query_cache.clear()
+        sort_by = next(iter(home.SORT_BY))
+        books = home.output_text(None, None, None, sort_by, None, None)
+        facets = home.update_facets(None, None, None, None, None)
+        return to_json([books, facets])
+
+    return render
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--cases", nargs="+", help="Only run these cases")
+    parser.add_argument("--output", type=Path, help="JSON file to write")
+    args = parser.parse_args()
+
+    def selected(name: str) -> bool:
+        return not args.cases or name in args.cases
+
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for nb_books in args.books:
+        path = library_path(nb_books, seed=args.seed)
+        library = CalibreSql(path, query_cache=QueryCache(max_entries=0))
+        cases = library_cases(library)
+        size_results = results.setdefault(str(nb_books), {})
+        for name, run in cases.items():
+            if selected(name):
+                size_results[name] = time_case(run, args.repeat)
+        library.close()
+
+        # The dashboard reads the library configured once, at import time
+        if selected("home_page") and nb_books == args.books[0]:
+            try:
+                render = home_page_case(path)
+            except ImportError as e:
+                print(f"Home page skipped: {e}", file=sys.stderr)
+            else:
+                size_results["home_page"] = time_case(render, args.repeat)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,36 @@
 from .calibredb import CalibreDB  # noqa: F401
-from .objects import BookMetadata, CalibreField  # noqa: F401
+from .objects import (  # noqa: F401
+    BookMetadata,
+    BookPage,
+    BookRecord,
+    CalibreField,
+    FacetField,
+    FacetValue,
+    LibraryChanges,
+)
 from .calibre_sql import CalibreSql  # noqa: F401
-from .filters import Filter, EqualityFilter  # noqa: F401
-from .search_params import SearchParams  # noqa: F401
+from .connection_pool import ConnectionPool  # noqa: F401
+from .database_snapshot import DatabaseSnapshot  # noqa: F401
+from .library_lock import LibraryLock, LibraryLockStats  # noqa: F401
+from .library_index import LibraryIndex  # noqa: F401
+from .metrics import MetricsRegistry  # noqa: F401
+from .query_cache import QueryCache, QueryCacheStats  # noqa: F401
+from .write_queue import JobStatus, WriteJob, WriteQueue  # noqa: F401
+from .epub import EpubMetadata  # noqa: F401
+from .hashing import HashCache  # noqa: F401
+from .dedup import DuplicateGroup, DuplicateReason  # noqa: F401
+from .ingest import BulkImport, ImportProgress, ImportStatus  # noqa: F401
+from .filters import (  # noqa: F401
+    Filter,
+    EqualityFilter,
+    InFilter,
+    FacetFilter,
+    LikeFilter,
+    ContainsFilter,
+    RangeFilter,
+    FullTextFilter,
+    AndFilter,
+    OrFilter,
+    NotFilter,
+)
+from .search_params import OrderBy, SearchParams  # noqa: F401
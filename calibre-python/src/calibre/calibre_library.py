@@ -1,20 +1,46 @@
 from __future__ import annotations
 
+import hashlib
 import shutil
+import tempfile
 from abc import abstractmethod
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional
 
-from calibre.objects import BookMetadata
+from calibre.filters import Filter
+from calibre.library_lock import LibraryLock
+from calibre.objects import (
+    BookMetadata,
+    BookPage,
+    CalibreField,
+    FacetField,
+    FacetValue,
+)
 from calibre.search_params import SearchParams
 
 
 class CalibreLibrary:
-    def __init__(self, library_path: Path) -> None:
+    def __init__(
+        self,
+        library_path: Path,
+        cache_dir: Optional[Path] = None,
+        lock: Optional[LibraryLock] = None,
+    ) -> None:
         if not library_path.exists():
             raise ValueError(f"Library not found : {library_path}")
         self.library_path = library_path
 
+        # Readers/writer lock coordinating the SQL reads and the calibredb writes of
+        # all the processes using the library
+        self.lock = lock or LibraryLock.shared(library_path)
+
+        # Folder for the data derived from the library (search index...), kept out
+        # of the library itself so that calibre never sees it.
+        if cache_dir is None:
+            digest = hashlib.sha1(str(library_path.resolve()).encode()).hexdigest()
+            cache_dir = Path(tempfile.gettempdir()) / "colibry" / digest[:16]
+        self.cache_dir = cache_dir
+
     @classmethod
     def new_empty_library(cls, new_library_path: Path) -> CalibreLibrary:
         path_empty_library = Path(__file__).resolve().parent / "empty_library"
@@ -26,3 +52,42 @@ class CalibreLibrary:
     @abstractmethod
     def list_books(self, params: SearchParams = SearchParams()) -> List[BookMetadata]:
         raise NotImplementedError
+
+    @abstractmethod
+    def list_page(self, params: SearchParams = SearchParams()) -> BookPage:
+        """Same as `list_books` but also returns the cursor to the next page when
+        `params.limit` books have been returned."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_batches(
+        self, params: SearchParams = SearchParams(), batch_size: int = 1000
+    ) -> Iterator[List[BookMetadata]]:
+        """Lazily list the books `batch_size` at a time, so that the whole library
+        is never held in memory."""
+        raise NotImplementedError
+
+    def iter_books(
+        self, params: SearchParams = SearchParams(), batch_size: int = 1000
+    ) -> Iterator[BookMetadata]:
+        for batch in self.iter_batches(params=params, batch_size=batch_size):
+            yield from batch
+
+    @abstractmethod
+    def count_books(self, params: SearchParams = SearchParams()) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def search(
+        self, query: str, limit: Optional[int] = 50, fields: List[CalibreField] = []
+    ) -> List[BookMetadata]:
+        """Full-text search on the titles, authors, series, tags and comments."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def facets(
+        self, fields: List[FacetField] = list(FacetField), filters: List[Filter] = []
+    ) -> Dict[FacetField, List[FacetValue]]:
+        """Distinct values of each facet among the books matching `filters`, sorted
+        by value, with the number of these books having them."""
+        raise NotImplementedError
@@ -1,19 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TYPE_CHECKING,
+    Tuple,
+    TypeVar,
+)
 
 from calibre.calibre_library import CalibreLibrary
+from calibre.connection_pool import ConnectionPool
+from calibre.database_snapshot import DatabaseSnapshot
 from calibre.objects import (
     BookMetadata,
+    BookPage,
+    BookRecord,
+    CalibreField,
+    FacetField,
+    FacetValue,
     InternalCalibreField,
-    InternalBookMetadata,
+    LibraryChanges,
 )
-from calibre.search_params import SearchParams
+from calibre.filters import AndFilter, Filter, FullTextFilter, InFilter
+from calibre.facets import facet_counts_sql
+from calibre.filters.filter import SqlExpression
+from calibre.fts import FTS_SCHEMA, FullTextIndex
+from calibre.library_lock import LibraryLock
+from calibre.metrics import MATERIALIZATION_SECONDS, SQL_QUERY_SECONDS, SQL_ROWS
+from calibre.query_cache import QueryCache, query_key
+from calibre.pagination import decode_cursor, encode_cursor, keyset_sql_filter
+from calibre.search_params import OrderBy, SearchParams
 from calibre.converters import (
-    book_metadata_internal_to_external,
+    book_record_factory,
     calibre_field_external_to_internals,
 )
 import sqlite3
 
+if TYPE_CHECKING:
+    # Not imported at run time, so that `python -m calibre.query_log` does not
+    # import its own module twice
+    from calibre.query_log import QueryLog
+
+T = TypeVar("T")
+
 
 class Concatenate:
     """String concatenation aggregator for sqlite"""
@@ -62,66 +101,531 @@ class SortedConcatenate:
             raise
 
 
+# SQL of the columns that are not part of the meta view
+_META_COLUMN_EXPRESSIONS = {
+    InternalCalibreField.has_cover: (
+        "(SELECT has_cover FROM books WHERE books.id = meta.id)"
+    ),
+    InternalCalibreField.format_files: (
+        "(SELECT json_group_array(json_array(format, name))"
+        " FROM data WHERE data.book = meta.id)"
+    ),
+}
+
+# Equivalent of the meta view, restricted to the columns of InternalCalibreField,
+# computed with the native aggregates of SQLite instead of the Python ones. The
+# lists are ordered by link id by aggregating over an ordered subquery. SQLite
+# flattens this subquery, so only the columns used by a query are computed.
+_BOOKS_JOIN = """(
+SELECT
+    books.id AS id,
+    books.title AS title,
+    books.path AS path,
+    (SELECT group_concat(name, ' & ') FROM (
+        SELECT authors.name
+        FROM books_authors_link AS bal JOIN authors ON bal.author = authors.id
+        WHERE bal.book = books.id
+        ORDER BY bal.id
+    )) AS authors,
+    books.author_sort AS author_sort,
+    (SELECT group_concat(format, ',') FROM (
+        SELECT format FROM data WHERE data.book = books.id ORDER BY data.id
+    )) AS formats,
+    (SELECT series.name
+     FROM books_series_link AS bsl JOIN series ON bsl.series = series.id
+     WHERE bsl.book = books.id) AS series,
+    books.series_index AS series_index,
+    (SELECT group_concat(tags.name, ',')
+     FROM books_tags_link AS btl JOIN tags ON btl.tag = tags.id
+     WHERE btl.book = books.id) AS tags,
+    books.timestamp AS timestamp,
+    books.has_cover AS has_cover,
+    (SELECT json_group_array(json_array(format, name)) FROM (
+        SELECT format, name FROM data WHERE data.book = books.id ORDER BY data.id
+    )) AS format_files
+FROM books
+) AS meta"""
+
+
+class _QueryPlan(NamedTuple):
+    sql: str
+    internal_fields: List[InternalCalibreField]
+    to_record: Callable[[Sequence[Any]], BookRecord]
+
+
+# Number of compiled queries kept by CalibreSql
+_QUERY_PLANS_CACHE_SIZE = 256
+
+
+def _unicode_lower(value: Optional[str]) -> Optional[str]:
+    return value.lower() if isinstance(value, str) else value
+
+
+def register_functions(connection: sqlite3.Connection) -> None:
+    """Register the functions calibre uses in the views of metadata.db, and
+    `unicode_lower`, the lower() of SQLite only lowers ASCII letters."""
+    connection.create_aggregate("sortconcat", 2, SortedConcatenate)
+    connection.create_aggregate("concat", 1, Concatenate)
+    connection.create_function("unicode_lower", 1, _unicode_lower, deterministic=True)
+
+
 class CalibreSql(CalibreLibrary):
-    def __init__(self, library_path: Path):
-        super().__init__(library_path=library_path)
+    def __init__(
+        self,
+        library_path: Path,
+        cache_dir: Optional[Path] = None,
+        verify_files: bool = False,
+        pool: Optional[ConnectionPool] = None,
+        use_meta_view: bool = False,
+        query_cache: Optional[QueryCache] = None,
+        lock: Optional[LibraryLock] = None,
+        query_log: Optional["QueryLog"] = None,
+        snapshot: Optional[DatabaseSnapshot] = None,
+    ):
+        """By default the paths of the covers and of the formats come from the
+        database only. With `verify_files`, they are checked to exist on disk.
+
+        Books are read from the tables of the library joined in pure SQL. With
+        `use_meta_view`, they are read from the `meta` view of calibre instead,
+        which calls back into Python for each author, tag and format.
+
+        Queries run on read-only connections borrowed from `pool`, which defaults
+        to the pool shared by all the instances reading the same library, so the
+        instances are cheap to create and can be used from several threads.
+
+        The results of `list_books`, `list_page`, `count_books` and `facets` are
+        kept in `query_cache` until the library is modified.
+
+        Queries hold `lock` shared, so they wait for the calibredb commands writing
+        to the library instead of failing with "database is locked".
+
+        With `query_log`, every statement is recorded in it along with its
+        parameters, its duration and its number of rows, see `QueryLog`.
+
+        With `snapshot`, a copy of metadata.db, queries run on the copy instead of
+        `pool`, without holding `lock`, and `data_version` changes with each new
+        copy of the snapshot, see `DatabaseSnapshot`.
+        """
+        super().__init__(library_path=library_path, cache_dir=cache_dir, lock=lock)
+
+        self.verify_files = verify_files
+        self.use_meta_view = use_meta_view
+
+        self.pool = pool or ConnectionPool.shared(
+            self.library_path / "metadata.db", setup=register_functions
+        )
+
+        # `PRAGMA data_version` only compares commits against the connection it
+        # runs on, so it is always asked to the same one
+        self._monitor: Optional[sqlite3.Connection] = None
+        self._monitor_lock = threading.Lock()
+
+        self._full_text_index: Optional[FullTextIndex] = None
+        self._full_text_index_lock = threading.Lock()
+
+        self.query_cache = query_cache or QueryCache()
+        self.query_log = query_log
+        self.snapshot = snapshot
+
+        self._query_plans: OrderedDict[Any, _QueryPlan] = OrderedDict()
+        self._query_plans_lock = threading.Lock()
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        if self.snapshot is not None:
+            # Copies are never written to, there is nothing to wait for
+            with self.snapshot.connection() as connection:
+                yield connection
+            return
+        with self.lock.shared_lock(), self.pool.connection() as connection:
+            yield connection
+
+    @property
+    def full_text_index(self) -> FullTextIndex:
+        """Full-text index of the library, created on first use."""
+        with self._full_text_index_lock:
+            if self._full_text_index is None:
+                self._full_text_index = FullTextIndex(
+                    library_path=self.library_path,
+                    index_path=self.cache_dir / "fts.db",
+                )
+            return self._full_text_index
+
+    def _attach_full_text_index(self, connection: sqlite3.Connection) -> None:
+        """Attach the full-text index to `connection` so that `FullTextFilter` can
+        be used in its queries."""
+        index_path = str(self.full_text_index.index_path.resolve())
+        attached = {e[1]: e[2] for e in connection.execute("PRAGMA database_list")}
+        if attached.get(FTS_SCHEMA) == index_path:
+            return
+        if FTS_SCHEMA in attached:
+            # Connection shared with an instance using another cache directory
+            connection.execute(f"DETACH DATABASE {FTS_SCHEMA}")
+        connection.execute(f"ATTACH DATABASE ? AS {FTS_SCHEMA}", [index_path])
+
+    def close(self) -> None:
+        """Close the connections owned by this instance. The pool is left open as
+        it may be shared, see `ConnectionPool.close`."""
+        with self._monitor_lock:
+            if self._monitor is not None:
+                self._monitor.close()
+                self._monitor = None
+        with self._full_text_index_lock:
+            if self._full_text_index is not None:
+                self._full_text_index.close()
+                self._full_text_index = None
+
+    def __enter__(self) -> "CalibreSql":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def search(
+        self, query: str, limit: Optional[int] = 50, fields: List[CalibreField] = []
+    ) -> List[BookMetadata]:
+        ids = self.full_text_index.search(query, limit=limit)
+        books = self.list_books(
+            params=SearchParams(
+                fields=fields,
+                filters=[InFilter(field=InternalCalibreField.id, values=ids)],
+            )
+        )
 
-        self.connection = sqlite3.connect(self.library_path / "metadata.db")
-        self.connection.create_aggregate("sortconcat", 2, SortedConcatenate)
-        self.connection.create_aggregate("concat", 1, Concatenate)
+        rank = {book_id: idx for idx, book_id in enumerate(ids)}
+        return sorted(books, key=lambda e: rank[e.id])
 
     def _list_all_tables(self):
-        cursor = self.connection.cursor()
-
-        res = cursor.execute("SELECT * FROM sqlite_master WHERE type='table';")
+        with self._connection() as connection:
+            res = connection.execute("SELECT * FROM sqlite_master WHERE type='table';")
+
+            print(res.fetchall())
+
+    def data_version(self) -> int:
+        """Counter changed by SQLite each time another connection commits to the
+        database. Cheap enough to be polled to know whether the library changed.
+        """
+        if self.snapshot is not None:
+            return self.snapshot.version
+        with self._monitor_lock:
+            if self._monitor is None:
+                self._monitor = self.pool.connect()
+            return self._monitor.execute("PRAGMA data_version").fetchone()[0]
+
+    def checkpoint(self) -> Optional[str]:
+        """Most recent `books.last_modified` of the library."""
+        with self._connection() as connection:
+            return self._checkpoint(connection)
+
+    def _checkpoint(self, connection: sqlite3.Connection) -> Optional[str]:
+        return self._run(
+            connection, "checkpoint", "SELECT MAX(last_modified) FROM books"
+        )[0][0]
+
+    def list_changes(
+        self,
+        checkpoint: Optional[str],
+        known_ids: Iterable[int],
+        params: SearchParams = SearchParams(),
+    ) -> LibraryChanges:
+        """List the books modified after `checkpoint` and the ones among `known_ids`
+        that have been removed from the library.
+        """
+        with self._connection() as connection:
+            new_checkpoint = self._checkpoint(connection)
+
+            records = []
+            if checkpoint is None:
+                records, _ = self._query_page(connection, params=params)
+            elif new_checkpoint is not None and new_checkpoint > checkpoint:
+                records, _ = self._query_books(
+                    connection,
+                    fields=params.fields,
+                    where="id IN (SELECT id FROM books WHERE last_modified > ?)",
+                    args=[checkpoint],
+                )
+            with MATERIALIZATION_SECONDS.time(("models",)):
+                updated = [e.to_book_metadata() for e in records]
+
+            ids = set(
+                e[0] for e in self._run(connection, "ids", "SELECT id FROM books")
+            )
+            deleted_ids = sorted(set(known_ids) - ids)
 
-        print(res.fetchall())
+        return LibraryChanges(
+            checkpoint=new_checkpoint, updated=updated, deleted_ids=deleted_ids
+        )
 
     def list_books(self, params: SearchParams = SearchParams()) -> List[BookMetadata]:
-        cur = self.connection.cursor()
-        fields = params.fields
-
-        # Turn the list of public fields to the list of internal ones
+        return self.list_page(params=params).books
+
+    def list_page(self, params: SearchParams = SearchParams()) -> BookPage:
+        return self._cached(query_key("list_page", params), self._list_page, params)
+
+    def _list_page(self, params: SearchParams) -> BookPage:
+        with self._connection() as connection:
+            records, next_cursor = self._query_page(connection, params=params)
+        with MATERIALIZATION_SECONDS.time(("models",)):
+            books = [e.to_book_metadata() for e in records]
+        return BookPage(books=books, next_cursor=next_cursor)
+
+    def _cached(self, key: str, compute: Callable[..., T], *args: Any) -> T:
+        return self.query_cache.get_or_compute(
+            key, self.data_version(), lambda: compute(*args)
+        )
+
+    def list_records(self, params: SearchParams = SearchParams()) -> List[BookRecord]:
+        """Fast path of `list_books` returning BookRecord instead of pydantic models."""
+        with self._connection() as connection:
+            return self._query_page(connection, params=params)[0]
+
+    def _query_page(
+        self, connection: sqlite3.Connection, params: SearchParams
+    ) -> Tuple[List[BookRecord], Optional[str]]:
+        where, args = self._search_where(connection, params)
+
+        # One more book is fetched to know whether there is a next page
+        records, keys = self._query_books(
+            connection,
+            fields=params.fields,
+            where=where,
+            args=args,
+            order_by=params.order_by,
+            limit=None if params.limit is None else params.limit + 1,
+        )
+
+        next_cursor = None
+        if params.limit is not None and len(records) > params.limit:
+            records = records[: params.limit]
+            next_cursor = encode_cursor(params.order_by, keys[params.limit - 1])
+
+        return records, next_cursor
+
+    def iter_batches(
+        self, params: SearchParams = SearchParams(), batch_size: int = 1000
+    ) -> Iterator[List[BookMetadata]]:
+        """Rows are fetched `batch_size` at a time from a single query.
+
+        SQLite keeps the database read-locked until the iteration is over, which
+        prevents calibre from writing to it meanwhile. The connection is also kept
+        out of the pool until then.
+        """
+        with self._connection() as connection:
+            where, args = self._search_where(connection, params)
+            plan = self._query_plan(
+                fields=params.fields,
+                where=where,
+                order_by=params.order_by,
+                limited=params.limit is not None,
+            )
+            if params.limit is not None:
+                args = [*args, int(params.limit)]
+            cur = connection.execute(plan.sql, args)
+            to_record = plan.to_record
+
+            # Fetching the rows is the costly part of the query, it is timed and
+            # logged as a whole once the iteration is over
+            duration, nb_rows = 0.0, 0
+            try:
+                while True:
+                    start = time.perf_counter()
+                    rows = cur.fetchmany(batch_size)
+                    duration += time.perf_counter() - start
+                    if not rows:
+                        break
+                    nb_rows += len(rows)
+                    with MATERIALIZATION_SECONDS.time(("models",)):
+                        books = [to_record(row).to_book_metadata() for row in rows]
+                    yield books
+            finally:
+                cur.close()
+                SQL_QUERY_SECONDS.observe(duration, ("books",))
+                SQL_ROWS.inc(nb_rows, ("books",))
+                if self.query_log is not None:
+                    self.query_log.record(
+                        connection, "books", plan.sql, args, duration, nb_rows
+                    )
+
+    def count_books(self, params: SearchParams = SearchParams()) -> int:
+        return self._cached(
+            query_key("count_books", params.filters), self._count_books, params.filters
+        )
+
+    def _count_books(self, filters: List[Filter]) -> int:
+        with self._connection() as connection:
+            self._prepare_filters(connection, filters)
+            where, args = AndFilter(filters=filters).to_sql_filter()
+            sql = f"SELECT COUNT(*) FROM {self._books_source()} WHERE {where}"
+            return self._run(connection, "count", sql, args)[0][0]
+
+    def facets(
+        self, fields: List[FacetField] = list(FacetField), filters: List[Filter] = []
+    ) -> Dict[FacetField, List[FacetValue]]:
+        return self._cached(
+            query_key("facets", fields, filters), self._facets, fields, filters
+        )
+
+    def _facets(
+        self, fields: List[FacetField], filters: List[Filter]
+    ) -> Dict[FacetField, List[FacetValue]]:
+        with self._connection() as connection:
+            self._prepare_filters(connection, filters)
+            where, args = AndFilter(filters=filters).to_sql_filter()
+            books_sql = f"SELECT id FROM {self._books_source()} WHERE {where}"
+            return {
+                field: [
+                    FacetValue(value=value, count=count)
+                    for value, count in self._run(
+                        connection, "facets", facet_counts_sql(field, books_sql), args
+                    )
+                ]
+                for field in fields
+            }
+
+    def _run(
+        self,
+        connection: sqlite3.Connection,
+        query: str,
+        sql: str,
+        args: Sequence[Any] = (),
+    ) -> List[Any]:
+        """Execute a statement and fetch all its rows, timing it as `query`."""
+        start = time.perf_counter()
+        rows = connection.execute(sql, args).fetchall()
+        duration = time.perf_counter() - start
+        SQL_QUERY_SECONDS.observe(duration, (query,))
+        if self.query_log is not None:
+            self.query_log.record(connection, query, sql, args, duration, len(rows))
+        return rows
+
+    def _books_source(self) -> str:
+        return "meta" if self.use_meta_view else _BOOKS_JOIN
+
+    def _search_where(
+        self, connection: sqlite3.Connection, params: SearchParams
+    ) -> SqlExpression:
+        """Condition selecting the books matching the filters of the search, after
+        its cursor if any."""
+        self._prepare_filters(connection, params.filters)
+        where, args = AndFilter(filters=params.filters).to_sql_filter()
+        if params.cursor is not None:
+            key = decode_cursor(params.cursor, params.order_by)
+            keyset_where, keyset_args = keyset_sql_filter(params.order_by, key)
+            where = f"({where}) AND ({keyset_where})"
+            args = args + keyset_args
+        return where, args
+
+    def _prepare_filters(
+        self, connection: sqlite3.Connection, filters: List[Filter]
+    ) -> None:
+        for e in AndFilter(filters=filters).iter_filters():
+            if isinstance(e, FullTextFilter):
+                self.full_text_index.sync()
+                self._attach_full_text_index(connection)
+                return
+
+    def _query_books(
+        self,
+        connection: sqlite3.Connection,
+        fields: List[CalibreField],
+        where: Optional[str] = None,
+        args: Sequence[Any] = (),
+        order_by: List[OrderBy] = [],
+        limit: Optional[int] = None,
+    ) -> Tuple[List[BookRecord], List[List[Any]]]:
+        """Run the query and return the books along with their sort keys."""
+        plan = self._query_plan(
+            fields=fields, where=where, order_by=order_by, limited=limit is not None
+        )
+        if limit is not None:
+            args = [*args, int(limit)]
+        res = self._run(connection, "books", plan.sql, args)
+        SQL_ROWS.inc(len(res), ("books",))
+
+        start = time.perf_counter()
+        to_record = plan.to_record
+        records = [to_record(row) for row in res]
+        MATERIALIZATION_SECONDS.observe(time.perf_counter() - start, ("records",))
+
+        nb_columns = len(plan.internal_fields)
+        keys = [[*row[nb_columns:], row[0]] for row in res]
+
+        return records, keys
+
+    def _query_plan(
+        self,
+        fields: List[CalibreField],
+        where: Optional[str],
+        order_by: List[OrderBy],
+        limited: bool,
+    ) -> _QueryPlan:
+        """Compiled query listing the books, cached by shape of the search.
+
+        The values of the filters and the limit are bound as parameters, so the
+        same SQL is executed again and SQLite can reuse its prepared statement.
+        """
+        key = (
+            tuple(fields),
+            where,
+            tuple((e.field, e.descending) for e in order_by),
+            limited,
+        )
+        with self._query_plans_lock:
+            plan = self._query_plans.get(key)
+            if plan is not None:
+                self._query_plans.move_to_end(key)
+                return plan
+
+        plan = self._compile_query_plan(fields, where, order_by, limited)
+
+        with self._query_plans_lock:
+            self._query_plans[key] = plan
+            while len(self._query_plans) > _QUERY_PLANS_CACHE_SIZE:
+                self._query_plans.popitem(last=False)
+        return plan
+
+    def _compile_query_plan(
+        self,
+        fields: List[CalibreField],
+        where: Optional[str],
+        order_by: List[OrderBy],
+        limited: bool,
+    ) -> _QueryPlan:
+        """The selected columns are the internal fields of the plan, in this order
+        and starting with the id, followed by the sort keys."""
+        # Turn the list of public fields to the list of internal ones, without
+        # duplicates but in a fixed order
         internal_fields = [InternalCalibreField.id, InternalCalibreField.title]
         for field in fields:
             internal_fields.extend(calibre_field_external_to_internals(field))
+        internal_fields = list(dict.fromkeys(internal_fields))
 
-        # Remove potential duplicates
-        internal_fields = list(set(internal_fields))
-
-        query = "SELECT "
-        first = True
+        columns = []
         for internal_field in internal_fields:
-            if first:
-                query += f" {internal_field.value}"
-                first = False
-            else:
-                query += f", {internal_field.value}"
-
-        query += " FROM meta"
-
-        if params.filters:
-            for filter in params.filters:
-                query += f" WHERE {filter.to_sql_filter()}"
-
-        query += " ORDER BY id"
-
-        res = cur.execute(query)
-        res = res.fetchall()
-
-        res_parsed = []
-        for row in res:
-            data = {}
-            for idx, field in enumerate(internal_fields):
-                data[field.value] = row[idx]
-            internal_book_metadata = InternalBookMetadata.model_validate(data)
-
-            book_metadata = book_metadata_internal_to_external(
-                internal=internal_book_metadata,
+            column = internal_field.value
+            if self.use_meta_view:
+                column = _META_COLUMN_EXPRESSIONS.get(internal_field, column)
+            columns.append(column)
+        # Sort keys, used to build the cursor to the next page
+        columns.extend(e.field.value for e in order_by)
+
+        query = f"SELECT {', '.join(columns)} FROM {self._books_source()}"
+        if where:
+            query += f" WHERE {where}"
+        sort = [
+            f"{e.field.value} {'DESC' if e.descending else 'ASC'}" for e in order_by
+        ]
+        query += f" ORDER BY {', '.join([*sort, 'id'])}"
+        if limited:
+            query += " LIMIT ?"
+
+        return _QueryPlan(
+            sql=query,
+            internal_fields=internal_fields,
+            to_record=book_record_factory(
+                internal_fields=internal_fields,
                 library_path=self.library_path,
                 fields=fields,
-            )
-
-            res_parsed.append(book_metadata)
-
-        return res_parsed
+                verify_files=self.verify_files,
+            ),
+        )
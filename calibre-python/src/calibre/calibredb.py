@@ -4,19 +4,35 @@ import json
 import logging
 import subprocess
 import threading
+import time
+from collections import Counter
 from pathlib import Path
-from typing import List, Union
+from typing import Dict, Iterator, List, Optional, Union
 
 from pydantic import TypeAdapter
 
 from calibre.calibre_library import CalibreLibrary
 from calibre.errors import CalibreRuntimeError
-from calibre.objects import BookMetadata
+from calibre.library_lock import LibraryLock
+from calibre.metrics import CALIBREDB_SECONDS
+from calibre.filters import AndFilter, Filter, FullTextFilter, InFilter
+from calibre.objects import (
+    BookMetadata,
+    BookPage,
+    CalibreField,
+    FacetField,
+    FacetValue,
+    InternalCalibreField,
+)
+from calibre.pagination import decode_cursor, encode_cursor
 from calibre.search_params import SearchParams
 from copy import deepcopy
 
 logger = logging.getLogger(__name__)
 
+# calibredb commands that do not modify the library, run under a shared lock
+_READ_COMMANDS = {"list", "search", "show_metadata", "list_categories", "clone"}
+
 
 def run_shell(cmd):
     res = subprocess.run(cmd, check=True, encoding="utf-8", capture_output=True)
@@ -28,8 +44,10 @@ def run_shell(cmd):
 
 
 class CalibreDB(CalibreLibrary):
-    def __init__(self, library_path: Union[Path, str]):
-        super().__init__(library_path=library_path)
+    def __init__(
+        self, library_path: Union[Path, str], lock: Optional[LibraryLock] = None
+    ):
+        super().__init__(library_path=library_path, lock=lock)
 
         # Concurrent access to calibre are forbidden by the calibredb CLI
         self.mutex = threading.Lock()
@@ -39,16 +57,28 @@ class CalibreDB(CalibreLibrary):
 
         logger.debug("Running cmd : %s", cmd)
 
-        self.mutex.acquire()
-
-        try:
-            res = run_shell(cmd)
-        except subprocess.CalledProcessError as e:
-            raise CalibreRuntimeError(e.cmd, e.returncode, e.stdout, e.stderr) from e
-
-        self.mutex.release()
-
-        return res
+        if params[0] in _READ_COMMANDS:
+            library_lock = self.lock.shared_lock()
+        else:
+            library_lock = self.lock.exclusive_lock()
+
+        with self.mutex, library_lock:
+            start = time.perf_counter()
+            status = "error"
+            try:
+                res = run_shell(cmd)
+                status = "ok"
+                return res
+            except subprocess.CalledProcessError as e:
+                raise CalibreRuntimeError(
+                    e.cmd, e.returncode, e.stdout, e.stderr
+                ) from e
+            finally:
+                duration = time.perf_counter() - start
+                CALIBREDB_SECONDS.observe(duration, (params[0], status))
+                logger.debug(
+                    "calibredb %s took %.3fs (%s)", params[0], duration, status
+                )
 
     def clone(self, new_library_path: Path) -> CalibreDB:
         self._run_calibredb(["clone", str(new_library_path)])
@@ -61,15 +91,114 @@ class CalibreDB(CalibreLibrary):
         return self
 
     def list_books(self, params: SearchParams = SearchParams()) -> List[BookMetadata]:
+        return self.list_page(params=params).books
+
+    def list_page(self, params: SearchParams = SearchParams()) -> BookPage:
+        books = self._list_all_books(params=params)
+
+        # calibredb can't resume a search, the page is sliced from the whole result
+        # right after the book referenced by the cursor.
+        if params.cursor is not None:
+            last_id = decode_cursor(params.cursor, params.order_by)[-1]
+            ids = [e.id for e in books]
+            books = books[ids.index(last_id) + 1 :] if last_id in ids else []
+
+        next_cursor = None
+        if params.limit is not None and len(books) > params.limit:
+            books = books[: params.limit]
+            key = [None] * len(params.order_by) + [books[-1].id]
+            next_cursor = encode_cursor(params.order_by, key)
+
+        return BookPage(books=books, next_cursor=next_cursor)
+
+    def iter_batches(
+        self, params: SearchParams = SearchParams(), batch_size: int = 1000
+    ) -> Iterator[List[BookMetadata]]:
+        """Only the ids of the books are listed upfront, their fields are then
+        listed with one calibredb call per batch."""
+        ids = [
+            e.id
+            for e in self.list_page(
+                params=params.model_copy(update={"fields": []})
+            ).books
+        ]
+
+        for start in range(0, len(ids), batch_size):
+            batch_ids = ids[start : start + batch_size]
+            books = self._list_all_books(
+                params=SearchParams(
+                    fields=params.fields,
+                    filters=[InFilter(field=InternalCalibreField.id, values=batch_ids)],
+                )
+            )
+            rank = {book_id: idx for idx, book_id in enumerate(batch_ids)}
+            yield sorted(books, key=lambda e: rank[e.id])
+
+    def count_books(self, params: SearchParams = SearchParams()) -> int:
+        return len(self._list_all_books(params=SearchParams(filters=params.filters)))
+
+    def search(
+        self, query: str, limit: Optional[int] = 50, fields: List[CalibreField] = []
+    ) -> List[BookMetadata]:
+        # calibredb doesn't rank its results
+        return self.list_page(
+            params=SearchParams(
+                fields=fields, filters=[FullTextFilter(query=query)], limit=limit
+            )
+        ).books
+
+    def facets(
+        self, fields: List[FacetField] = list(FacetField), filters: List[Filter] = []
+    ) -> Dict[FacetField, List[FacetValue]]:
+        if not fields:
+            return {}
+
+        cmd = ["list", "--for-machine", "--fields", ",".join(e.value for e in fields)]
+        if filters:
+            cmd.append("-s")
+            cmd.append(AndFilter(filters=filters).to_calibredb_filter())
+        books = json.loads(self._run_calibredb(cmd))
+
+        counts = {field: Counter() for field in fields}
+        for book in books:
+            for field in fields:
+                value = book.get(field.value)
+                if not value:
+                    continue
+                if field == FacetField.authors:
+                    counts[field].update(value.split(" & "))
+                elif isinstance(value, list):
+                    counts[field].update(value)
+                else:
+                    counts[field][value] += 1
+
+        return {
+            field: [
+                FacetValue(value=value, count=count)
+                for value, count in sorted(
+                    counts[field].items(), key=lambda e: e[0].lower()
+                )
+            ]
+            for field in fields
+        }
+
+    def _list_all_books(self, params: SearchParams) -> List[BookMetadata]:
         fields = deepcopy(params.fields)
         fields.append("id")
         fields.append("title")
 
         cmd = ["list", "--for-machine", "--fields", ",".join(fields)]
         if params.filters:
-            for filter in params.filters:
-                cmd.append("-s")
-                cmd.append(filter.to_calibredb_filter())
+            cmd.append("-s")
+            cmd.append(AndFilter(filters=params.filters).to_calibredb_filter())
+        if params.order_by:
+            descending = set(e.descending for e in params.order_by)
+            if len(descending) > 1:
+                raise ValueError("calibredb can only sort all fields in one direction")
+            sort_by = [e.field.value for e in params.order_by] + ["id"]
+            cmd.extend(["--sort-by", ",".join(sort_by)])
+            if not params.order_by[0].descending:
+                cmd.append("--ascending")
 
         res = self._run_calibredb(cmd)
 
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRAGMAS: Dict[str, Any] = {
+    # Never write to the library, that is calibre's job
+    "query_only": 1,
+    # Read the database through a memory mapping of up to 256MB
+    "mmap_size": 256 * 1024 * 1024,
+    # Page cache of 64MB (negative values are in KiB)
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+class PoolTimeoutError(TimeoutError):
+    """Raised when no connection has been released in time."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of read-only connections to a SQLite database.
+
+    Connections are opened lazily up to `max_size` and released connections are
+    reused most recent first, so that their page cache stays warm. A connection is
+    only ever used by one thread at a time, but may be used by several threads
+    over its lifetime.
+
+    With `immutable`, SQLite is told that the database is never modified, so it
+    neither locks it nor checks it for changes, e.g. for a private copy.
+    """
+
+    _shared: Dict[Path, ConnectionPool] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        database_path: Path,
+        max_size: int = 8,
+        timeout: float = 30.0,
+        pragmas: Dict[str, Any] = DEFAULT_PRAGMAS,
+        setup: Optional[Callable[[sqlite3.Connection], None]] = None,
+        immutable: bool = False,
+    ):
+        self.database_path = database_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.setup = setup
+        self.immutable = immutable
+
+        self._idle: List[sqlite3.Connection] = []
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @classmethod
+    def shared(
+        cls,
+        database_path: Path,
+        setup: Optional[Callable[[sqlite3.Connection], None]] = None,
+    ) -> ConnectionPool:
+        """Pool shared by everything reading `database_path` in this process."""
+        key = database_path.resolve()
+        with cls._shared_lock:
+            pool = cls._shared.get(key)
+            if pool is None or pool._closed:
+                pool = cls(database_path=key, setup=setup)
+                cls._shared[key] = pool
+            return pool
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection set up like the pooled ones, but owned by the caller."""
+        logger.debug("Opening a connection to %s", self.database_path)
+        uri = self.database_path.resolve().as_uri() + "?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        connection = sqlite3.connect(
+            uri,
+            uri=True,
+            timeout=self.timeout,
+            check_same_thread=False,
+            # CalibreSql compiles its queries so that the same ones come back
+            cached_statements=256,
+        )
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        if self.setup is not None:
+            self.setup(connection)
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise ValueError(f"Connection pool of {self.database_path} closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if not self._condition.wait(timeout=self.timeout):
+                    raise PoolTimeoutError(
+                        f"No connection to {self.database_path} available "
+                        f"after {self.timeout}s"
+                    )
+
+        try:
+            return self.connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        with self._condition:
+            if self._closed:
+                self._size -= 1
+                connection.close()
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """Close the idle connections, the ones in use are closed when released."""
+        with self._condition:
+            self._closed = True
+            for connection in self._idle:
+                connection.close()
+            self._size -= len(self._idle)
+            self._idle = []
+            self._condition.notify_all()
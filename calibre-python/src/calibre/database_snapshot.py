@@ -0,0 +1,211 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from calibre.connection_pool import DEFAULT_PRAGMAS, ConnectionPool
+from calibre.library_lock import LibraryLock
+from calibre.metrics import SNAPSHOT_COPY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# tmpfs of most Linux systems, the copies are then only held in memory
+_SHARED_MEMORY_DIR = Path("/dev/shm")
+
+
+def default_snapshot_dir() -> Path:
+    if _SHARED_MEMORY_DIR.is_dir() and os.access(_SHARED_MEMORY_DIR, os.W_OK):
+        return _SHARED_MEMORY_DIR
+    return Path(tempfile.gettempdir())
+
+
+class DatabaseSnapshot:
+    """Private copy of a SQLite database, from which the reads are served.
+
+    The database is copied with the backup API of SQLite into a file of
+    `snapshot_dir`, /dev/shm by default so that the copy stays in memory, and read
+    through a pool of immutable connections: readers never touch the source, e.g.
+    on a slow network share or locked by calibre.
+
+    `refresh` copies the database again when it was modified and then swaps the
+    copies. Queries already running finish on the previous copy, which is deleted
+    right away but only freed once their connections are closed. `start` refreshes
+    the snapshot in a background thread.
+
+    Only the copies wait for `lock` and for the locks of SQLite on the source.
+    """
+
+    def __init__(
+        self,
+        database_path: Path,
+        snapshot_dir: Optional[Path] = None,
+        lock: Optional[LibraryLock] = None,
+        max_size: int = 8,
+        timeout: float = 30.0,
+        pragmas: Dict[str, Any] = DEFAULT_PRAGMAS,
+        setup: Optional[Callable[[sqlite3.Connection], None]] = None,
+    ):
+        """The first copy is made right away."""
+        self.database_path = database_path
+        self.snapshot_dir = snapshot_dir or default_snapshot_dir()
+        self.lock = lock
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.setup = setup
+
+        # `PRAGMA data_version` only compares commits against the connection it
+        # runs on, so the copies are read from the same one
+        self._source = sqlite3.connect(
+            self.database_path.resolve().as_uri() + "?mode=ro",
+            uri=True,
+            timeout=timeout,
+            check_same_thread=False,
+        )
+        self._source_version: Optional[int] = None
+        # Incremented by each copy, see `CalibreSql.data_version`
+        self.version = 0
+
+        self._pool: Optional[ConnectionPool] = None
+        self._refresh_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refresh()
+
+    @property
+    def path(self) -> Path:
+        """Path of the current copy."""
+        return self._current_pool().database_path
+
+    def _current_pool(self) -> ConnectionPool:
+        pool = self._pool
+        if pool is None:
+            raise ValueError(f"Snapshot of {self.database_path} closed")
+        return pool
+
+    def _copy(self) -> Path:
+        fd, name = tempfile.mkstemp(
+            prefix="colibry-snapshot-", suffix=".db", dir=self.snapshot_dir
+        )
+        os.close(fd)
+        path = Path(name)
+        try:
+            target = sqlite3.connect(path)
+            try:
+                # A failed copy is thrown away, it needs no journal
+                target.execute("PRAGMA journal_mode = OFF")
+                with self.lock.shared_lock() if self.lock else nullcontext():
+                    self._source.backup(target)
+                # Copies of databases in WAL mode could not be opened read-only
+                # without their -shm file
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        return path
+
+    def refresh(self, force: bool = False) -> bool:
+        """Copy the database again if it was modified since the last copy, or if
+        `force`. Returns whether a new copy is served."""
+        with self._refresh_lock:
+            if self._stopped.is_set():
+                raise ValueError(f"Snapshot of {self.database_path} closed")
+            # Read before the copy, so that commits made during it are not missed
+            source_version = self._source.execute("PRAGMA data_version").fetchone()[0]
+            if not force and source_version == self._source_version:
+                return False
+
+            start = time.perf_counter()
+            status = "error"
+            try:
+                path = self._copy()
+                status = "ok"
+            finally:
+                duration = time.perf_counter() - start
+                SNAPSHOT_COPY_SECONDS.observe(duration, (status,))
+
+            previous = self._pool
+            self._pool = ConnectionPool(
+                path,
+                max_size=self.max_size,
+                timeout=self.timeout,
+                pragmas=self.pragmas,
+                setup=self.setup,
+                immutable=True,
+            )
+            self._source_version = source_version
+            self.version += 1
+            if previous is not None:
+                previous.close()
+                previous.database_path.unlink(missing_ok=True)
+
+        logger.info(
+            "Snapshot of %s copied to %s in %.3fs", self.database_path, path, duration
+        )
+        return True
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        while True:
+            pool = self._current_pool()
+            try:
+                connection = pool.acquire()
+                break
+            except ValueError:
+                # Pool of a copy swapped in the meantime
+                if pool is self._pool:
+                    raise
+        try:
+            yield connection
+        finally:
+            pool.release(connection)
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection to the current copy, owned by the caller."""
+        return self._current_pool().connect()
+
+    def start(self, interval: float) -> "DatabaseSnapshot":
+        """Refresh the snapshot every `interval` seconds in a background thread."""
+        if self._thread is not None:
+            raise ValueError(f"Snapshot of {self.database_path} already started")
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="snapshot-refresh", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _run(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                # The previous copy keeps being served until the next try
+                logger.exception(
+                    "Failed to refresh the snapshot of %s", self.database_path
+                )
+
+    def close(self) -> None:
+        """Stop the refreshes and delete the copy, the connections in use are
+        closed when released."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._refresh_lock:
+            pool, self._pool = self._pool, None
+            if pool is not None:
+                pool.close()
+                pool.database_path.unlink(missing_ok=True)
+            self._source.close()
+
+    def __enter__(self) -> "DatabaseSnapshot":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,248 @@
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from pydantic import BaseModel
+
+from calibre.calibre_library import CalibreLibrary
+from calibre.calibredb import CalibreDB
+from calibre.hashing import HashCache, process_pool
+from calibre.objects import BookMetadata, CalibreField
+from calibre.search_params import SearchParams
+
+logger = logging.getLogger(__name__)
+
+# Leading articles left out of the titles compared, in English and in French
+_ARTICLES = {"a", "an", "the", "l", "la", "le", "les", "un", "une", "des"}
+_NON_WORD_RE = re.compile(r"[\W_]+")
+# Letters that NFKD does not decompose
+_LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ø": "o", "ł": "l"})
+# Books by the same authors whose titles are compared to each other pairwise,
+# above that only identical titles are grouped
+_MAX_FUZZY_BLOCK_SIZE = 500
+
+
+class DuplicateReason(str, Enum):
+    # Format files with the same content
+    content = "content"
+    # Same authors and titles equal once normalized, or close enough
+    metadata = "metadata"
+
+
+class DuplicateGroup(BaseModel):
+    reason: DuplicateReason
+    # Hash of the shared content, or normalized authors of the books
+    key: str
+    # Sorted by id, so the book added first comes first
+    books: List[BookMetadata]
+
+    def redundant_books(self) -> List[BookMetadata]:
+        """Books of the group to remove to keep only the one added first."""
+        return self.books[1:]
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Lower case words of a text, without accents nor punctuation."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text.casefold()).translate(_LIGATURES)
+    text = "".join(e for e in text if not unicodedata.combining(e))
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def normalize_title(title: Optional[str]) -> str:
+    words = normalize_text(title).split()
+    if len(words) > 1 and words[0] in _ARTICLES:
+        words = words[1:]
+    return " ".join(words)
+
+
+def normalize_authors(authors: Optional[str]) -> str:
+    """Authors in an order independent form, "Daudet, Ernest & Paul Éluard" and
+    "Paul Eluard & Ernest Daudet" are the same."""
+    if not authors:
+        return ""
+    names = (" ".join(sorted(normalize_text(e).split())) for e in authors.split(" & "))
+    return " & ".join(sorted(e for e in names if e))
+
+
+class _DisjointSets:
+    """Union-find of book ids, to merge the pairs of duplicates into groups."""
+
+    def __init__(self) -> None:
+        self.parents: Dict[int, int] = {}
+
+    def find(self, node: int) -> int:
+        parent = self.parents.setdefault(node, node)
+        while parent != node:
+            grandparent = self.parents[parent]
+            self.parents[node] = grandparent
+            node, parent = parent, grandparent
+        return node
+
+    def union(self, nodes: Iterable[int]) -> None:
+        nodes = iter(nodes)
+        root = self.find(next(nodes))
+        for node in nodes:
+            other = self.find(node)
+            if other != root:
+                self.parents[other] = root
+
+    def groups(self) -> List[List[int]]:
+        """Groups of more than one node, sorted."""
+        groups: Dict[int, List[int]] = defaultdict(list)
+        for node in self.parents:
+            groups[self.find(node)].append(node)
+        return sorted(sorted(e) for e in groups.values() if len(e) > 1)
+
+
+def content_duplicates(
+    books: List[BookMetadata], hashes: Dict[Path, str]
+) -> List[DuplicateGroup]:
+    """Books having format files with the same hash in `hashes`."""
+    books_by_hash: Dict[str, Set[int]] = defaultdict(set)
+    for book in books:
+        for path in book.formats or []:
+            sha256 = hashes.get(path)
+            if sha256 is not None:
+                books_by_hash[sha256].add(book.id)
+
+    # Books sharing several files are grouped once
+    sets = _DisjointSets()
+    keys: Dict[int, str] = {}
+    for sha256, ids in books_by_hash.items():
+        if len(ids) > 1:
+            sets.union(ids)
+            for book_id in ids:
+                keys.setdefault(book_id, sha256)
+
+    books_by_id = {e.id: e for e in books}
+    return [
+        DuplicateGroup(
+            reason=DuplicateReason.content,
+            key=keys[group[0]],
+            books=[books_by_id[e] for e in group],
+        )
+        for group in sets.groups()
+    ]
+
+
+def metadata_duplicates(
+    books: List[BookMetadata], title_similarity: float = 0.9
+) -> List[DuplicateGroup]:
+    """Books by the same authors whose normalized titles are equal, or at least
+    `title_similarity` similar (see `difflib.SequenceMatcher.ratio`)."""
+    blocks: Dict[str, List[BookMetadata]] = defaultdict(list)
+    for book in books:
+        blocks[normalize_authors(book.authors)].append(book)
+
+    groups = []
+    for authors, block in blocks.items():
+        if len(block) < 2:
+            continue
+        by_title: Dict[str, List[int]] = defaultdict(list)
+        for book in block:
+            by_title[normalize_title(book.title)].append(book.id)
+
+        sets = _DisjointSets()
+        for ids in by_title.values():
+            sets.union(ids)
+
+        if title_similarity < 1 and len(by_title) <= _MAX_FUZZY_BLOCK_SIZE:
+            distinct = list(by_title)
+            for i, title in enumerate(distinct):
+                matcher = SequenceMatcher(None, title)
+                for other in distinct[i + 1 :]:
+                    matcher.set_seq2(other)
+                    if (
+                        matcher.real_quick_ratio() >= title_similarity
+                        and matcher.quick_ratio() >= title_similarity
+                        and matcher.ratio() >= title_similarity
+                    ):
+                        sets.union([by_title[title][0], by_title[other][0]])
+
+        books_by_id = {e.id: e for e in block}
+        groups.extend(
+            DuplicateGroup(
+                reason=DuplicateReason.metadata,
+                key=authors,
+                books=[books_by_id[e] for e in group],
+            )
+            for group in sets.groups()
+        )
+    return groups
+
+
+def find_duplicates(
+    library: CalibreLibrary,
+    hash_cache: Optional[HashCache] = None,
+    workers: Optional[int] = None,
+    title_similarity: float = 0.9,
+) -> List[DuplicateGroup]:
+    """Groups of books of the library that are duplicates of each other.
+
+    The format files are hashed in a pool of `workers` processes, all the CPUs by
+    default or none with 0. Their hashes are kept in `hash_cache`, by default in
+    the cache directory of the library, so that the next calls only hash the files
+    added or modified since.
+
+    Books grouped because of their content are not grouped again because of their
+    metadata.
+    """
+    books = list(
+        library.iter_books(
+            params=SearchParams(fields=[CalibreField.authors, CalibreField.formats])
+        )
+    )
+
+    own_cache = hash_cache is None
+    if hash_cache is None:
+        hash_cache = HashCache(library.cache_dir / "hashes.db")
+    paths = [e for book in books for e in book.formats or []]
+    try:
+        if workers == 0:
+            hashes = hash_cache.hash_files(paths)
+        else:
+            with process_pool(max_workers=workers) as executor:
+                hashes = hash_cache.hash_files(paths, executor=executor)
+    finally:
+        if own_cache:
+            hash_cache.close()
+
+    groups = content_duplicates(books, hashes)
+    content_group = {e.id: i for i, group in enumerate(groups) for e in group.books}
+    for group in metadata_duplicates(books, title_similarity=title_similarity):
+        indexes = set(content_group.get(e.id) for e in group.books)
+        if len(indexes) > 1 or None in indexes:
+            groups.append(group)
+
+    logger.info("%d groups of duplicates found among %d books", len(groups), len(books))
+    return groups
+
+
+def remove_duplicates(
+    library: CalibreDB,
+    groups: List[DuplicateGroup],
+    confirmed: List[DuplicateGroup] = [],
+) -> List[BookMetadata]:
+    """Remove all the books of the groups but the first one of each, see
+    `DuplicateGroup.redundant_books`. Returns the books removed.
+
+    Only the groups of books with the same files are removed from `groups`. Books
+    with similar metadata may be different books, e.g. numbered volumes, so their
+    groups are only removed when passed in `confirmed`, e.g. once checked by a user.
+    """
+    groups = [e for e in groups if e.reason == DuplicateReason.content]
+    groups.extend(confirmed)
+    books_by_id = {e.id: e for group in groups for e in group.redundant_books()}
+    # A book may be in several groups, and be the one kept in some of them
+    kept = {group.books[0].id for group in groups}
+    books = [books_by_id[e] for e in sorted(books_by_id) if e not in kept]
+    if books:
+        library.remove_books(books)
+    return books
@@ -0,0 +1,203 @@
+import logging
+import posixpath
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+from pydantic import BaseModel
+
+from calibre.hashing import process_pool
+
+logger = logging.getLogger(__name__)
+
+_CONTAINER = "META-INF/container.xml"
+_NS = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+    "dc": "http://purl.org/dc/elements/1.1/",
+}
+_OPF_MANIFEST = f"{{{_NS['opf']}}}manifest"
+# Roles of the creators that are authors, creators without a role are too
+_AUTHOR_ROLES = {None, "aut"}
+# Files read by each task sent to the process pool
+_READ_CHUNK_SIZE = 16
+
+
+class InvalidEpubError(ValueError):
+    """Raised when a file is not an EPUB whose metadata can be read."""
+
+
+class EpubMetadata(BaseModel):
+    title: Optional[str] = None
+    authors: List[str] = []
+    series: Optional[str] = None
+    series_index: Optional[float] = None
+    languages: List[str] = []
+    # Name of the cover image in the archive, see `read_cover`
+    cover: Optional[str] = None
+
+
+def _text(element: Optional[ElementTree.Element]) -> Optional[str]:
+    if element is None or element.text is None:
+        return None
+    return " ".join(element.text.split()) or None
+
+
+def _float(value: Optional[str]) -> Optional[float]:
+    try:
+        return None if value is None else float(value)
+    except ValueError:
+        return None
+
+
+def _opf_path(archive: zipfile.ZipFile) -> str:
+    with archive.open(_CONTAINER) as f:
+        container = ElementTree.parse(f).getroot()
+    rootfile = container.find("container:rootfiles/container:rootfile", _NS)
+    if rootfile is None or not rootfile.get("full-path"):
+        raise InvalidEpubError(f"No package document in {_CONTAINER}")
+    return rootfile.attrib["full-path"]
+
+
+def _parse_package(archive: zipfile.ZipFile, opf_path: str) -> ElementTree.Element:
+    """Parse the package document up to the end of its manifest, the spine and the
+    guide that follow are not needed."""
+    package = None
+    with archive.open(opf_path) as f:
+        for event, element in ElementTree.iterparse(f, events=("start", "end")):
+            if package is None:
+                package = element
+            elif event == "end" and element.tag == _OPF_MANIFEST:
+                break
+    if package is None:
+        raise InvalidEpubError(f"Empty package document {opf_path}")
+    return package
+
+
+def _series(
+    metadata: ElementTree.Element,
+) -> Tuple[Optional[str], Optional[float]]:
+    # Written by calibre in the EPUB 2 way
+    metas = {
+        e.get("name"): e.get("content") for e in metadata.iterfind("opf:meta", _NS)
+    }
+    if metas.get("calibre:series"):
+        return metas["calibre:series"], _float(metas.get("calibre:series_index"))
+
+    # EPUB 3 collections refined as a series
+    refines: Dict[str, Dict[str, Optional[str]]] = {}
+    for meta in metadata.iterfind("opf:meta[@refines]", _NS):
+        refines.setdefault(meta.attrib["refines"].lstrip("#"), {})[
+            meta.get("property")
+        ] = _text(meta)
+    for meta in metadata.iterfind("opf:meta[@property='belongs-to-collection']", _NS):
+        properties = refines.get(meta.get("id"), {})
+        if properties.get("collection-type") in (None, "series"):
+            return _text(meta), _float(properties.get("group-position"))
+    return None, None
+
+
+def _cover(package: ElementTree.Element, opf_path: str) -> Optional[str]:
+    items = package.findall("opf:manifest/opf:item", _NS)
+
+    # EPUB 3 declares it in the manifest, EPUB 2 in a meta of the metadata
+    cover = next(
+        (e for e in items if "cover-image" in e.get("properties", "").split()), None
+    )
+    if cover is None:
+        cover_id = None
+        for meta in package.iterfind("opf:metadata/opf:meta[@name='cover']", _NS):
+            cover_id = meta.get("content")
+        cover = next((e for e in items if e.get("id") == cover_id), None)
+    if cover is None or not cover.get("media-type", "").startswith("image/"):
+        return None
+
+    href = unquote(cover.get("href", ""))
+    return posixpath.normpath(posixpath.join(posixpath.dirname(opf_path), href))
+
+
+def read_epub_metadata(path: Path) -> EpubMetadata:
+    """Read the metadata of an EPUB from its package document.
+
+    Only `container.xml` and the package document are read from the archive,
+    the content of the book is never decompressed.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            opf_path = _opf_path(archive)
+            package = _parse_package(archive, opf_path)
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise InvalidEpubError(f"Invalid EPUB {path}: {e}") from e
+
+    metadata = package.find("opf:metadata", _NS)
+    if metadata is None:
+        raise InvalidEpubError(f"Invalid EPUB {path}: no metadata")
+
+    role = f"{{{_NS['opf']}}}role"
+    series, series_index = _series(metadata)
+    return EpubMetadata(
+        title=_text(metadata.find("dc:title", _NS)),
+        authors=[
+            text
+            for e in metadata.iterfind("dc:creator", _NS)
+            if e.get(role) in _AUTHOR_ROLES and (text := _text(e))
+        ],
+        series=series,
+        series_index=series_index,
+        languages=[
+            text for e in metadata.iterfind("dc:language", _NS) if (text := _text(e))
+        ],
+        cover=_cover(package, opf_path),
+    )
+
+
+def read_cover(path: Path, metadata: Optional[EpubMetadata] = None) -> Optional[bytes]:
+    """Content of the cover image of an EPUB, None when it has none."""
+    if metadata is None:
+        metadata = read_epub_metadata(path)
+    if metadata.cover is None:
+        return None
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(metadata.cover)
+    except KeyError:
+        logger.debug("Cover %s missing from %s", metadata.cover, path)
+        return None
+    except zipfile.BadZipFile as e:
+        raise InvalidEpubError(f"Invalid EPUB {path}: {e}") from e
+
+
+class EpubReadResult(NamedTuple):
+    path: Path
+    metadata: Optional[EpubMetadata] = None
+    # Why the metadata could not be read, None when they were
+    error: Optional[str] = None
+
+
+def _read(path: Path) -> EpubReadResult:
+    try:
+        return EpubReadResult(path, metadata=read_epub_metadata(path))
+    except (InvalidEpubError, OSError) as e:
+        return EpubReadResult(path, error=str(e))
+
+
+def read_epubs(
+    paths: Iterable[Path], workers: Optional[int] = None
+) -> Iterator[EpubReadResult]:
+    """Read the metadata of many EPUBs in a pool of `workers` processes, all the
+    CPUs by default or none with 0. Results come in the order of `paths`."""
+    paths = list(paths)
+    if workers == 0:
+        yield from map(_read, paths)
+        return
+    with process_pool(max_workers=workers) as executor:
+        yield from executor.map(_read, paths, chunksize=_READ_CHUNK_SIZE)
+
+
+def find_epubs(directory: Path) -> List[Path]:
+    """EPUBs of a directory and of its sub-directories."""
+    return sorted(
+        e for e in directory.rglob("*") if e.suffix.lower() == ".epub" and e.is_file()
+    )
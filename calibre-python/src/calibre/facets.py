@@ -0,0 +1,46 @@
+from typing import Dict, NamedTuple
+
+from calibre.objects import FacetField
+
+
+class _FacetTable(NamedTuple):
+    table: str
+    link_table: str
+    # Column of the link table referencing the table
+    link_column: str
+    # Column of the table holding the value
+    value_column: str
+
+
+_FACET_TABLES: Dict[FacetField, _FacetTable] = {
+    FacetField.authors: _FacetTable("authors", "books_authors_link", "author", "name"),
+    FacetField.series: _FacetTable("series", "books_series_link", "series", "name"),
+    FacetField.tags: _FacetTable("tags", "books_tags_link", "tag", "name"),
+    FacetField.languages: _FacetTable(
+        "languages", "books_languages_link", "lang_code", "lang_code"
+    ),
+}
+
+
+def facet_books_sql(field: FacetField, nb_values: int) -> str:
+    """Query selecting the ids of the books having one of `nb_values` values."""
+    t = _FACET_TABLES[field]
+    placeholders = ", ".join("?" for _ in range(nb_values))
+    return (
+        f"SELECT link.book FROM {t.link_table} AS link"
+        f" JOIN {t.table} AS value ON link.{t.link_column} = value.id"
+        f" WHERE value.{t.value_column} IN ({placeholders})"
+    )
+
+
+def facet_counts_sql(field: FacetField, books_sql: str) -> str:
+    """Query counting, for each value of the facet, the books among the ones
+    selected by `books_sql` that have it. Values without any book are left out."""
+    t = _FACET_TABLES[field]
+    return (
+        f"SELECT value.{t.value_column}, COUNT(*) FROM {t.link_table} AS link"
+        f" JOIN {t.table} AS value ON link.{t.link_column} = value.id"
+        f" WHERE link.book IN ({books_sql})"
+        f" GROUP BY value.id"
+        f" ORDER BY value.{t.value_column}"
+    )
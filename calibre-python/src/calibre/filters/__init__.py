@@ -1 +1,13 @@
-from .filter import Filter, EqualityFilter  # noqa: F401
+from .filter import (  # noqa: F401
+    Filter,
+    EqualityFilter,
+    InFilter,
+    FacetFilter,
+    LikeFilter,
+    ContainsFilter,
+    RangeFilter,
+    FullTextFilter,
+    AndFilter,
+    OrFilter,
+    NotFilter,
+)
@@ -1,7 +1,41 @@
-from calibre.objects import InternalCalibreField
-from typing import Any, Union
-from pydantic import BaseModel
+from __future__ import annotations
+
+import re
 from abc import abstractmethod
+from datetime import datetime
+from typing import Any, Iterator, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from calibre.facets import facet_books_sql
+from calibre.fts import FTS_SCHEMA, to_fts_query
+from calibre.objects import FacetField, InternalCalibreField
+
+# A SQL boolean expression with its "?" placeholders and the values to bind to them
+SqlExpression = Tuple[str, List[Any]]
+
+# Name of the calibre search locations that differ from the column name
+_CALIBREDB_SEARCH_LOCATIONS = {
+    InternalCalibreField.timestamp: "date",
+}
+
+
+def _calibredb_location(field: InternalCalibreField) -> str:
+    return _CALIBREDB_SEARCH_LOCATIONS.get(field, field.value)
+
+
+def _calibredb_value(value: Any) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{value}"'
+
+
+def _sql_value(value: Any) -> Any:
+    # Calibre stores the dates as text like "2024-05-14 09:31:14.123456+00:00"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return value
 
 
 class Filter(BaseModel):
@@ -10,20 +44,239 @@ class Filter(BaseModel):
         raise NotImplementedError
 
     @abstractmethod
-    def to_sql_filter(self) -> str:
+    def to_sql_filter(self) -> SqlExpression:
         raise NotImplementedError
 
+    def __and__(self, other: Filter) -> AndFilter:
+        return AndFilter(filters=[self, other])
+
+    def __or__(self, other: Filter) -> OrFilter:
+        return OrFilter(filters=[self, other])
+
+    def __invert__(self) -> NotFilter:
+        return NotFilter(filter=self)
+
+    def iter_filters(self) -> Iterator[Filter]:
+        """Iterate over this filter and all the filters it is composed of."""
+        yield self
+
 
 class EqualityFilter(Filter):
     field: InternalCalibreField
     value: Any
 
     def to_calibredb_filter(self) -> str:
-        return f'{self.field.value}:"{str(self.value)}"'
+        return f"{_calibredb_location(self.field)}:{_calibredb_value(self.value)}"
 
-    def to_sql_filter(self) -> str:
-        return f'{self.field.value}="{str(self.value)}"'
+    def to_sql_filter(self) -> SqlExpression:
+        return f"{self.field.value} = ?", [_sql_value(self.value)]
 
     @classmethod
     def with_id(cls, id: Union[int, str]):
         return cls(field=InternalCalibreField.id, value=id)
+
+
+class InFilter(Filter):
+    """Match the books whose field is exactly one of the values."""
+
+    field: InternalCalibreField
+    values: List[Any]
+
+    def to_calibredb_filter(self) -> str:
+        if not self.values:
+            return 'id:"=-1"'
+        location = _calibredb_location(self.field)
+        return (
+            "("
+            + " or ".join(
+                f"{location}:{_calibredb_value(f'={e}')}" for e in self.values
+            )
+            + ")"
+        )
+
+    def to_sql_filter(self) -> SqlExpression:
+        if not self.values:
+            return "0", []
+        placeholders = ", ".join("?" for _ in self.values)
+        return f"{self.field.value} IN ({placeholders})", [
+            _sql_value(e) for e in self.values
+        ]
+
+
+class FacetFilter(Filter):
+    """Match the books having at least one of the values of a facet, e.g. books
+    written by one of the authors even when they have co-authors."""
+
+    field: FacetField
+    values: List[str]
+
+    def to_calibredb_filter(self) -> str:
+        if not self.values:
+            return 'id:"=-1"'
+        return (
+            "("
+            + " or ".join(
+                f"{self.field.value}:{_calibredb_value(f'={e}')}" for e in self.values
+            )
+            + ")"
+        )
+
+    def to_sql_filter(self) -> SqlExpression:
+        if not self.values:
+            return "0", []
+        return f"id IN ({facet_books_sql(self.field, len(self.values))})", list(
+            self.values
+        )
+
+
+class LikeFilter(Filter):
+    """Match the books whose field matches a SQL LIKE pattern (case insensitive)."""
+
+    field: InternalCalibreField
+    pattern: str
+
+    def to_calibredb_filter(self) -> str:
+        regex = "".join(
+            ".*" if c == "%" else "." if c == "_" else re.escape(c)
+            for c in self.pattern
+        )
+        return f"{_calibredb_location(self.field)}:{_calibredb_value(f'~^{regex}$')}"
+
+    def to_sql_filter(self) -> SqlExpression:
+        return f"{self.field.value} LIKE ?", [self.pattern]
+
+
+class ContainsFilter(Filter):
+    """Match the books whose field contains the value (case insensitive).
+
+    In SQL, both are lowered with `unicode_lower`, see `register_functions`.
+    """
+
+    field: InternalCalibreField
+    value: str
+
+    def to_calibredb_filter(self) -> str:
+        return f"{_calibredb_location(self.field)}:{_calibredb_value(self.value)}"
+
+    def to_sql_filter(self) -> SqlExpression:
+        escaped = re.sub(r"([\\%_])", r"\\\1", self.value.lower())
+        return (
+            f"unicode_lower({self.field.value}) LIKE ? ESCAPE '\\'",
+            [f"%{escaped}%"],
+        )
+
+
+class RangeFilter(Filter):
+    """Match the books whose field is between min and max, both included."""
+
+    field: InternalCalibreField
+    min: Optional[Any] = None
+    max: Optional[Any] = None
+
+    def to_calibredb_filter(self) -> str:
+        location = _calibredb_location(self.field)
+        conditions = []
+        if self.min is not None:
+            conditions.append(f"{location}:{_calibredb_value(f'>={self.min}')}")
+        if self.max is not None:
+            conditions.append(f"{location}:{_calibredb_value(f'<={self.max}')}")
+        if not conditions:
+            return "id:true"
+        return "(" + " and ".join(conditions) + ")"
+
+    def to_sql_filter(self) -> SqlExpression:
+        conditions = []
+        args = []
+        if self.min is not None:
+            conditions.append(f"{self.field.value} >= ?")
+            args.append(_sql_value(self.min))
+        if self.max is not None:
+            conditions.append(f"{self.field.value} <= ?")
+            args.append(_sql_value(self.max))
+        if not conditions:
+            return "1", []
+        return " AND ".join(conditions), args
+
+
+class FullTextFilter(Filter):
+    """Match the books found by a full-text search on their titles, authors,
+    series, tags and comments."""
+
+    query: str
+
+    def to_calibredb_filter(self) -> str:
+        return self.query
+
+    def to_sql_filter(self) -> SqlExpression:
+        query = to_fts_query(self.query)
+        if not query:
+            # FTS5 rejects empty queries, a search without terms matches all books
+            return "1", []
+        return (
+            f"id IN (SELECT rowid FROM {FTS_SCHEMA}.books_fts WHERE books_fts MATCH ?)",
+            [query],
+        )
+
+
+class AndFilter(Filter):
+    filters: List[Filter]
+
+    def iter_filters(self) -> Iterator[Filter]:
+        yield self
+        for e in self.filters:
+            yield from e.iter_filters()
+
+    def to_calibredb_filter(self) -> str:
+        if not self.filters:
+            return "id:true"
+        return " and ".join(f"({e.to_calibredb_filter()})" for e in self.filters)
+
+    def to_sql_filter(self) -> SqlExpression:
+        return _join_sql_filters(self.filters, "AND", "1")
+
+
+class OrFilter(Filter):
+    filters: List[Filter]
+
+    def iter_filters(self) -> Iterator[Filter]:
+        yield self
+        for e in self.filters:
+            yield from e.iter_filters()
+
+    def to_calibredb_filter(self) -> str:
+        if not self.filters:
+            return 'id:"=-1"'
+        return " or ".join(f"({e.to_calibredb_filter()})" for e in self.filters)
+
+    def to_sql_filter(self) -> SqlExpression:
+        return _join_sql_filters(self.filters, "OR", "0")
+
+
+class NotFilter(Filter):
+    filter: Filter
+
+    def iter_filters(self) -> Iterator[Filter]:
+        yield self
+        yield from self.filter.iter_filters()
+
+    def to_calibredb_filter(self) -> str:
+        return f"not ({self.filter.to_calibredb_filter()})"
+
+    def to_sql_filter(self) -> SqlExpression:
+        sql, args = self.filter.to_sql_filter()
+        # Like in calibre, a book without value for the field matches the negation
+        return f"NOT IFNULL(({sql}), 0)", args
+
+
+def _join_sql_filters(
+    filters: List[Filter], operator: str, empty: str
+) -> SqlExpression:
+    if not filters:
+        return empty, []
+    sqls = []
+    args = []
+    for e in filters:
+        sql, filter_args = e.to_sql_filter()
+        sqls.append(f"({sql})")
+        args.extend(filter_args)
+    return f" {operator} ".join(sqls), args
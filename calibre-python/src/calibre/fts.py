@@ -0,0 +1,157 @@
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+# Name under which the index is attached to the connections of CalibreSql
+FTS_SCHEMA = "fts"
+
+_TOKEN_RE = re.compile(r'"[^"]*"?|[^\s"]+')
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+_CREATE_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, authors, series, tags, comments,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS fts_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Books removed from the library or modified since the last synchronization
+_DELETE_BOOKS = """
+DELETE FROM books_fts
+WHERE rowid IN (SELECT id FROM lib.books WHERE last_modified > :checkpoint)
+   OR rowid NOT IN (SELECT id FROM lib.books)
+"""
+
+_INSERT_BOOKS = """
+INSERT INTO books_fts(rowid, title, authors, series, tags, comments)
+SELECT
+    books.id,
+    books.title,
+    (SELECT group_concat(authors.name, ' & ')
+     FROM lib.books_authors_link AS bal JOIN lib.authors ON bal.author = authors.id
+     WHERE bal.book = books.id),
+    (SELECT series.name
+     FROM lib.books_series_link AS bsl JOIN lib.series ON bsl.series = series.id
+     WHERE bsl.book = books.id),
+    (SELECT group_concat(tags.name, ' ')
+     FROM lib.books_tags_link AS btl JOIN lib.tags ON btl.tag = tags.id
+     WHERE btl.book = books.id),
+    (SELECT strip_html(comments.text) FROM lib.comments WHERE comments.book = books.id)
+FROM lib.books
+WHERE books.last_modified > :checkpoint
+"""
+
+
+def _strip_html(text: Optional[str]) -> Optional[str]:
+    if text is None:
+        return None
+    return _HTML_TAG_RE.sub(" ", text)
+
+
+def to_fts_query(text: str) -> str:
+    """Turn a user search into a FTS5 query matching all of its terms.
+
+    Words are matched as prefixes (`dau` matches `Daudet`) and double-quoted
+    text as phrases. Characters having a meaning in the FTS5 syntax are escaped
+    so that any input is a valid query.
+    """
+    terms = []
+    for token in _TOKEN_RE.findall(text):
+        if token.startswith('"'):
+            phrase = token.strip('"').strip()
+            if phrase:
+                terms.append(f'"{phrase}"')
+        else:
+            terms.append(f'"{token}"*')
+    return " ".join(terms)
+
+
+class FullTextIndex:
+    """Side-car SQLite FTS5 index of the titles, authors, series, tags and comments
+    of the books of a calibre library.
+
+    The index lives in its own database so that metadata.db is never written to. It
+    is kept in sync incrementally with `books.last_modified`. Its connection is
+    shared between threads and only used under a lock.
+    """
+
+    def __init__(self, library_path: Path, index_path: Path):
+        self.library_path = library_path
+        self.index_path = index_path
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(
+            self.index_path.resolve().as_uri(),
+            uri=True,
+            timeout=30,
+            check_same_thread=False,
+        )
+        self.connection.create_function("strip_html", 1, _strip_html)
+        self.connection.executescript(_CREATE_SCHEMA)
+        self.connection.execute(
+            "ATTACH DATABASE ? AS lib",
+            [(self.library_path / "metadata.db").resolve().as_uri() + "?mode=ro"],
+        )
+
+        self._data_version: Optional[int] = None
+        self._lock = threading.RLock()
+
+    def sync(self) -> None:
+        """Re-index the books modified since the last synchronization."""
+        with self._lock:
+            self._sync()
+
+    def _sync(self) -> None:
+        data_version = self.connection.execute("PRAGMA lib.data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT value FROM fts_state WHERE key = 'checkpoint'"
+            ).fetchone()
+            checkpoint = "" if row is None else row[0]
+
+            self.connection.execute(_DELETE_BOOKS, {"checkpoint": checkpoint})
+            self.connection.execute(_INSERT_BOOKS, {"checkpoint": checkpoint})
+            self.connection.execute(
+                "INSERT OR REPLACE INTO fts_state(key, value) "
+                "SELECT 'checkpoint', IFNULL(MAX(last_modified), '') FROM lib.books"
+            )
+
+        self._data_version = data_version
+
+    def rebuild(self) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM books_fts")
+            self.connection.execute("DELETE FROM fts_state")
+            self._data_version = None
+        self.sync()
+
+    def search(self, query: str, limit: Optional[int] = 50) -> List[int]:
+        """Ids of the books matching `query`, the most relevant first."""
+        fts_query = to_fts_query(query)
+
+        with self._lock:
+            self._sync()
+            if not fts_query:
+                return []
+
+            # Matches in the title weigh more than in the authors, series...
+            res = self.connection.execute(
+                "SELECT rowid FROM books_fts WHERE books_fts MATCH ? "
+                "ORDER BY bm25(books_fts, 10.0, 5.0, 5.0, 2.0, 1.0) "
+                "LIMIT ?",
+                [fts_query, -1 if limit is None else limit],
+            )
+            return [e[0] for e in res]
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
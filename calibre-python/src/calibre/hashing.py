@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+# Files hashed by each task sent to a process pool
+_FILES_PER_TASK = 16
+# Paths looked up in the cache by each query, under the SQLite variables limit
+_LOOKUP_BATCH_SIZE = 500
+
+_CREATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+def hash_file(path: Path) -> str:
+    """SHA-256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """Pool of processes to hash, check or read files, all the CPUs by default.
+
+    Processes are not forked from the caller, e.g. a web worker whose threads may
+    hold locks that would never be released in the children, but started from a
+    fork server or spawned where there is none.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def _hash_files(paths: List[Path]) -> List[Optional[str]]:
+    hashes = []
+    for path in paths:
+        try:
+            hashes.append(hash_file(path))
+        except OSError as e:
+            logger.warning("Can't hash %s: %s", path, e)
+            hashes.append(None)
+    return hashes
+
+
+def chunks(values: List, size: int) -> Iterator[List]:
+    """Consecutive slices of `values` of `size` values, the last one may be shorter."""
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+class HashCache:
+    """Persistent cache of the content hashes of files.
+
+    Hashes are keyed by the path, the size and the modification time of their file,
+    so a file is hashed again only once it has been modified. The cache lives in
+    its own SQLite database, its connection is shared between threads and only
+    used under a lock.
+    """
+
+    def __init__(self, cache_path: Path):
+        self.cache_path = cache_path
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(
+            self.cache_path.resolve().as_uri(),
+            uri=True,
+            timeout=30,
+            check_same_thread=False,
+        )
+        self.connection.executescript(_CREATE_SCHEMA)
+
+        # Files found in the cache and files hashed, since the cache was opened
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hash_files(
+        self, paths: Iterable[Path], executor: Optional[Executor] = None
+    ) -> Dict[Path, str]:
+        """Hashes of the files, those not in the cache are hashed with `executor`.
+
+        Files that can't be read are left out of the result.
+        """
+        stats: Dict[str, Tuple[Path, int, int]] = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                logger.debug("File not found: %s", path)
+                continue
+            except OSError as e:
+                logger.warning("Can't hash %s: %s", path, e)
+                continue
+            stats[os.fspath(path)] = (path, stat.st_size, stat.st_mtime_ns)
+
+        hashes: Dict[Path, str] = {}
+        with self._lock:
+            for batch in chunks(list(stats), _LOOKUP_BATCH_SIZE):
+                rows = self.connection.execute(
+                    "SELECT path, size, mtime_ns, sha256 FROM file_hashes "
+                    f"WHERE path IN ({', '.join('?' * len(batch))})",
+                    batch,
+                )
+                for key, size, mtime_ns, sha256 in rows:
+                    path, current_size, current_mtime_ns = stats[key]
+                    if (size, mtime_ns) == (current_size, current_mtime_ns):
+                        hashes[path] = sha256
+
+        missing = [key for key, (path, _, _) in stats.items() if path not in hashes]
+        batches = list(chunks([stats[e][0] for e in missing], _FILES_PER_TASK))
+        if executor is None:
+            results = map(_hash_files, batches)
+        else:
+            results = executor.map(_hash_files, batches)
+        computed = [e for batch in results for e in batch]
+
+        rows = []
+        for key, sha256 in zip(missing, computed):
+            if sha256 is None:
+                continue
+            path, size, mtime_ns = stats[key]
+            hashes[path] = sha256
+            rows.append((key, size, mtime_ns, sha256))
+
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO file_hashes(path, size, mtime_ns, sha256) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.hits += len(stats) - len(missing)
+            self.misses += len(missing)
+        return hashes
+
+    def clear(self) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM file_hashes")
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
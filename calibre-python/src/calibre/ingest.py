@@ -0,0 +1,328 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import Executor
+from enum import Enum
+from pathlib import Path
+from typing import (
+    Callable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from pydantic import BaseModel
+
+from calibre.calibre_library import CalibreLibrary
+from calibre.epub import InvalidEpubError, read_epub_metadata
+from calibre.hashing import HashCache, chunks, hash_file, process_pool
+from calibre.objects import CalibreField
+from calibre.search_params import SearchParams
+from calibre.write_queue import WriteJob, WriteQueue
+
+logger = logging.getLogger(__name__)
+
+# Extensions of the files calibre can add to a library
+EBOOK_EXTENSIONS = {
+    ".azw",
+    ".azw3",
+    ".azw4",
+    ".cbr",
+    ".cbz",
+    ".chm",
+    ".djvu",
+    ".docx",
+    ".epub",
+    ".fb2",
+    ".htmlz",
+    ".kepub",
+    ".lit",
+    ".lrf",
+    ".mobi",
+    ".odt",
+    ".pdb",
+    ".pdf",
+    ".prc",
+    ".rtf",
+    ".txt",
+    ".txtz",
+}
+# Formats stored in a zip archive, checked to be readable ones
+_ZIP_EXTENSIONS = {".cbz", ".docx", ".epub", ".htmlz", ".kepub", ".odt", ".txtz"}
+# Formats whose metadata are checked to be readable
+_EPUB_EXTENSIONS = {".epub", ".kepub"}
+
+# Files checked by each task sent to the process pool
+_CHECK_CHUNK_SIZE = 16
+# Error messages kept in the progress of an import
+_MAX_ERRORS = 50
+# Minimum seconds between two writes of the progress file
+_PROGRESS_SAVE_INTERVAL = 0.5
+
+
+class FileCheck(NamedTuple):
+    path: Path
+    sha256: Optional[str] = None
+    # Why the file can't be added, None when it can
+    error: Optional[str] = None
+
+
+def check_file(path: Path) -> FileCheck:
+    """Check that a file looks like an ebook calibre can add, and hash it."""
+    extension = path.suffix.lower()
+    if extension not in EBOOK_EXTENSIONS:
+        return FileCheck(path, error=f"Format not supported: {extension or path.name}")
+    try:
+        if path.stat().st_size == 0:
+            return FileCheck(path, error="Empty file")
+        if extension in _ZIP_EXTENSIONS and not zipfile.is_zipfile(path):
+            return FileCheck(path, error=f"Not a valid {extension[1:]} file")
+        if extension in _EPUB_EXTENSIONS:
+            read_epub_metadata(path)
+        if extension == ".pdf":
+            with open(path, "rb") as f:
+                if not f.read(1024).lstrip().startswith(b"%PDF-"):
+                    return FileCheck(path, error="Not a valid pdf file")
+        return FileCheck(path, sha256=hash_file(path))
+    except InvalidEpubError:
+        return FileCheck(path, error=f"Not a valid {extension[1:]} file")
+    except OSError as e:
+        return FileCheck(path, error=str(e))
+
+
+def _check_files(paths: List[Path]) -> List[FileCheck]:
+    return [check_file(e) for e in paths]
+
+
+def library_hashes(
+    library: CalibreLibrary, executor: Optional[Executor] = None
+) -> Set[str]:
+    """Hashes of all the format files of a library.
+
+    They are kept in the cache directory of the library, so that only the files
+    added or modified since the last call are hashed.
+    """
+    paths = [
+        path
+        for book in library.iter_books(
+            params=SearchParams(fields=[CalibreField.formats])
+        )
+        for path in book.formats or []
+    ]
+    hash_cache = HashCache(library.cache_dir / "hashes.db")
+    try:
+        return set(hash_cache.hash_files(paths, executor=executor).values())
+    finally:
+        hash_cache.close()
+
+
+class ImportStatus(str, Enum):
+    checking = "checking"
+    adding = "adding"
+    done = "done"
+    failed = "failed"
+
+
+class ImportProgress(BaseModel):
+    id: str
+    status: ImportStatus = ImportStatus.checking
+    total: int = 0
+    checked: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    # Files handed to calibredb, then added to the library or not
+    queued: int = 0
+    added: int = 0
+    failed: int = 0
+    errors: List[str] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (ImportStatus.done, ImportStatus.failed)
+
+    def save(self, path: Path) -> None:
+        """Write the progress to `path` at once, so that other processes reading it
+        never see a partial file."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.model_dump_json())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ImportProgress"]:
+        try:
+            return cls.model_validate_json(path.read_text())
+        except FileNotFoundError:
+            return None
+
+
+class BulkImport:
+    """Add many files to a library without blocking the caller.
+
+    The files are checked and hashed in a pool of `workers` processes, all of them
+    by default. Those that are not ebooks, or whose content is already in the
+    library or earlier in the import, are skipped. The others are handed to
+    `write_queue` by chunks of `chunk_size` files, so that a few calibredb
+    invocations add them all.
+
+    `progress` tells where the import is at. With `progress_dir`, the progress is
+    also saved to the file `<id>.json` in it, e.g. for other processes to show it.
+    """
+
+    def __init__(
+        self,
+        paths: Iterable[Path],
+        write_queue: WriteQueue,
+        library: CalibreLibrary,
+        workers: Optional[int] = None,
+        chunk_size: int = 50,
+        progress_dir: Optional[Path] = None,
+        on_finished: Optional[Callable[["BulkImport"], None]] = None,
+    ):
+        self.paths = list(paths)
+        self.write_queue = write_queue
+        self.library = library
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.on_finished = on_finished
+
+        self.id = uuid.uuid4().hex
+        self.progress_path = (
+            None if progress_dir is None else progress_dir / f"{self.id}.json"
+        )
+        self._progress = ImportProgress(id=self.id, total=len(self.paths))
+        self._saved_at = 0.0
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name=f"import-{self.id[:8]}", daemon=True
+        )
+
+    def start(self) -> "BulkImport":
+        self._save_progress(force=True)
+        self._thread.start()
+        return self
+
+    def progress(self) -> ImportProgress:
+        with self._lock:
+            return self._progress.model_copy(deep=True)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout=timeout)
+
+    def _executor(self) -> Optional[Executor]:
+        if self.workers == 0:
+            return None
+        return process_pool(max_workers=self.workers)
+
+    def _run(self) -> None:
+        try:
+            executor = self._executor()
+            try:
+                checks = self._check(executor)
+                known_hashes = library_hashes(self.library, executor)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+            for nb_files, job in self._queue(checks, known_hashes):
+                self._on_added(job, nb_files)
+            self._update(status=ImportStatus.done)
+        except Exception as e:
+            logger.exception("Import %s failed", self.id)
+            self._update(status=ImportStatus.failed, error=f"Import failed: {e}")
+        finally:
+            self._save_progress(force=True)
+            if self.on_finished is not None:
+                self.on_finished(self)
+            self._finished.set()
+
+    def _check(self, executor: Optional[Executor]) -> List[FileCheck]:
+        batches = list(chunks(self.paths, _CHECK_CHUNK_SIZE))
+        results = (
+            executor.map(_check_files, batches)
+            if executor
+            else map(_check_files, batches)
+        )
+
+        checks = []
+        for chunk in results:
+            checks.extend(chunk)
+            with self._lock:
+                self._progress.checked += len(chunk)
+                for check in chunk:
+                    if check.error is not None:
+                        self._progress.invalid += 1
+                        self._add_error(f"{check.path.name}: {check.error}")
+            self._save_progress()
+        return checks
+
+    def _queue(
+        self, checks: List[FileCheck], known_hashes: Set[str]
+    ) -> List[Tuple[int, WriteJob]]:
+        to_add = []
+        seen = set(known_hashes)
+        for check in checks:
+            if check.error is not None:
+                continue
+            if check.sha256 in seen:
+                with self._lock:
+                    self._progress.duplicates += 1
+                continue
+            seen.add(check.sha256)
+            to_add.append(check.path)
+
+        self._update(status=ImportStatus.adding)
+        jobs = []
+        for chunk in chunks(to_add, self.chunk_size):
+            jobs.append((len(chunk), self.write_queue.add(chunk)))
+            with self._lock:
+                self._progress.queued += len(chunk)
+        self._save_progress(force=True)
+        return jobs
+
+    def _on_added(self, job: WriteJob, nb_files: int) -> None:
+        error = job.future.exception()
+        with self._lock:
+            if error is None:
+                self._progress.added += nb_files
+            else:
+                self._progress.failed += nb_files
+                self._add_error(f"{nb_files} files not added: {error}")
+        self._save_progress()
+
+    def _add_error(self, error: str) -> None:
+        if len(self._progress.errors) < _MAX_ERRORS:
+            self._progress.errors.append(error)
+
+    def _update(self, status: ImportStatus, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._progress.status = status
+            if error is not None:
+                self._add_error(error)
+
+    def _save_progress(self, force: bool = False) -> None:
+        if self.progress_path is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._saved_at < _PROGRESS_SAVE_INTERVAL:
+                return
+            self._saved_at = now
+            progress = self._progress.model_copy(deep=True)
+        try:
+            progress.save(self.progress_path)
+        except OSError as e:
+            logger.warning("Can't save the progress of import %s: %s", self.id, e)
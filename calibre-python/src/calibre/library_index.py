@@ -0,0 +1,380 @@
+import bisect
+import logging
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from calibre.filters import FacetFilter, Filter
+from calibre.objects import (
+    BookMetadata,
+    BookPage,
+    CalibreField,
+    FacetField,
+    FacetValue,
+    InternalCalibreField,
+)
+from calibre.pagination import decode_cursor, encode_cursor
+from calibre.search_params import OrderBy, SearchParams
+
+logger = logging.getLogger(__name__)
+
+# Fields the books can be sorted by, and the facets they can be filtered on
+SORT_FIELDS = (
+    InternalCalibreField.id,
+    InternalCalibreField.title,
+    InternalCalibreField.authors,
+    InternalCalibreField.series,
+    InternalCalibreField.series_index,
+    InternalCalibreField.timestamp,
+)
+FACET_FIELDS = (FacetField.authors, FacetField.series)
+# Sort orders computed when the index is built, the other ones on first use
+_PRECOMPUTED_ORDERS = (InternalCalibreField.authors, InternalCalibreField.timestamp)
+# Matching books sorted by rank rather than found by walking the whole order when
+# they are less than 1 / _SPARSE_RATIO of the library
+_SPARSE_RATIO = 16
+
+
+def _split_authors(authors: Optional[str]) -> List[str]:
+    """Names of the authors, as calibre joins them in the `authors` column."""
+    return authors.split(" & ") if authors else []
+
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    # SQLite sorts NULL before any other value
+    return (0, 0) if value is None else (1, value)
+
+
+class _Order:
+    """Positions of the books in a sort order and the rank of each position."""
+
+    def __init__(self, positions: array):
+        self.positions = positions
+        self._ranks: Optional[array] = None
+
+    @property
+    def ranks(self) -> array:
+        # Only needed to sort a few books, computed on first use
+        if self._ranks is None:
+            ranks = array("l", bytes(self.positions.itemsize * len(self.positions)))
+            for rank, position in enumerate(self.positions):
+                ranks[position] = rank
+            self._ranks = ranks
+        return self._ranks
+
+
+class LibraryIndex:
+    """Columnar in-memory index of the books of a library.
+
+    Books are stored by position, in the order of their ids. Their ids and
+    timestamps are kept in arrays and their authors and series as codes of
+    interned values, each value knowing the positions of its books. The order of
+    the books for a sort field is a permutation of the positions computed once.
+
+    Facet filters are turned into byte masks of the positions of their books,
+    combined with a single AND of big integers, and counted or scanned in C.
+    Books are sorted as CalibreSql sorts them, books without a value first, except
+    that timestamps are compared to the second. Cursors of the pages are only
+    valid for the index.
+
+    The index is immutable, build a new one when the library changes.
+    """
+
+    def __init__(
+        self, books: Iterable[BookMetadata], fields: Sequence[CalibreField] = ()
+    ):
+        """`fields` are the fields the books were read with, searches asking for,
+        filtering or sorting on others are not supported, see `supports`."""
+        start = time.perf_counter()
+        self.books = sorted(books, key=lambda e: e.id)
+        self.fields = frozenset(fields)
+        # Names of the fields having values, ids and titles are always read
+        self._read_fields = {"id", "title", *(e.value for e in fields)}
+        self.size = len(self.books)
+
+        self.ids = array("q", (e.id for e in self.books))
+        self.timestamps = array(
+            "d",
+            (
+                float("nan") if e.timestamp is None else e.timestamp.timestamp()
+                for e in self.books
+            ),
+        )
+
+        # Interned values of each facet, the codes of each book, the positions of
+        # the books of each code and the rank of each code in the sorted values
+        self.values: Dict[FacetField, List[str]] = {}
+        self._codes: Dict[FacetField, Dict[str, int]] = {}
+        self._book_codes: Dict[FacetField, List[Tuple[int, ...]]] = {}
+        self._value_positions: Dict[FacetField, List[array]] = {}
+        self._value_ranks: Dict[FacetField, array] = {}
+        self._all_facets: Dict[FacetField, List[FacetValue]] = {}
+        self._intern(
+            FacetField.authors, (_split_authors(e.authors) for e in self.books)
+        )
+        self._intern(
+            FacetField.series, ([e.series] if e.series else [] for e in self.books)
+        )
+
+        self._orders: Dict[Tuple[InternalCalibreField, bool], _Order] = {}
+        for field in _PRECOMPUTED_ORDERS:
+            for descending in (False, True):
+                self._order(field, descending)
+
+        logger.debug(
+            "Index of %d books built in %.3fs",
+            self.size,
+            time.perf_counter() - start,
+        )
+
+    def _intern(self, field: FacetField, books_values: Iterable[List[str]]) -> None:
+        codes: Dict[str, int] = {}
+        book_codes: List[Tuple[int, ...]] = []
+        positions: List[array] = []
+        for position, values in enumerate(books_values):
+            book = []
+            for value in values:
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+                    positions.append(array("l"))
+                positions[code].append(position)
+                book.append(code)
+            book_codes.append(tuple(book))
+        self.values[field] = values = list(codes)
+        ranks = array("l", bytes(array("l").itemsize * len(values)))
+        for rank, code in enumerate(sorted(range(len(values)), key=values.__getitem__)):
+            ranks[code] = rank
+        self._value_ranks[field] = ranks
+        self._codes[field] = codes
+        self._book_codes[field] = book_codes
+        self._value_positions[field] = positions
+
+    def _sort_value(self, field: InternalCalibreField, position: int) -> Any:
+        """Value of the field of a book, as compared to sort the books."""
+        if field == InternalCalibreField.id:
+            return self.ids[position]
+        if field == InternalCalibreField.timestamp:
+            value = self.timestamps[position]
+            return None if value != value else value
+        return getattr(self.books[position], field.value)
+
+    def _sort_values(self, field: InternalCalibreField) -> List[Any]:
+        """Values of the field of all the books, see `_sort_value`."""
+        if field == InternalCalibreField.id:
+            return list(self.ids)
+        if field == InternalCalibreField.timestamp:
+            return [None if e != e else e for e in self.timestamps]
+        name = field.value
+        return [getattr(e, name) for e in self.books]
+
+    def _order(self, field: InternalCalibreField, descending: bool) -> _Order:
+        """Order of the books for `ORDER BY field [DESC], id`."""
+        order = self._orders.get((field, descending))
+        if order is None:
+            keys = self._sort_values(field)
+            if any(e is None for e in keys):
+                keys = [_sort_key(e) for e in keys]
+            # Positions are sorted by id and the sort is stable, even reversed, so
+            # the books with the same value stay sorted by id
+            positions = sorted(
+                range(self.size), key=keys.__getitem__, reverse=descending
+            )
+            # Dict assignment is atomic, an order computed twice by two threads is
+            # the same
+            order = self._orders[(field, descending)] = _Order(array("l", positions))
+        return order
+
+    def supports(self, params: SearchParams) -> bool:
+        """Whether the search can be run on the index."""
+        return (
+            self.fields.issuperset(params.fields)
+            and all(self._supports_filter(e) for e in params.filters)
+            and len(params.order_by) <= 1
+            and all(
+                e.field in SORT_FIELDS and e.field.value in self._read_fields
+                for e in params.order_by
+            )
+        )
+
+    def supports_facets(self, fields: List[FacetField], filters: List[Filter]) -> bool:
+        """Whether the facets can be counted on the index."""
+        return all(self._supports_facet(e) for e in fields) and all(
+            self._supports_filter(e) for e in filters
+        )
+
+    def _supports_facet(self, field: FacetField) -> bool:
+        return field in FACET_FIELDS and field.value in self._read_fields
+
+    def _supports_filter(self, f: Filter) -> bool:
+        return isinstance(f, FacetFilter) and self._supports_facet(f.field)
+
+    def _mask(self, filters: List[Filter]) -> Optional[bytearray]:
+        """Byte per position, 1 for the books matching all the filters. None when
+        they all match."""
+        mask = None
+        for f in filters:
+            if not self._supports_filter(f):
+                raise ValueError(f"Filter not supported by the index: {f!r}")
+            codes = self._codes[f.field]
+            positions = self._value_positions[f.field]
+            flags = bytearray(self.size)
+            for value in f.values:
+                code = codes.get(value)
+                if code is not None:
+                    for position in positions[code]:
+                        flags[position] = 1
+            if mask is None:
+                mask = flags
+            else:
+                both = int.from_bytes(mask, "little") & int.from_bytes(flags, "little")
+                mask = bytearray(both.to_bytes(self.size, "little"))
+        return mask
+
+    def _matching_positions(self, mask: bytearray) -> List[int]:
+        positions = []
+        position = mask.find(1)
+        while position != -1:
+            positions.append(position)
+            position = mask.find(1, position + 1)
+        return positions
+
+    def count_books(self, filters: List[Filter] = []) -> int:
+        mask = self._mask(filters)
+        return self.size if mask is None else mask.count(1)
+
+    def _rank_after(
+        self, order: _Order, order_by: List[OrderBy], key: List[Any]
+    ) -> int:
+        """Rank of the first book sorted after the sort key of a cursor. The book
+        of the cursor may have been removed since, so its key is looked up."""
+        book_id = key[-1]
+        if not order_by:
+            target: Tuple[Any, ...] = ((1, book_id),)
+            descending = False
+        else:
+            target = (_sort_key(key[0]), book_id)
+            descending = order_by[0].descending
+
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            position = order.positions[middle]
+            if order_by:
+                value = _sort_key(self._sort_value(order_by[0].field, position))
+                if descending:
+                    after = value < target[0] or (
+                        value == target[0] and self.ids[position] > book_id
+                    )
+                else:
+                    after = (value, self.ids[position]) > target
+            else:
+                after = self.ids[position] > book_id
+            if after:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _cursor_key(self, order_by: List[OrderBy], position: int) -> List[Any]:
+        key = [self._sort_value(e.field, position) for e in order_by]
+        return [*key, self.ids[position]]
+
+    def list_page(self, params: SearchParams = SearchParams()) -> BookPage:
+        if not self.supports(params):
+            raise ValueError("Search not supported by the index")
+
+        if params.order_by:
+            order = self._order(params.order_by[0].field, params.order_by[0].descending)
+        else:
+            order = self._order(InternalCalibreField.id, False)
+
+        start = 0
+        if params.cursor is not None:
+            key = decode_cursor(params.cursor, params.order_by)
+            try:
+                start = self._rank_after(order, params.order_by, key)
+            except TypeError as e:
+                # Values of another type, e.g. a cursor made by CalibreSql
+                raise ValueError(f"Invalid cursor : {params.cursor}") from e
+
+        # One more book is looked for to know whether there is a next page
+        end = None if params.limit is None else params.limit + 1
+        mask = self._mask(params.filters)
+        if mask is None:
+            positions = list(
+                order.positions[start : None if end is None else start + end]
+            )
+        elif end is None or mask.count(1) * _SPARSE_RATIO <= self.size:
+            ranks = order.ranks
+            positions = sorted(
+                (e for e in self._matching_positions(mask) if ranks[e] >= start),
+                key=ranks.__getitem__,
+            )[:end]
+        else:
+            # Many books match, the first ones are close in the order
+            positions = []
+            for position in order.positions[start:]:
+                if mask[position]:
+                    positions.append(position)
+                    if len(positions) == end:
+                        break
+
+        next_cursor = None
+        if params.limit is not None and len(positions) > params.limit:
+            positions = positions[: params.limit]
+            next_cursor = encode_cursor(
+                params.order_by, self._cursor_key(params.order_by, positions[-1])
+            )
+        return BookPage(
+            books=[self.books[e] for e in positions], next_cursor=next_cursor
+        )
+
+    def list_books(self, params: SearchParams = SearchParams()) -> List[BookMetadata]:
+        return self.list_page(params=params).books
+
+    def facets(
+        self, fields: List[FacetField] = list(FACET_FIELDS), filters: List[Filter] = []
+    ) -> Dict[FacetField, List[FacetValue]]:
+        mask = self._mask(filters)
+        matching = None if mask is None else self._matching_positions(mask)
+
+        facets = {}
+        for field in fields:
+            if not self._supports_facet(field):
+                raise ValueError(f"Facet not supported by the index: {field}")
+            if matching is None:
+                facets[field] = self._unfiltered_facet(field)
+                continue
+
+            counts: Dict[int, int] = {}
+            book_codes = self._book_codes[field]
+            for position in matching:
+                for code in book_codes[position]:
+                    counts[code] = counts.get(code, 0) + 1
+            values = self.values[field]
+            facets[field] = [
+                FacetValue(value=values[code], count=counts[code])
+                for code in sorted(counts, key=self._value_ranks[field].__getitem__)
+            ]
+        return facets
+
+    def _unfiltered_facet(self, field: FacetField) -> List[FacetValue]:
+        # Shared by the callers, as the results of CalibreSql in its query cache
+        facet = self._all_facets.get(field)
+        if facet is None:
+            values = self.values[field]
+            positions = self._value_positions[field]
+            facet = self._all_facets[field] = [
+                FacetValue(value=values[code], count=len(positions[code]))
+                for code in sorted(
+                    range(len(values)), key=self._value_ranks[field].__getitem__
+                )
+            ]
+        return facet
+
+    def get(self, book_id: int) -> Optional[BookMetadata]:
+        position = bisect.bisect_left(self.ids, book_id)
+        if position < self.size and self.ids[position] == book_id:
+            return self.books[position]
+        return None
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from pydantic import BaseModel
+
+from calibre.metrics import LIBRARY_LOCK_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Bounds of the sleep between two attempts to take a contended lock, in seconds
+_MIN_RETRY_DELAY = 0.001
+_MAX_RETRY_DELAY = 0.05
+
+
+class LibraryLockTimeoutError(TimeoutError):
+    """Raised when a library lock could not be taken in time."""
+
+
+class LibraryLockStats(BaseModel):
+    shared_acquisitions: int = 0
+    exclusive_acquisitions: int = 0
+    # Acquisitions that had to wait for another holder
+    contentions: int = 0
+    timeouts: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    # Current holders in this process
+    readers: int = 0
+    writers: int = 0
+
+
+class _Files(NamedTuple):
+    gate: int
+    data: int
+
+
+class _Hold:
+    def __init__(self, exclusive: bool, files: _Files):
+        self.exclusive = exclusive
+        self.files = files
+        self.depth = 1
+
+
+class LibraryLock:
+    """Reader/writer lock on a library, shared by all the processes of the host.
+
+    Readers (SQL queries) hold a shared lock so that they run concurrently, writers
+    (calibredb commands modifying the library) hold an exclusive one. The lock is
+    made of two `flock` locks on files kept outside of the library:
+
+    - the data lock, shared by the readers or held by a single writer,
+    - the gate lock, that readers only hold while taking the data lock and that
+      writers take first, so that a waiting writer is not starved by new readers.
+
+    A thread holding the lock may take it again, shared inside exclusive included.
+    Upgrading a shared lock to an exclusive one is not supported.
+    """
+
+    _shared: Dict[Path, LibraryLock] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, lock_path: Path, timeout: float = 30.0):
+        self.lock_path = lock_path
+        self.gate_path = lock_path.with_suffix(".gate")
+        self.timeout = timeout
+
+        # Open file descriptors reused between holds, like the connections of a pool
+        self._idle_files: List[_Files] = []
+        self._holds: Dict[int, _Hold] = {}
+        self._stats = LibraryLockStats()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, library_path: Path) -> LibraryLock:
+        """Lock of `library_path` shared by everything using it in this process.
+
+        Other processes find the same lock files, named after the path of the
+        library in the temporary directory.
+        """
+        key = library_path.resolve()
+        with cls._shared_lock:
+            lock = cls._shared.get(key)
+            if lock is None:
+                digest = hashlib.sha1(str(key).encode()).hexdigest()
+                lock_dir = Path(tempfile.gettempdir()) / "colibry" / "locks"
+                lock = cls(lock_path=lock_dir / f"{digest[:16]}.lock")
+                cls._shared[key] = lock
+            return lock
+
+    @contextmanager
+    def shared_lock(self, timeout: Optional[float] = None) -> Iterator[None]:
+        ident = self._acquire(exclusive=False, timeout=timeout)
+        try:
+            yield
+        finally:
+            self._release(ident)
+
+    @contextmanager
+    def exclusive_lock(self, timeout: Optional[float] = None) -> Iterator[None]:
+        ident = self._acquire(exclusive=True, timeout=timeout)
+        try:
+            yield
+        finally:
+            self._release(ident)
+
+    def stats(self) -> LibraryLockStats:
+        with self._lock:
+            holds = list(self._holds.values())
+            return self._stats.model_copy(
+                update={
+                    "readers": sum(1 for e in holds if not e.exclusive),
+                    "writers": sum(1 for e in holds if e.exclusive),
+                }
+            )
+
+    def close(self) -> None:
+        """Close the idle lock files, the held ones are closed when released."""
+        with self._lock:
+            for files in self._idle_files:
+                os.close(files.gate)
+                os.close(files.data)
+            self._idle_files = []
+
+    def _acquire(self, exclusive: bool, timeout: Optional[float]) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            hold = self._holds.get(ident)
+            if hold is not None:
+                if exclusive and not hold.exclusive:
+                    raise RuntimeError(
+                        f"Can't upgrade the shared lock {self.lock_path} to exclusive"
+                    )
+                hold.depth += 1
+                return ident
+            files = self._idle_files.pop() if self._idle_files else None
+
+        if files is None:
+            files = self._open_files()
+
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        try:
+            contended = self._lock_files(files, exclusive, start + timeout)
+        except BaseException as e:
+            with self._lock:
+                self._idle_files.append(files)
+                if isinstance(e, LibraryLockTimeoutError):
+                    self._stats.timeouts += 1
+            raise
+        wait = time.monotonic() - start
+        LIBRARY_LOCK_WAIT_SECONDS.observe(
+            wait, ("exclusive" if exclusive else "shared",)
+        )
+
+        with self._lock:
+            self._holds[ident] = _Hold(exclusive=exclusive, files=files)
+            if exclusive:
+                self._stats.exclusive_acquisitions += 1
+            else:
+                self._stats.shared_acquisitions += 1
+            if contended:
+                self._stats.contentions += 1
+                self._stats.wait_seconds += wait
+                self._stats.max_wait_seconds = max(self._stats.max_wait_seconds, wait)
+        if contended:
+            logger.debug(
+                "Waited %.3fs for the %s lock %s",
+                wait,
+                "exclusive" if exclusive else "shared",
+                self.lock_path,
+            )
+        return ident
+
+    def _release(self, ident: int) -> None:
+        with self._lock:
+            hold = self._holds[ident]
+            hold.depth -= 1
+            if hold.depth > 0:
+                return
+            del self._holds[ident]
+
+        fcntl.flock(hold.files.data, fcntl.LOCK_UN)
+        if hold.exclusive:
+            fcntl.flock(hold.files.gate, fcntl.LOCK_UN)
+        with self._lock:
+            self._idle_files.append(hold.files)
+
+    def _open_files(self) -> _Files:
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        gate = os.open(self.gate_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            data = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        except BaseException:
+            os.close(gate)
+            raise
+        return _Files(gate=gate, data=data)
+
+    def _lock_files(self, files: _Files, exclusive: bool, deadline: float) -> bool:
+        """Take the gate then the data lock. Returns whether it had to wait."""
+        if exclusive:
+            contended = self._flock(files.gate, fcntl.LOCK_EX, deadline)
+            try:
+                contended |= self._flock(files.data, fcntl.LOCK_EX, deadline)
+            except BaseException:
+                fcntl.flock(files.gate, fcntl.LOCK_UN)
+                raise
+            return contended
+
+        contended = self._flock(files.gate, fcntl.LOCK_SH, deadline)
+        try:
+            contended |= self._flock(files.data, fcntl.LOCK_SH, deadline)
+        finally:
+            fcntl.flock(files.gate, fcntl.LOCK_UN)
+        return contended
+
+    def _flock(self, fd: int, operation: int, deadline: float) -> bool:
+        """`flock` with a deadline. Returns whether it had to wait."""
+        delay = _MIN_RETRY_DELAY
+        contended = False
+        while True:
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                return contended
+            except BlockingIOError:
+                pass
+            contended = True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LibraryLockTimeoutError(
+                    f"Lock {self.lock_path} still held by another process "
+                    f"or thread after the timeout"
+                )
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, _MAX_RETRY_DELAY)
@@ -0,0 +1,285 @@
+"""Timing instrumentation of the hot paths of the package.
+
+The instruments below are updated by the library code (SQL queries, conversion of
+their rows, files checked on disk, calibredb commands, waits for the library
+lock) and are rendered in the Prometheus text format by `REGISTRY.render()`.
+Metrics are kept per process: with several gunicorn workers, each one exposes its
+own, as Prometheus expects.
+"""
+
+import bisect
+import math
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+# Upper bounds of the buckets of the histograms, in seconds
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _check_labels(self, labels: Tuple[str, ...]) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects the labels {self.labelnames}, got {labels}"
+            )
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+            *self._samples(),
+        ]
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, labels: Tuple[str, ...] = ()) -> None:
+        with self._lock:
+            value = self._values.get(labels)
+            if value is None:
+                self._check_labels(labels)
+                value = 0
+            self._values[labels] = value + amount
+
+    def value(self, labels: Tuple[str, ...] = ()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+            for labels, v in values
+        ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self, nb_buckets: int):
+        # Observations per bucket, not cumulated, the last one being +Inf
+        self.buckets = [0] * (nb_buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], _HistogramValue] = {}
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._values.get(labels)
+            if histogram is None:
+                self._check_labels(labels)
+                histogram = self._values[labels] = _HistogramValue(len(self.buckets))
+            histogram.buckets[index] += 1
+            histogram.count += 1
+            histogram.sum += value
+
+    def time(self, labels: Tuple[str, ...] = ()) -> "_Timer":
+        """Context manager observing the duration of its block, even when it
+        raises."""
+        return _Timer(self, labels)
+
+    def count(self, labels: Tuple[str, ...] = ()) -> int:
+        with self._lock:
+            histogram = self._values.get(labels)
+            return 0 if histogram is None else histogram.count
+
+    def sum(self, labels: Tuple[str, ...] = ()) -> float:
+        with self._lock:
+            histogram = self._values.get(labels)
+            return 0.0 if histogram is None else histogram.sum
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(
+                (labels, list(e.buckets), e.count, e.sum)
+                for labels, e in self._values.items()
+            )
+        names = (*self.labelnames, "le")
+        samples = []
+        for labels, buckets, count, total in values:
+            cumulated = 0
+            for bound, observations in zip((*self.buckets, math.inf), buckets):
+                cumulated += observations
+                bucket_labels = _format_labels(names, (*labels, _format_value(bound)))
+                samples.append(f"{self.name}_bucket{bucket_labels} {cumulated}")
+            labels_text = _format_labels(self.labelnames, labels)
+            samples.append(f"{self.name}_sum{labels_text} {_format_value(total)}")
+            samples.append(f"{self.name}_count{labels_text} {count}")
+        return samples
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class _Timer:
+    """Cheaper than a generator based context manager, it is used on every query."""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or (
+                    existing.labelnames != metric.labelnames
+                ):
+                    raise ValueError(f"Metric {metric.name} already registered")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        """Counter `name`, created on first call and shared by the next ones."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Histogram `name`, created on first call and shared by the next ones."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """All the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda e: e.name)
+        return "".join(f"{line}\n" for e in metrics for line in e.render())
+
+    def reset(self) -> None:
+        """Forget the observations, e.g. between two tests or benchmark runs."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+
+REGISTRY = MetricsRegistry()
+
+SQL_QUERY_SECONDS = REGISTRY.histogram(
+    "colibry_sql_query_seconds",
+    "Time spent executing SQL queries on the library and fetching their rows.",
+    ["query"],
+)
+SQL_ROWS = REGISTRY.counter(
+    "colibry_sql_rows_total", "Rows of books fetched from the library.", ["query"]
+)
+MATERIALIZATION_SECONDS = REGISTRY.histogram(
+    "colibry_materialization_seconds",
+    "Time spent turning rows into BookRecord (records) and then into BookMetadata "
+    "(models).",
+    ["stage"],
+)
+FILESYSTEM_PROBES = REGISTRY.counter(
+    "colibry_filesystem_probes_total",
+    "Files checked to exist on disk while reading books with verify_files.",
+    ["file"],
+)
+CALIBREDB_SECONDS = REGISTRY.histogram(
+    "colibry_calibredb_seconds",
+    "Duration of the calibredb subprocesses, lock wait excluded.",
+    ["command", "status"],
+)
+LIBRARY_LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "colibry_library_lock_wait_seconds",
+    "Time waited to take the library lock.",
+    ["mode"],
+    buckets=(0.00001, 0.0001, *DEFAULT_BUCKETS),
+)
+SNAPSHOT_COPY_SECONDS = REGISTRY.histogram(
+    "colibry_snapshot_copy_seconds",
+    "Time spent copying the library into the snapshot the reads are served from.",
+    ["status"],
+)
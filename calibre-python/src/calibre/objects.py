@@ -1,5 +1,5 @@
-from pydantic import BaseModel, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Json
+from typing import List, Optional, Tuple
 from pathlib import Path
 from datetime import datetime
 from enum import Enum
@@ -28,14 +28,87 @@ class BookMetadata(BaseModel):
     model_config = ConfigDict(extra="allow")
 
 
+class BookRecord:
+    """Lightweight equivalent of BookMetadata built straight from database rows,
+    without any validation. Use `to_book_metadata` to get the pydantic model.
+
+    Unlike in BookMetadata, the cover and the formats are plain `str` paths.
+    """
+
+    __slots__ = (
+        "id",
+        "title",
+        "authors",
+        "cover",
+        "languages",
+        "formats",
+        "series",
+        "series_index",
+        "timestamp",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        title: str,
+        authors: Optional[str] = None,
+        cover: Optional[str] = None,
+        languages: Optional[List[str]] = None,
+        formats: Optional[List[str]] = None,
+        series: Optional[str] = None,
+        series_index: Optional[float] = None,
+        timestamp: Optional[datetime] = None,
+    ):
+        self.id = id
+        self.title = title
+        self.authors = authors
+        self.cover = cover
+        self.languages = languages
+        self.formats = formats
+        self.series = series
+        self.series_index = series_index
+        self.timestamp = timestamp
+
+    def __repr__(self) -> str:
+        return f"BookRecord(id={self.id!r}, title={self.title!r})"
+
+    def to_book_metadata(self) -> BookMetadata:
+        # The values come from the database and are already of the right types,
+        # except for the paths
+        return BookMetadata.model_construct(
+            id=self.id,
+            title=self.title,
+            authors=self.authors,
+            cover=None if self.cover is None else Path(self.cover),
+            languages=self.languages,
+            formats=None if self.formats is None else [Path(e) for e in self.formats],
+            series=self.series,
+            series_index=self.series_index,
+            timestamp=self.timestamp,
+        )
+
+
+class BookPage(BaseModel):
+    """A page of search results and the cursor to fetch the next one."""
+
+    books: List[BookMetadata] = []
+    next_cursor: Optional[str] = None
+
+
 class InternalCalibreField(str, Enum):
     id = "id"
     title = "title"
     path = "path"
     authors = "authors"
+    author_sort = "author_sort"
     formats = "formats"
     series = "series"
     series_index = "series_index"
+    tags = "tags"
+    timestamp = "timestamp"
+    # Not part of the meta view, see CalibreSql
+    has_cover = "has_cover"
+    format_files = "format_files"
 
 
 class InternalBookMetadata(BaseModel):
@@ -47,3 +120,31 @@ class InternalBookMetadata(BaseModel):
     series: Optional[str] = None
     series_index: Optional[float] = None
     timestamp: Optional[datetime] = None
+    has_cover: Optional[bool] = None
+    # (format, file name without extension) of each file of the book
+    format_files: Optional[Json[List[Tuple[str, str]]]] = None
+
+
+class FacetField(str, Enum):
+    authors = "authors"
+    series = "series"
+    tags = "tags"
+    languages = "languages"
+
+
+class FacetValue(BaseModel):
+    """A distinct value of a facet and the number of books having it."""
+
+    value: str
+    count: int
+
+
+class LibraryChanges(BaseModel):
+    """Books added, modified or deleted since a checkpoint of the library."""
+
+    checkpoint: Optional[str] = None
+    updated: List[BookMetadata] = []
+    deleted_ids: List[int] = []
+
+    def is_empty(self) -> bool:
+        return not self.updated and not self.deleted_ids
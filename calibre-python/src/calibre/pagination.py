@@ -0,0 +1,75 @@
+import base64
+import json
+from typing import Any, List
+
+from calibre.filters.filter import SqlExpression
+from calibre.search_params import OrderBy
+
+
+def _order_signature(order_by: List[OrderBy]) -> List[List[Any]]:
+    return [[e.field.value, e.descending] for e in order_by]
+
+
+def encode_cursor(order_by: List[OrderBy], key: List[Any]) -> str:
+    """Build the opaque cursor pointing after the row whose sort key is `key`.
+
+    The key is the value of each `order_by` field followed by the id of the book.
+    """
+    payload = {"o": _order_signature(order_by), "k": key}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str, order_by: List[OrderBy]) -> List[Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        order_signature, key = payload["o"], payload["k"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid cursor : {cursor}") from e
+
+    if order_signature != _order_signature(order_by) or len(key) != len(order_by) + 1:
+        raise ValueError("Cursor does not match the order of the search")
+
+    return key
+
+
+def keyset_sql_filter(order_by: List[OrderBy], key: List[Any]) -> SqlExpression:
+    """SQL expression selecting the rows sorted after `key` by `ORDER BY order_by, id`.
+
+    SQLite sorts NULL before any other value, so they come first in ascending
+    order and last in descending order.
+    """
+    columns = [(e.field.value, e.descending) for e in order_by] + [("id", False)]
+
+    conditions = []
+    args: List[Any] = []
+    for idx, (column, descending) in enumerate(columns):
+        value = key[idx]
+        if value is None:
+            if descending:
+                # Nothing is sorted after NULL
+                continue
+            after, after_args = f"{column} IS NOT NULL", []
+        elif descending:
+            after, after_args = f"({column} < ? OR {column} IS NULL)", [value]
+        else:
+            after, after_args = f"{column} > ?", [value]
+
+        condition = []
+        condition_args: List[Any] = []
+        for previous_column, previous_value in zip(
+            [e[0] for e in columns[:idx]], key[:idx]
+        ):
+            if previous_value is None:
+                condition.append(f"{previous_column} IS NULL")
+            else:
+                condition.append(f"{previous_column} = ?")
+                condition_args.append(previous_value)
+        condition.append(after)
+        condition_args.extend(after_args)
+
+        conditions.append(" AND ".join(condition))
+        args.extend(condition_args)
+
+    if not conditions:
+        return "0", []
+    return " OR ".join(f"({e})" for e in conditions), args
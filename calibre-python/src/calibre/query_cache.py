@@ -0,0 +1,134 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from enum import Enum
+from pathlib import PurePath
+from typing import Any, Callable, Hashable, Optional, Tuple, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+# Number of elements of a long list whose size is measured to estimate its size
+_SAMPLE_SIZE = 64
+
+
+class QueryCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+
+def query_key(*parts: Any) -> str:
+    """Canonical hash of the parameters of a query.
+
+    The repr of pydantic models contains the class and the fields of the actual
+    subclasses, e.g. of each filter of SearchParams, so two equal searches always
+    get the same key.
+    """
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def estimate_size(value: Any) -> int:
+    """Rough estimate of the memory held by `value` and the objects it contains."""
+    if value is None or isinstance(value, (bool, int, float, Enum)):
+        return sys.getsizeof(value)
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, PurePath):
+        return sys.getsizeof(value) + sys.getsizeof(str(value))
+    if isinstance(value, BaseModel):
+        return sys.getsizeof(value) + estimate_size(value.__dict__)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)) and len(value) > _SAMPLE_SIZE:
+        # Results are lists of similar books, a sample of them is enough
+        step = len(value) // _SAMPLE_SIZE
+        sample = value[::step][:_SAMPLE_SIZE]
+        sample_size = sum(estimate_size(e) for e in sample)
+        return sys.getsizeof(value) + sample_size * len(value) // len(sample)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(e) for e in value)
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """LRU cache of query results for one version of a library.
+
+    Every lookup gives the current version of the library (e.g. `PRAGMA
+    data_version`), the whole cache is dropped as soon as it changes. The cache is
+    bounded both in number of entries and in estimated memory size. Cached values
+    are shared between the callers and must not be modified.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries: OrderedDict[Hashable, Tuple[Any, int]] = OrderedDict()
+        self._version: Optional[Hashable] = None
+        self._size_bytes = 0
+        self._stats = QueryCacheStats()
+        self._lock = threading.Lock()
+
+    def get_or_compute(
+        self, key: Hashable, version: Hashable, compute: Callable[[], T]
+    ) -> T:
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return entry[0]
+            self._stats.misses += 1
+
+        value = compute()
+
+        size = estimate_size(value)
+        with self._lock:
+            # The library may have changed while computing the value
+            if version == self._version and size <= self.max_bytes:
+                self._put(key, value, size)
+        return value
+
+    def _check_version(self, version: Hashable) -> None:
+        if version != self._version:
+            if self._entries:
+                self._stats.invalidations += 1
+            self._clear()
+            self._version = version
+
+    def _put(self, key: Hashable, value: Any, size: int) -> None:
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size_bytes -= previous[1]
+        self._entries[key] = (value, size)
+        self._size_bytes += size
+
+        while (
+            len(self._entries) > self.max_entries or self._size_bytes > self.max_bytes
+        ):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size_bytes -= evicted_size
+            self._stats.evictions += 1
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._size_bytes = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> QueryCacheStats:
+        with self._lock:
+            return self._stats.model_copy(
+                update={"entries": len(self._entries), "size_bytes": self._size_bytes}
+            )
@@ -0,0 +1,215 @@
+"""Log of the SQL statements run by CalibreSql, to find out why a search is slow.
+
+Profile a search of a library, with the query plan of every statement:
+
+    python -m calibre.query_log profile LIBRARY --author "Victor Hugo" --threshold 0
+
+Print a log dumped by the dashboard on /query-log, slowest statements first:
+
+    python -m calibre.query_log show query-log.json --sort duration
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Deque, List, Optional, Sequence
+
+from pydantic import BaseModel, TypeAdapter
+
+
+class QueryLogEntry(BaseModel):
+    timestamp: datetime
+    # Kind of statement, as in the colibry_sql_query_seconds metric
+    query: str
+    sql: str
+    parameters: List[Any]
+    duration_seconds: float
+    rows: int
+    # EXPLAIN QUERY PLAN of the statements slower than the threshold of the log,
+    # one line per step indented by depth as in the sqlite3 shell
+    plan: Optional[List[str]] = None
+
+
+def _parameter(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return value
+
+
+def explain_query_plan(
+    connection: sqlite3.Connection, sql: str, parameters: Sequence[Any] = ()
+) -> List[str]:
+    """Query plan chosen by SQLite for a statement, as lines indented by depth."""
+    steps = connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    depths = {0: -1}
+    lines = []
+    for step_id, parent, _, detail in steps:
+        depth = depths.get(parent, -1) + 1
+        depths[step_id] = depth
+        lines.append(f"{'  ' * depth}{detail}")
+    return lines
+
+
+class QueryLog:
+    """Ring buffer of the last `max_entries` statements run by a CalibreSql.
+
+    The query plan of the statements that took at least `slow_threshold` seconds
+    is captured right after them, on the same connection, so that it is the plan
+    SQLite just used. It costs another query, 0 captures it for every statement.
+    """
+
+    def __init__(self, max_entries: int = 500, slow_threshold: float = 0.1):
+        self.max_entries = max_entries
+        self.slow_threshold = slow_threshold
+        self._entries: Deque[QueryLogEntry] = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        connection: sqlite3.Connection,
+        query: str,
+        sql: str,
+        parameters: Sequence[Any],
+        duration: float,
+        rows: int,
+    ) -> QueryLogEntry:
+        plan = None
+        if duration >= self.slow_threshold:
+            plan = explain_query_plan(connection, sql, parameters)
+        entry = QueryLogEntry(
+            timestamp=datetime.now(timezone.utc),
+            query=query,
+            sql=sql,
+            parameters=[_parameter(e) for e in parameters],
+            duration_seconds=duration,
+            rows=rows,
+            plan=plan,
+        )
+        with self._lock:
+            self._entries.append(entry)
+        return entry
+
+    def entries(self, slow_only: bool = False) -> List[QueryLogEntry]:
+        """Statements of the log, oldest first."""
+        with self._lock:
+            entries = list(self._entries)
+        if slow_only:
+            entries = [e for e in entries if e.duration_seconds >= self.slow_threshold]
+        return entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def dump(self, slow_only: bool = False) -> str:
+        """Statements of the log as a JSON array, see `load`."""
+        entries = self.entries(slow_only=slow_only)
+        return _ENTRIES_ADAPTER.dump_json(entries, indent=2).decode()
+
+    @staticmethod
+    def load(text: str) -> List[QueryLogEntry]:
+        return _ENTRIES_ADAPTER.validate_json(text)
+
+
+_ENTRIES_ADAPTER = TypeAdapter(List[QueryLogEntry])
+
+
+def format_entry(entry: QueryLogEntry) -> str:
+    lines = [
+        f"-- {entry.query}: {entry.duration_seconds * 1000:.2f} ms, {entry.rows} rows "
+        f"({entry.timestamp.isoformat()})",
+        entry.sql,
+        f"-- parameters: {json.dumps(entry.parameters, default=str)}",
+    ]
+    lines.extend(f"-- plan: {e}" for e in entry.plan or [])
+    return "\n".join(lines)
+
+
+def _profile(args: argparse.Namespace) -> List[QueryLogEntry]:
+    from calibre.calibre_sql import CalibreSql
+    from calibre.filters import FacetFilter, FullTextFilter
+    from calibre.objects import CalibreField, FacetField, InternalCalibreField
+    from calibre.query_cache import QueryCache
+    from calibre.search_params import OrderBy, SearchParams
+
+    filters = []
+    if args.author:
+        filters.append(FacetFilter(field=FacetField.authors, values=args.author))
+    if args.series:
+        filters.append(FacetFilter(field=FacetField.series, values=args.series))
+    if args.text:
+        filters.append(FullTextFilter(query=args.text))
+    params = SearchParams(
+        fields=list(CalibreField),
+        filters=filters,
+        order_by=[
+            OrderBy(
+                field=InternalCalibreField(args.sort.lstrip("-")),
+                descending=args.sort.startswith("-"),
+            )
+        ],
+        limit=args.limit,
+    )
+
+    query_log = QueryLog(slow_threshold=args.threshold)
+    with CalibreSql(
+        args.library_path,
+        query_cache=QueryCache(max_entries=0),
+        query_log=query_log,
+    ) as library:
+        # What the home page of the dashboard runs for a search
+        library.list_page(params=params)
+        library.count_books(params=params)
+        library.facets(filters=filters)
+    return query_log.entries()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    profile = subparsers.add_parser("profile", help="Log the statements of a search")
+    profile.add_argument("library_path", type=Path)
+    profile.add_argument("--author", action="append")
+    profile.add_argument("--series", action="append")
+    profile.add_argument("--text", help="Full-text search")
+    profile.add_argument(
+        "--sort", default="-timestamp", help="Field to sort by, '-' for descending"
+    )
+    profile.add_argument("--limit", type=int, default=60)
+    profile.add_argument(
+        "--threshold",
+        type=float,
+        default=0.0,
+        help="Seconds above which the query plan is captured",
+    )
+
+    show = subparsers.add_parser("show", help="Print a log dumped as JSON")
+    show.add_argument("path", type=Path, help="Dump of the log, - for stdin")
+    show.add_argument("--sort", choices=["time", "duration"], default="time")
+
+    for subparser in (profile, show):
+        subparser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    if args.command == "profile":
+        entries = _profile(args)
+    else:
+        text = sys.stdin.read() if str(args.path) == "-" else args.path.read_text()
+        entries = QueryLog.load(text)
+        if args.sort == "duration":
+            entries.sort(key=lambda e: e.duration_seconds, reverse=True)
+
+    if args.json:
+        print(_ENTRIES_ADAPTER.dump_json(entries, indent=2).decode())
+    else:
+        print("\n\n".join(format_entry(e) for e in entries))
+
+
+if __name__ == "__main__":
+    main()
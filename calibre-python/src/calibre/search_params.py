@@ -1,9 +1,20 @@
 from pydantic import BaseModel
-from calibre.objects import CalibreField
-from typing import List
+from calibre.objects import CalibreField, InternalCalibreField
+from typing import List, Optional
 from calibre.filters.filter import Filter
 
 
+class OrderBy(BaseModel):
+    field: InternalCalibreField
+    descending: bool = False
+
+
 class SearchParams(BaseModel):
     fields: List[CalibreField] = []
     filters: List[Filter] = []
+    # Books are always sorted by id last so that the order is deterministic
+    order_by: List[OrderBy] = []
+    # Maximum number of books to return, and where to resume a previous search
+    # from with the `next_cursor` of its last page
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
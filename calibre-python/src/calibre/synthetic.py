@@ -0,0 +1,459 @@
+"""Generate realistic calibre libraries of any size, e.g. to benchmark them.
+
+Books, authors, series, tags, languages, publishers and formats are written
+straight into a copy of the bundled empty library, with the skewed distributions
+of real libraries: a few authors wrote many books, a third of the books belong
+to a series, most are EPUBs... Generation is deterministic for a given seed.
+
+    python -m calibre.synthetic /tmp/library --books 100000 [--no-files]
+"""
+
+import argparse
+import base64
+import io
+import itertools
+import logging
+import random
+import shutil
+import sqlite3
+import uuid
+import zipfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EMPTY_LIBRARY = Path(__file__).resolve().parent / "empty_library"
+
+_FIRST_NAMES = (
+    "Adèle Agatha Albert Alexandre Alice Anne Antoine Arthur Boris Camille Charles "
+    "Charlotte Claire Daniel David Edith Élisabeth Émile Ernest Esther Fiona Franz "
+    "George Gustave Hector Helen Henri Isaac Jane Jean Jules Julia Karen Leo Louise "
+    "Marcel Margaret Marie Mary Maurice Nathalie Olga Oscar Paul Philip Pierre Rosa "
+    "Samuel Simone Sophie Stefan Terry Ursula Victor Virginia Walter William Zadie"
+).split()
+_LAST_NAMES = (
+    "Adams Asimov Austen Balzac Barjavel Beauvoir Brontë Camus Christie Colette "
+    "Daudet Dickens Dumas Eliot Éluard Flaubert Gaiman Gide Hugo Ishiguro James "
+    "Jemisin Kafka King Leblanc Lessing London Malot Martin Maupassant Mérimée "
+    "Miller Modiano Morrison Nabokov Orwell Perec Pratchett Proust Queneau Rowling "
+    "Sand Sartre Shelley Simenon Smith Stendhal Stevenson Tolkien Tolstoï Twain "
+    "Verne Vian Voltaire Walker Wells Wilde Woolf Yourcenar Zola"
+).split()
+_ADJECTIVES = (
+    "Blue Broken Burning Dark Distant Emerald Endless Fallen Final Forgotten Golden "
+    "Hidden Hollow Last Little Lost Midnight Northern Old Pale Quiet Red Silent "
+    "Silver Small Strange Sunken Wild Winter Young"
+).split()
+_NOUNS = (
+    "Bridge City Crown Daughter Dream Empire Garden Harbor Heart House Island "
+    "Journey Kingdom Letter Library Machine Memory Mirror Mountain Night Ocean "
+    "Orchard River Road Secret Shadow Sister Sky Storm Stranger Summer Tower Voyage "
+    "War Wind Witness World"
+).split()
+_TAGS = [
+    "Fiction", "Fantasy", "Science Fiction", "Mystery", "Thriller", "Romance",
+    "Horror", "History", "Biography", "Poetry", "Drama", "Classics", "Adventure",
+    "Humor", "Philosophy", "Essays", "Travel", "Children", "Young Adult", "Crime",
+    "Short Stories", "Comics", "Politics", "Science", "Art", "Music", "Cooking",
+    "Religion", "Psychology", "Economics", "War", "Nature", "Memoir", "Satire",
+    "Dystopia", "Historical Fiction", "Detective", "Space Opera", "Magic Realism",
+]  # fmt: skip
+_LANGUAGES = [("eng", 60), ("fra", 25), ("deu", 6), ("spa", 5), ("ita", 4)]
+# Formats of the books and how often a book has each of them, in percent
+_FORMATS = [("EPUB", 90), ("PDF", 25), ("MOBI", 10), ("AZW3", 8)]
+# Share of the books that are part of a series, and that have a cover
+_SERIES_RATE = 0.35
+_COVER_RATE = 0.92
+# Exponent of the Zipf-like distribution of the books among the authors and tags
+_ZIPF_EXPONENT = 1.1
+
+# 2x3 pixels JPEG used as the cover of every book
+_COVER = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9PDkzODdA"
+    "SFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhCY2NjY2NjY2NjY2Nj"
+    "Y2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2P/wAARCAADAAIDASIAAhEBAxEB/8QA"
+    "HwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIh"
+    "MUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVW"
+    "V1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXG"
+    "x8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQF"
+    "BgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAV"
+    "YnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOE"
+    "hYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq"
+    "8vP09fb3+Pn6/9oADAMBAAIRAxEAPwCpRRRXQYn/2Q=="
+)
+
+_CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles><rootfile full-path="content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+_PACKAGE = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="id">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
+<dc:title>{title}</dc:title>
+{creators}
+<dc:language>{language}</dc:language>
+<dc:identifier id="id">urn:uuid:{uuid}</dc:identifier>
+</metadata>
+<manifest><item id="text" href="text.html" media-type="application/xhtml+xml"/></manifest>
+<spine><itemref idref="text"/></spine>
+</package>"""
+
+_SAFE_NAME = str.maketrans({e: "_" for e in '\\/:*?"<>|'})
+
+
+def _xml_escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _zipf_weights(nb_values: int) -> List[float]:
+    """Cumulative weights of a Zipf-like distribution, for `random.choices`."""
+    return list(
+        itertools.accumulate(
+            1 / (rank**_ZIPF_EXPONENT) for rank in range(1, nb_values + 1)
+        )
+    )
+
+
+def _title_sort(title: str) -> str:
+    """Like calibre, leading articles are moved to the end of the title."""
+    for article in ("The ", "A ", "An "):
+        if title.startswith(article):
+            return f"{title[len(article):]}, {article.strip()}"
+    return title
+
+
+class _Book:
+    __slots__ = (
+        "id",
+        "title",
+        "authors",
+        "series",
+        "series_index",
+        "tags",
+        "language",
+        "publisher",
+        "formats",
+        "has_cover",
+        "timestamp",
+        "pubdate",
+        "uuid",
+    )
+
+
+class LibraryGenerator:
+    def __init__(
+        self,
+        nb_books: int,
+        seed: int = 0,
+        nb_authors: Optional[int] = None,
+        nb_publishers: Optional[int] = None,
+    ):
+        self.nb_books = nb_books
+        self.random = random.Random(seed)
+        self.nb_authors = nb_authors or max(1, nb_books // 4)
+        self.nb_publishers = nb_publishers or max(1, min(nb_books // 50, 2000))
+
+    def _unique_names(self, nb_names: int, make) -> List[str]:
+        names: Dict[str, None] = {}
+        while len(names) < nb_names:
+            name = make()
+            if name in names:
+                name = f"{name} {len(names)}"
+            names[name] = None
+        return list(names)
+
+    def _author_name(self) -> str:
+        first = self.random.choice(_FIRST_NAMES)
+        last = self.random.choice(_LAST_NAMES)
+        if self.random.random() < 0.5:
+            return f"{first} {chr(self.random.randrange(65, 91))}. {last}"
+        return f"{first} {last}"
+
+    def _title(self) -> str:
+        r = self.random
+        pattern = r.randrange(5)
+        if pattern == 0:
+            return f"The {r.choice(_ADJECTIVES)} {r.choice(_NOUNS)}"
+        if pattern == 1:
+            return f"{r.choice(_NOUNS)} of the {r.choice(_NOUNS)}"
+        if pattern == 2:
+            return f"A {r.choice(_NOUNS)} in {r.choice(_ADJECTIVES)} {r.choice(_NOUNS)}"
+        if pattern == 3:
+            return f"{r.choice(_ADJECTIVES)} {r.choice(_NOUNS)}"
+        return f"The {r.choice(_NOUNS)}'s {r.choice(_NOUNS)}"
+
+    def books(self) -> Tuple[List[str], List[str], List[str], List[_Book]]:
+        """Authors, series, publishers and books of the library."""
+        r = self.random
+        authors = self._unique_names(self.nb_authors, self._author_name)
+        publishers = self._unique_names(
+            self.nb_publishers,
+            lambda: f"{r.choice(_LAST_NAMES)} {r.choice(['Press', 'Books', 'Éditions', 'Publishing'])}",
+        )
+        author_weights = _zipf_weights(len(authors))
+        tag_weights = _zipf_weights(len(_TAGS))
+        languages, language_weights = zip(*_LANGUAGES)
+
+        series: List[str] = []
+        series_names: Dict[str, None] = {}
+        # Series of each author and the number of books already in each series
+        author_series: Dict[int, List[int]] = {}
+        series_sizes: List[int] = []
+
+        start = datetime(2014, 1, 1, tzinfo=timezone.utc)
+        step = timedelta(days=10 * 365) / max(1, self.nb_books)
+
+        books = []
+        for book_id in range(1, self.nb_books + 1):
+            book = _Book()
+            book.id = book_id
+            book.title = self._title()
+
+            nb_authors = 1 if r.random() < 0.85 else r.choice([2, 2, 3])
+            book_authors = r.choices(
+                range(len(authors)), cum_weights=author_weights, k=nb_authors
+            )
+            book.authors = list(dict.fromkeys(book_authors))
+
+            book.series = None
+            book.series_index = 1.0
+            if r.random() < _SERIES_RATE:
+                own_series = author_series.setdefault(book.authors[0], [])
+                if not own_series or r.random() < 0.2:
+                    name = f"{r.choice(_ADJECTIVES)} {r.choice(_NOUNS)}"
+                    if name in series_names:
+                        name = f"{name} {len(series)}"
+                    series_names[name] = None
+                    series.append(name)
+                    series_sizes.append(0)
+                    own_series.append(len(series) - 1)
+                book.series = r.choice(own_series)
+                series_sizes[book.series] += 1
+                book.series_index = float(series_sizes[book.series])
+
+            book.tags = sorted(
+                set(
+                    r.choices(
+                        range(len(_TAGS)), cum_weights=tag_weights, k=r.randrange(5)
+                    )
+                )
+            )
+            book.language = r.choices(languages, weights=language_weights)[0]
+            book.publisher = r.randrange(len(publishers)) if r.random() < 0.8 else None
+            book.formats = [e for e, rate in _FORMATS if r.randrange(100) < rate]
+            if not book.formats:
+                book.formats = ["EPUB"]
+            book.has_cover = r.random() < _COVER_RATE
+            book.timestamp = (
+                start + step * book_id + timedelta(seconds=r.randrange(3600))
+            )
+            book.pubdate = datetime(
+                r.randrange(1800, 2025), r.randrange(1, 13), 1, tzinfo=timezone.utc
+            )
+            book.uuid = str(uuid.UUID(int=r.getrandbits(128), version=4))
+            books.append(book)
+
+        return authors, series, publishers, books
+
+
+def _author_sort(name: str) -> str:
+    parts = name.split(" ")
+    return f"{parts[-1]}, {' '.join(parts[:-1])}" if len(parts) > 1 else name
+
+
+def _book_path(book: _Book, authors: List[str]) -> Tuple[str, str]:
+    """Folder of the book in the library and name of its files, as calibre does."""
+    author = authors[book.authors[0]].translate(_SAFE_NAME)
+    title = book.title.translate(_SAFE_NAME)
+    return f"{author}/{title} ({book.id})", f"{title} - {author}"
+
+
+def _format_file(book: _Book, authors: List[str], ebook_format: str) -> bytes:
+    if ebook_format != "EPUB":
+        # Not readable ebooks, but files of the right size class and unique content
+        header = b"%PDF-1.4\n" if ebook_format == "PDF" else b"BOOKMOBI"
+        return header + f"{book.uuid} {book.title}\n".encode() * 64
+
+    creators = "\n".join(
+        f'<dc:creator opf:role="aut">{_xml_escape(authors[e])}</dc:creator>'
+        for e in book.authors
+    )
+    package = _PACKAGE.format(
+        title=_xml_escape(book.title),
+        creators=creators,
+        language=book.language,
+        uuid=book.uuid,
+    )
+    content = f"<html><body><h1>{_xml_escape(book.title)}</h1></body></html>"
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        archive.writestr("META-INF/container.xml", _CONTAINER)
+        archive.writestr("content.opf", package, zipfile.ZIP_DEFLATED)
+        archive.writestr("text.html", content, zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def _timestamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f+00:00")
+
+
+def generate_library(
+    library_path: Path,
+    nb_books: int,
+    seed: int = 0,
+    with_files: bool = True,
+    nb_authors: Optional[int] = None,
+) -> Path:
+    """Create a library of `nb_books` random books at `library_path`.
+
+    With `with_files`, the folder of each book is created with its cover and its
+    format files: minimal valid EPUBs and placeholder files for the other formats.
+    Without, only metadata.db is written, which is much faster for big libraries.
+    """
+    if library_path.exists():
+        raise ValueError(f"Library already exists: {library_path}")
+
+    generator = LibraryGenerator(nb_books=nb_books, seed=seed, nb_authors=nb_authors)
+    authors, series, publishers, books = generator.books()
+
+    shutil.copytree(EMPTY_LIBRARY, library_path)
+    connection = sqlite3.connect(library_path / "metadata.db")
+    # Functions called by the triggers of calibre
+    connection.create_function("title_sort", 1, _title_sort, deterministic=True)
+    connection.create_function("uuid4", 0, lambda: str(uuid.uuid4()))
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA journal_mode = MEMORY")
+
+    languages = {code: idx + 1 for idx, (code, _) in enumerate(_LANGUAGES)}
+    paths = [_book_path(e, authors) for e in books]
+    with connection:
+        connection.executemany(
+            "INSERT INTO authors(id, name, sort) VALUES (?, ?, ?)",
+            [(idx + 1, e, _author_sort(e)) for idx, e in enumerate(authors)],
+        )
+        connection.executemany(
+            "INSERT INTO series(id, name, sort) VALUES (?, ?, ?)",
+            [(idx + 1, e, _title_sort(e)) for idx, e in enumerate(series)],
+        )
+        connection.executemany(
+            "INSERT INTO tags(id, name) VALUES (?, ?)",
+            [(idx + 1, e) for idx, e in enumerate(_TAGS)],
+        )
+        connection.executemany(
+            "INSERT INTO publishers(id, name, sort) VALUES (?, ?, ?)",
+            [(idx + 1, e, e) for idx, e in enumerate(publishers)],
+        )
+        connection.executemany(
+            "INSERT INTO languages(id, lang_code) VALUES (?, ?)",
+            [(idx, code) for code, idx in languages.items()],
+        )
+        connection.executemany(
+            "INSERT INTO books(id, title, timestamp, pubdate, series_index, "
+            "author_sort, path, has_cover, last_modified) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    e.id,
+                    e.title,
+                    _timestamp(e.timestamp),
+                    _timestamp(e.pubdate),
+                    e.series_index,
+                    " & ".join(_author_sort(authors[a]) for a in e.authors),
+                    path,
+                    e.has_cover,
+                    _timestamp(e.timestamp),
+                )
+                for e, (path, _) in zip(books, paths)
+            ),
+        )
+        # uuid4() is random, the uuids of the generator are used instead
+        connection.executemany(
+            "UPDATE books SET uuid = ? WHERE id = ?", ((e.uuid, e.id) for e in books)
+        )
+        connection.executemany(
+            "INSERT INTO books_authors_link(book, author) VALUES (?, ?)",
+            ((e.id, a + 1) for e in books for a in e.authors),
+        )
+        connection.executemany(
+            "INSERT INTO books_series_link(book, series) VALUES (?, ?)",
+            ((e.id, e.series + 1) for e in books if e.series is not None),
+        )
+        connection.executemany(
+            "INSERT INTO books_tags_link(book, tag) VALUES (?, ?)",
+            ((e.id, t + 1) for e in books for t in e.tags),
+        )
+        connection.executemany(
+            "INSERT INTO books_languages_link(book, lang_code, item_order) "
+            "VALUES (?, ?, 0)",
+            ((e.id, languages[e.language]) for e in books),
+        )
+        connection.executemany(
+            "INSERT INTO books_publishers_link(book, publisher) VALUES (?, ?)",
+            ((e.id, e.publisher + 1) for e in books if e.publisher is not None),
+        )
+        connection.executemany(
+            "INSERT INTO identifiers(book, type, val) VALUES (?, 'uuid', ?)",
+            ((e.id, e.uuid) for e in books),
+        )
+        connection.executemany(
+            "INSERT INTO comments(book, text) VALUES (?, ?)",
+            (
+                (e.id, f"<p>{e.title}, a novel by {authors[e.authors[0]]}.</p>")
+                for e in books
+            ),
+        )
+        connection.executemany(
+            "INSERT INTO data(book, format, uncompressed_size, name) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                (e.id, f, 0, name)
+                for e, (_, name) in zip(books, paths)
+                for f in e.formats
+            ),
+        )
+    connection.execute("PRAGMA journal_mode = DELETE")
+    connection.close()
+
+    if with_files:
+        for book, (path, name) in zip(books, paths):
+            folder = library_path / path
+            folder.mkdir(parents=True, exist_ok=True)
+            if book.has_cover:
+                (folder / "cover.jpg").write_bytes(_COVER)
+            for ebook_format in book.formats:
+                content = _format_file(book, authors, ebook_format)
+                (folder / f"{name}.{ebook_format.lower()}").write_bytes(content)
+
+    logger.info(
+        "Library of %d books by %d authors generated at %s",
+        nb_books,
+        len(authors),
+        library_path,
+    )
+    return library_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("library_path", type=Path)
+    parser.add_argument("--books", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-files", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    generate_library(
+        args.library_path,
+        nb_books=args.books,
+        seed=args.seed,
+        with_files=not args.no_files,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import itertools
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, wait
+from enum import Enum
+from pathlib import Path
+from typing import Any, Deque, List, Optional
+
+from calibre.calibredb import CalibreDB
+
+logger = logging.getLogger(__name__)
+
+
+class JobKind(str, Enum):
+    add = "add"
+    remove = "remove"
+
+
+class JobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class WriteJob:
+    """A write to the library, completed by the worker of a WriteQueue."""
+
+    def __init__(self, id: int, kind: JobKind, items: List[Any]):
+        self.id = id
+        self.kind = kind
+        # Paths of the ebooks to add or ids of the books to remove
+        self.items = items
+        self.status = JobStatus.pending
+        self.error: Optional[BaseException] = None
+        self.future: Future = Future()
+
+    def __repr__(self) -> str:
+        return (
+            f"WriteJob(id={self.id!r}, kind={self.kind.value!r}, "
+            f"status={self.status.value!r}, items={len(self.items)})"
+        )
+
+
+class WriteQueue:
+    """Serialize the writes to a calibre library on a background worker.
+
+    Consecutive jobs of the same kind waiting in the queue are coalesced into a
+    single calibredb invocation, of at most `max_batch_size` ebooks or ids, which
+    saves the seconds calibredb takes to start. Jobs are never reordered, a remove
+    submitted after an add runs after it. When a coalesced invocation fails, its
+    jobs are run again one by one so that only the faulty ones fail.
+
+    Submitting a job never blocks, wait on `job.future` to get its outcome. Jobs
+    whose future is cancelled before they run are skipped.
+    """
+
+    def __init__(
+        self,
+        library: CalibreDB,
+        max_batch_size: int = 100,
+        max_finished_jobs: int = 1000,
+    ):
+        self.library = library
+        self.max_batch_size = max_batch_size
+        self.max_finished_jobs = max_finished_jobs
+
+        self._ids = itertools.count(1)
+        self._pending: Deque[WriteJob] = deque()
+        # Every job not finished yet and the most recent finished ones, by id
+        self._jobs: OrderedDict[int, WriteJob] = OrderedDict()
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._worker = threading.Thread(
+            target=self._run, name="calibredb-writes", daemon=True
+        )
+        self._worker.start()
+
+    def add(self, ebooks: List[Path]) -> WriteJob:
+        return self._submit(JobKind.add, list(ebooks))
+
+    def remove(self, ids: List[int]) -> WriteJob:
+        return self._submit(JobKind.remove, list(ids))
+
+    def _submit(self, kind: JobKind, items: List[Any]) -> WriteJob:
+        with self._condition:
+            if self._closed:
+                raise ValueError("Write queue closed")
+            job = WriteJob(id=next(self._ids), kind=kind, items=items)
+            self._pending.append(job)
+            self._jobs[job.id] = job
+            self._condition.notify()
+        return job
+
+    def job(self, job_id: int) -> Optional[WriteJob]:
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[WriteJob]:
+        with self._condition:
+            return list(self._jobs.values())
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait for all the jobs submitted so far to be finished."""
+        with self._condition:
+            futures = [e.future for e in self._jobs.values()]
+        _, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def close(self, wait: bool = True) -> None:
+        """Stop accepting jobs. The pending ones are still run."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if wait:
+            self._worker.join()
+
+    def _next_batch(self) -> List[WriteJob]:
+        """Take the jobs at the head of the queue that can run together, those
+        cancelled in the meantime are dropped."""
+        batch: List[WriteJob] = []
+        nb_items = 0
+        while self._pending:
+            job = self._pending[0]
+            if batch and (
+                job.kind != batch[0].kind
+                or nb_items + len(job.items) > self.max_batch_size
+            ):
+                break
+            self._pending.popleft()
+            # Their futures can't be cancelled anymore once running
+            if not job.future.set_running_or_notify_cancel():
+                job.status = JobStatus.cancelled
+                continue
+            job.status = JobStatus.running
+            batch.append(job)
+            nb_items += len(job.items)
+        self._forget_finished_jobs()
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch = self._next_batch()
+            if not batch:
+                continue
+
+            try:
+                self._execute(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._finish(batch[0], error=e)
+                    continue
+                logger.warning(
+                    "Batch of %d %s jobs failed, running them one by one: %s",
+                    len(batch),
+                    batch[0].kind.value,
+                    e,
+                )
+                for job in batch:
+                    try:
+                        self._execute([job])
+                    except Exception as job_error:
+                        self._finish(job, error=job_error)
+                    else:
+                        self._finish(job)
+            else:
+                for job in batch:
+                    self._finish(job)
+
+    def _execute(self, batch: List[WriteJob]) -> None:
+        items = [item for job in batch for item in job.items]
+        if not items:
+            return
+        logger.info(
+            "Running %d %s jobs on %d items",
+            len(batch),
+            batch[0].kind.value,
+            len(items),
+        )
+        if batch[0].kind == JobKind.add:
+            self.library.add(ebooks=items)
+        else:
+            self.library.remove_from_ids(ids=items)
+
+    def _finish(self, job: WriteJob, error: Optional[BaseException] = None) -> None:
+        with self._condition:
+            job.status = JobStatus.failed if error is not None else JobStatus.done
+            job.error = error
+            self._forget_finished_jobs()
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(None)
+
+    def _forget_finished_jobs(self) -> None:
+        finished = [
+            e.id
+            for e in self._jobs.values()
+            if e.status in (JobStatus.done, JobStatus.failed, JobStatus.cancelled)
+        ]
+        for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
@@ -1,6 +1,46 @@
+import threading
 from pytest import fixture
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, Set
+
+from calibre.calibre_library import CalibreLibrary
+from calibre.calibredb import CalibreDB
+from calibre.errors import CalibreRuntimeError
+from calibre.objects import BookMetadata
+
+
+class RecordingCalibreDB(CalibreDB):
+    """Records the calibredb commands instead of running them.
+
+    Commands wait for `release`, set by default, e.g. so that jobs pile up in a
+    write queue behind the first one, and fail when given a file of `failing`.
+    """
+
+    def __init__(self, library_path: Path):
+        super().__init__(library_path=library_path)
+        self.commands: List[List[str]] = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.failing: Set[str] = set()
+
+    def _run_calibredb(self, params: List[str]):
+        self.started.set()
+        self.release.wait(timeout=10)
+        self.commands.append(params)
+        if self.failing.intersection(params):
+            raise CalibreRuntimeError(["calibredb", *params], 1, "", "bad file")
+
+
+class FakeLibrary(CalibreLibrary):
+    """Library made of the books of `books`."""
+
+    def __init__(self, library_path: Path, books: List[BookMetadata]):
+        super().__init__(library_path=library_path, cache_dir=library_path / "cache")
+        self.books = books
+
+    def iter_batches(self, params=None, batch_size=1000) -> Iterator[List]:
+        yield self.books
 
 
 @fixture(scope="session")
@@ -12,3 +52,14 @@ def data_folder() -> Path:
 def ebook_paths(data_folder: Path) -> List[Path]:
     ebooks_dir = data_folder / "ebooks"
     return list(ebooks_dir.glob("*.epub"))
+
+
+@fixture
+def calibredb(tmp_path: Path) -> RecordingCalibreDB:
+    return RecordingCalibreDB(tmp_path)
+
+
+@fixture
+def fake_library(tmp_path: Path) -> FakeLibrary:
+    """Empty library, fill `books` to add some."""
+    return FakeLibrary(tmp_path, [])
@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+from calibre.connection_pool import ConnectionPool, PoolTimeoutError
+
+
+@pytest.fixture
+def database_path(tmp_path: Path) -> Path:
+    path = tmp_path / "metadata.db"
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY)")
+        connection.executemany("INSERT INTO books VALUES (?)", [(1,), (2,), (3,)])
+    connection.close()
+    return path
+
+
+def test_connection_reused(database_path: Path):
+    pool = ConnectionPool(database_path, max_size=2)
+
+    with pool.connection() as connection:
+        pass
+    with pool.connection() as other_connection:
+        assert other_connection is connection
+
+    pool.close()
+
+
+def test_connection_read_only(database_path: Path):
+    pool = ConnectionPool(database_path)
+
+    with pool.connection() as connection:
+        assert connection.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 3
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute("DELETE FROM books")
+
+    pool.close()
+
+
+def test_setup(database_path: Path):
+    pool = ConnectionPool(
+        database_path,
+        setup=lambda e: e.create_function("double", 1, lambda x: 2 * x),
+    )
+
+    with pool.connection() as connection:
+        assert connection.execute("SELECT double(21)").fetchone()[0] == 42
+
+    pool.close()
+
+
+def test_max_size(database_path: Path):
+    pool = ConnectionPool(database_path, max_size=1, timeout=0.1)
+
+    connection = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+
+    pool.release(connection)
+    assert pool.acquire() is connection
+
+    pool.close()
+
+
+def test_concurrent_reads(database_path: Path):
+    pool = ConnectionPool(database_path, max_size=4)
+    results = []
+
+    def read():
+        for _ in range(50):
+            with pool.connection() as connection:
+                results.append(
+                    connection.execute("SELECT SUM(id) FROM books").fetchone()[0]
+                )
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for e in threads:
+        e.start()
+    for e in threads:
+        e.join()
+
+    assert results == [6] * 400
+    pool.close()
+
+
+def test_close(database_path: Path):
+    pool = ConnectionPool(database_path)
+
+    connection = pool.acquire()
+    pool.close()
+    with pytest.raises(ValueError):
+        pool.acquire()
+
+    # Connections in use when the pool is closed are closed once released
+    pool.release(connection)
+    with pytest.raises(sqlite3.ProgrammingError):
+        connection.execute("SELECT 1")
+
+
+def test_shared(database_path: Path):
+    pool = ConnectionPool.shared(database_path)
+    assert ConnectionPool.shared(database_path.parent / "." / "metadata.db") is pool
+
+    pool.close()
+    assert ConnectionPool.shared(database_path) is not pool
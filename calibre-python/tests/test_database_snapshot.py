@@ -0,0 +1,76 @@
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+
+from calibre.calibre_sql import CalibreSql, register_functions
+from calibre.database_snapshot import DatabaseSnapshot
+from calibre.query_cache import QueryCache
+from calibre.search_params import SearchParams
+from calibre.synthetic import generate_library
+
+
+@pytest.fixture
+def library_path(tmp_path: Path) -> Path:
+    return generate_library(tmp_path / "library", 20, seed=2, with_files=False)
+
+
+def _delete_book(library_path: Path, book_id: int) -> None:
+    connection = sqlite3.connect(library_path / "metadata.db")
+    connection.execute("DELETE FROM books WHERE id = ?", [book_id])
+    connection.commit()
+    connection.close()
+
+
+def test_refresh(tmp_path: Path, library_path: Path):
+    snapshot = DatabaseSnapshot(
+        library_path / "metadata.db",
+        snapshot_dir=tmp_path,
+        setup=register_functions,
+        timeout=0.1,
+    )
+    library = CalibreSql(library_path, query_cache=QueryCache(), snapshot=snapshot)
+    assert library.count_books(SearchParams()) == 20
+    version = library.data_version()
+
+    # Changes are only seen once copied
+    _delete_book(library_path, 1)
+    assert library.count_books(SearchParams()) == 20
+    assert library.data_version() == version
+    previous_path = snapshot.path
+    assert snapshot.refresh()
+    assert not snapshot.refresh()
+    assert library.data_version() != version
+    assert library.count_books(SearchParams()) == 19
+    assert not previous_path.exists()
+
+    # Readers never wait for the locks on the library, only the copies do
+    writer = sqlite3.connect(library_path / "metadata.db")
+    writer.execute("BEGIN EXCLUSIVE")
+    with pytest.raises(sqlite3.OperationalError):
+        snapshot.refresh(force=True)
+    assert len(library.list_books(SearchParams())) == 19
+    writer.rollback()
+    writer.close()
+
+    path = snapshot.path
+    snapshot.close()
+    assert not path.exists()
+    library.close()
+    library.pool.close()
+
+
+def test_background_refresh(tmp_path: Path, library_path: Path):
+    with DatabaseSnapshot(
+        library_path / "metadata.db", snapshot_dir=tmp_path
+    ) as snapshot:
+        snapshot.start(interval=0.01)
+        _delete_book(library_path, 2)
+
+        deadline = time.monotonic() + 5
+        while snapshot.version == 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with snapshot.connection() as connection:
+            count = connection.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        assert count == 19
@@ -0,0 +1,75 @@
+import shutil
+from pathlib import Path
+from typing import List
+
+from calibre.calibre_library import CalibreLibrary
+from calibre.calibredb import CalibreDB
+from calibre.dedup import (
+    DuplicateReason,
+    find_duplicates,
+    normalize_authors,
+    normalize_title,
+    remove_duplicates,
+)
+from calibre.hashing import HashCache
+from calibre.objects import BookMetadata
+
+
+def test_normalize():
+    assert normalize_title("La Petite Sœur !") == normalize_title("petite soeur")
+    assert normalize_title("Le") == "le"
+    assert normalize_authors("Éluard, Paul & Ernest Daudet") == normalize_authors(
+        "Ernest Daudet & Paul Eluard"
+    )
+
+
+def test_find_duplicates(
+    tmp_path: Path,
+    ebook_paths: List[Path],
+    fake_library: CalibreLibrary,
+    calibredb: CalibreDB,
+):
+    copy = Path(shutil.copy(ebook_paths[0], tmp_path / "copy.epub"))
+    books = [
+        BookMetadata(
+            id=1, title="Jean le Gueux", authors="A", formats=[ebook_paths[0]]
+        ),
+        BookMetadata(id=2, title="Other", authors="B", formats=[copy]),
+        BookMetadata(id=3, title="La Vie immédiate", authors="Paul Éluard"),
+        BookMetadata(id=4, title="Vie immediate", authors="Eluard, Paul"),
+        BookMetadata(id=5, title="La Vie immédiate (2)", authors="Paul Éluard"),
+        BookMetadata(id=6, title="La Vie immédiate", authors="Someone Else"),
+        BookMetadata(id=7, title="Jean le gueux", authors="A"),
+    ]
+    library = fake_library
+    library.books = books
+    hash_cache = HashCache(tmp_path / "hashes.db")
+
+    groups = find_duplicates(library, hash_cache=hash_cache, workers=0)
+
+    assert [(e.reason, [b.id for b in e.books]) for e in groups] == [
+        (DuplicateReason.content, [1, 2]),
+        (DuplicateReason.metadata, [1, 7]),
+        (DuplicateReason.metadata, [3, 4, 5]),
+    ]
+    assert (hash_cache.hits, hash_cache.misses) == (0, 2)
+
+    # Only the books with the same files are removed by default
+    assert [e.id for e in remove_duplicates(calibredb, groups)] == [2]
+    assert calibredb.commands == [["remove", "2"]]
+
+    # Only the modified file is hashed again
+    with open(copy, "ab") as f:
+        f.write(b"modified")
+    groups = find_duplicates(library, hash_cache=hash_cache, workers=0)
+    assert DuplicateReason.content not in [e.reason for e in groups]
+    assert (hash_cache.hits, hash_cache.misses) == (1, 3)
+
+    # Books with similar metadata are only removed once confirmed
+    calibredb.commands = []
+    assert remove_duplicates(calibredb, groups) == []
+    assert calibredb.commands == []
+
+    removed = remove_duplicates(calibredb, groups, confirmed=groups[:1])
+    assert [e.id for e in removed] == [7]
+    assert calibredb.commands == [["remove", "7"]]
@@ -0,0 +1,97 @@
+import zipfile
+from pathlib import Path
+from typing import List
+
+import pytest
+from calibre.epub import (
+    InvalidEpubError,
+    find_epubs,
+    read_cover,
+    read_epub_metadata,
+    read_epubs,
+)
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/package.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>"""
+
+PACKAGE = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>  The   Title </dc:title>
+    <dc:creator id="a1">First Author</dc:creator>
+    <dc:creator>Second Author</dc:creator>
+    <dc:language>en</dc:language>
+    <meta property="belongs-to-collection" id="c1">The Series</meta>
+    <meta refines="#c1" property="collection-type">series</meta>
+    <meta refines="#c1" property="group-position">2</meta>
+  </metadata>
+  <manifest>
+    <item id="img" href="images/my%20cover.png" media-type="image/png"
+      properties="cover-image"/>
+  </manifest>
+  <spine/>
+</package>"""
+
+
+def write_epub(path: Path) -> Path:
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("mimetype", "application/epub+zip")
+        archive.writestr("META-INF/container.xml", CONTAINER)
+        archive.writestr("OEBPS/package.opf", PACKAGE)
+        archive.writestr("OEBPS/images/my cover.png", b"png")
+    return path
+
+
+def test_read_epub_metadata(ebook_paths: List[Path]):
+    by_name = {e.name: read_epub_metadata(e) for e in ebook_paths}
+
+    metadata = by_name["pidansat_de_mairobert_brossin_de_mere_madame_du_barry.epub"]
+    assert metadata.title == "Madame Du Barry"
+    assert metadata.authors == [
+        "Mathieu-François Pidansat de Mairobert",
+        "Élisabeth Brossin de Méré",
+    ]
+    assert metadata.languages == ["fr"]
+    assert metadata.cover == "cover.jpeg"
+
+    metadata = by_name["daudet_ernest_jean_le_gueux.epub"]
+    assert metadata.cover == "Ops/images/cover.jpg"
+
+
+def test_epub3(tmp_path: Path):
+    path = write_epub(tmp_path / "book.epub")
+    metadata = read_epub_metadata(path)
+
+    assert metadata.title == "The Title"
+    assert metadata.authors == ["First Author", "Second Author"]
+    assert (metadata.series, metadata.series_index) == ("The Series", 2.0)
+    assert metadata.cover == "OEBPS/images/my cover.png"
+    assert read_cover(path) == b"png"
+
+
+def test_invalid(tmp_path: Path):
+    (tmp_path / "text.epub").write_text("not a zip")
+    with zipfile.ZipFile(tmp_path / "empty.epub", "w") as archive:
+        archive.writestr("mimetype", "application/epub+zip")
+
+    for name in ["text.epub", "empty.epub"]:
+        with pytest.raises(InvalidEpubError):
+            read_epub_metadata(tmp_path / name)
+
+
+def test_read_epubs(tmp_path: Path, ebook_paths: List[Path]):
+    write_epub(tmp_path / "book.epub")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "broken.epub").write_text("not a zip")
+
+    paths = find_epubs(tmp_path)
+    assert [e.name for e in paths] == ["book.epub", "broken.epub"]
+
+    results = list(read_epubs(paths + ebook_paths, workers=2))
+    assert [e.path for e in results] == paths + ebook_paths
+    assert results[1].metadata is None and results[1].error
+    assert all(e.metadata is not None for e in results[2:])
@@ -0,0 +1,168 @@
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from calibre.filters.filter import (
+    AndFilter,
+    ContainsFilter,
+    EqualityFilter,
+    FacetFilter,
+    Filter,
+    FullTextFilter,
+    InFilter,
+    LikeFilter,
+    NotFilter,
+    OrFilter,
+    RangeFilter,
+)
+from calibre.calibre_sql import CalibreSql
+from calibre.fts import to_fts_query
+from calibre.objects import FacetField, InternalCalibreField
+from calibre.search_params import SearchParams
+from calibre.synthetic import generate_library
+
+
+@pytest.mark.parametrize(
+    "filter,sql,args",
+    [
+        [EqualityFilter.with_id(2), "id = ?", [2]],
+        [
+            InFilter(field=InternalCalibreField.authors, values=["A", "B"]),
+            "authors IN (?, ?)",
+            ["A", "B"],
+        ],
+        [InFilter(field=InternalCalibreField.authors, values=[]), "0", []],
+        [
+            FacetFilter(field=FacetField.tags, values=["a", "b"]),
+            "id IN (SELECT link.book FROM books_tags_link AS link"
+            " JOIN tags AS value ON link.tag = value.id"
+            " WHERE value.name IN (?, ?))",
+            ["a", "b"],
+        ],
+        [FacetFilter(field=FacetField.authors, values=[]), "0", []],
+        [
+            LikeFilter(field=InternalCalibreField.title, pattern="The %"),
+            "title LIKE ?",
+            ["The %"],
+        ],
+        [
+            ContainsFilter(field=InternalCalibreField.title, value="Vol 10%_"),
+            "unicode_lower(title) LIKE ? ESCAPE '\\'",
+            ["%vol 10\\%\\_%"],
+        ],
+        [
+            RangeFilter(
+                field=InternalCalibreField.timestamp,
+                min=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            ),
+            "timestamp >= ?",
+            ["2024-01-01 00:00:00+00:00"],
+        ],
+        [
+            RangeFilter(field=InternalCalibreField.series_index, min=1, max=2),
+            "series_index >= ? AND series_index <= ?",
+            [1, 2],
+        ],
+        [
+            EqualityFilter.with_id(1) | ~EqualityFilter.with_id(2),
+            "(id = ?) OR (NOT IFNULL((id = ?), 0))",
+            [1, 2],
+        ],
+        [
+            FullTextFilter(query="jules verne"),
+            "id IN (SELECT rowid FROM fts.books_fts WHERE books_fts MATCH ?)",
+            ['"jules"* "verne"*'],
+        ],
+        [FullTextFilter(query="  "), "1", []],
+        [FullTextFilter(query='"'), "1", []],
+        [AndFilter(filters=[]), "1", []],
+        [OrFilter(filters=[]), "0", []],
+    ],
+)
+def test_to_sql_filter(filter: Filter, sql: str, args: list):
+    assert filter.to_sql_filter() == (sql, args)
+
+
+@pytest.mark.parametrize(
+    "filter,expected",
+    [
+        [EqualityFilter.with_id(2), 'id:"2"'],
+        [
+            InFilter(field=InternalCalibreField.authors, values=['Jules "V"', "B"]),
+            '(authors:"=Jules \\"V\\"" or authors:"=B")',
+        ],
+        [
+            FacetFilter(field=FacetField.series, values=["S"]),
+            '(series:"=S")',
+        ],
+        [
+            LikeFilter(field=InternalCalibreField.title, pattern="The %"),
+            'title:"~^The\\\\ .*$"',
+        ],
+        [
+            RangeFilter(field=InternalCalibreField.series_index, min=1, max=2),
+            '(series_index:">=1" and series_index:"<=2")',
+        ],
+        [
+            AndFilter(
+                filters=[
+                    ContainsFilter(field=InternalCalibreField.title, value="a"),
+                    NotFilter(filter=EqualityFilter.with_id(2)),
+                ]
+            ),
+            '(title:"a") and (not (id:"2"))',
+        ],
+    ],
+)
+def test_to_calibredb_filter(filter: Filter, expected: str):
+    assert filter.to_calibredb_filter() == expected
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        ["", ""],
+        ["dau", '"dau"*'],
+        ["le gueux", '"le"* "gueux"*'],
+        ['"la vie" eluard', '"la vie" "eluard"*'],
+        ['unterminated "phrase', '"unterminated"* "phrase"'],
+        [' " ', ""],
+        ["NEAR(a b)", '"NEAR(a"* "b)"*'],
+    ],
+)
+def test_to_fts_query(text: str, expected: str):
+    assert to_fts_query(text) == expected
+
+
+@pytest.mark.parametrize("query", ["", "  ", '"'])
+def test_full_text_search_without_terms(tmp_path: Path, query: str):
+    path = generate_library(tmp_path / "library", 5, with_files=False)
+    with CalibreSql(path, cache_dir=tmp_path / "cache") as library:
+        params = SearchParams(filters=[FullTextFilter(query=query)])
+        assert len(library.list_books(params)) == 5
+    library.pool.close()
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [["élisabeth", [2]], ["ÉLISABETH", [2]], ["l'œuvre", [2]], ["%", []]],
+)
+def test_contains_non_ascii(tmp_path: Path, value: str, expected: list):
+    path = generate_library(tmp_path / "library", 5, with_files=False)
+    connection = sqlite3.connect(path / "metadata.db")
+    # Called by the triggers of calibre on the books table
+    connection.create_function("title_sort", 1, lambda e: e)
+    connection.execute(
+        "UPDATE books SET title = ? WHERE id = 2", ["Élisabeth et l'Œuvre"]
+    )
+    connection.commit()
+    connection.close()
+
+    with CalibreSql(path, cache_dir=tmp_path / "cache") as library:
+        params = SearchParams(
+            filters=[ContainsFilter(field=InternalCalibreField.title, value=value)]
+        )
+        ids = [e.id for e in library.list_books(params)]
+    library.pool.close()
+    assert ids == expected
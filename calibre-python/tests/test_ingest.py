@@ -0,0 +1,69 @@
+import shutil
+from pathlib import Path
+from typing import List
+
+from calibre.calibre_library import CalibreLibrary
+from calibre.calibredb import CalibreDB
+from calibre.ingest import BulkImport, ImportProgress, ImportStatus, check_file
+from calibre.objects import BookMetadata
+from calibre.write_queue import WriteQueue
+
+
+def test_check_file(tmp_path: Path, ebook_paths: List[Path]):
+    check = check_file(ebook_paths[0])
+    assert check.error is None
+    assert len(check.sha256) == 64
+
+    (tmp_path / "notes.xyz").write_text("notes")
+    (tmp_path / "empty.pdf").touch()
+    (tmp_path / "broken.epub").write_text("not a zip")
+    (tmp_path / "fake.pdf").write_text("not a pdf")
+    errors = [
+        check_file(tmp_path / e).error
+        for e in ["notes.xyz", "empty.pdf", "broken.epub", "fake.pdf", "missing.txt"]
+    ]
+
+    assert all(e is not None for e in errors)
+
+
+def test_bulk_import(
+    tmp_path: Path,
+    ebook_paths: List[Path],
+    fake_library: CalibreLibrary,
+    calibredb: CalibreDB,
+):
+    upload_dir = tmp_path / "upload"
+    upload_dir.mkdir()
+    paths = []
+    for path in ebook_paths:
+        paths.append(Path(shutil.copy(path, upload_dir)))
+    # Same content as an uploaded book
+    paths.append(Path(shutil.copy(ebook_paths[1], upload_dir / "copy.epub")))
+    (upload_dir / "broken.epub").write_text("not a zip")
+    paths.append(upload_dir / "broken.epub")
+
+    write_queue = WriteQueue(calibredb)
+    # The first book is already in the library
+    library = fake_library
+    library.books = [BookMetadata(id=1, title="Book", formats=[ebook_paths[0]])]
+
+    bulk_import = BulkImport(
+        paths,
+        write_queue=write_queue,
+        library=library,
+        workers=0,
+        chunk_size=2,
+        progress_dir=tmp_path,
+    ).start()
+    assert bulk_import.wait(timeout=30)
+    write_queue.close()
+
+    progress = bulk_import.progress()
+    assert progress.status == ImportStatus.done
+    assert (progress.total, progress.checked) == (len(paths), len(paths))
+    assert (progress.invalid, progress.duplicates) == (1, 2)
+    assert progress.added == len(ebook_paths) - 1
+    assert ImportProgress.load(tmp_path / f"{bulk_import.id}.json") == progress
+
+    added = [e for command in calibredb.commands for e in command[1:]]
+    assert sorted(added) == sorted(str(e) for e in paths[1 : len(ebook_paths)])
@@ -4,9 +4,17 @@ from typing import List
 import pytest
 from calibre.calibre_sql import CalibreSql
 from calibre.calibredb import CalibreDB
-from calibre.objects import CalibreField, InternalCalibreField
-from calibre.search_params import SearchParams
-from calibre.filters.filter import Filter, EqualityFilter
+from calibre.objects import CalibreField, FacetField, InternalCalibreField
+from calibre.search_params import OrderBy, SearchParams
+from calibre.filters.filter import (
+    Filter,
+    ContainsFilter,
+    EqualityFilter,
+    FacetFilter,
+    FullTextFilter,
+    InFilter,
+    RangeFilter,
+)
 
 
 def test_new_add_list(tmp_path: Path, ebook_paths: List[Path]):
@@ -72,10 +80,16 @@ def library_calibresql(library_calibredb):
         [[CalibreField.cover], []],
         [[CalibreField.series], []],
         [[CalibreField.formats], []],
+        [list(CalibreField), []],
         [
             [CalibreField.authors],
             [EqualityFilter(field=InternalCalibreField.id, value=2)],
         ],
+        [[], [InFilter(field=InternalCalibreField.id, values=[1, 3])]],
+        [[], [RangeFilter(field=InternalCalibreField.id, min=2, max=3)]],
+        [[], [~EqualityFilter.with_id(2) & ~EqualityFilter.with_id(3)]],
+        [[], [EqualityFilter.with_id(1) | EqualityFilter.with_id(4)]],
+        [[], [ContainsFilter(field=InternalCalibreField.title, value="a")]],
     ],
 )
 def test_new_add_list_sql(
@@ -92,3 +106,184 @@ def test_new_add_list_sql(
     assert (
         books_metadata_expected == books_metadata
     ), f"calibreDB = {books_metadata_expected} calibresql {books_metadata}"
+
+
+def test_verify_files_sql(library_calibresql: CalibreSql):
+    search_params = SearchParams(fields=[CalibreField.cover, CalibreField.formats])
+    library_verify_files = CalibreSql(
+        library_path=library_calibresql.library_path, verify_files=True
+    )
+
+    books_metadata = library_verify_files.list_books(params=search_params)
+
+    assert books_metadata == library_calibresql.list_books(params=search_params)
+    assert all(e.cover.exists() for e in books_metadata)
+    assert all(p.exists() for e in books_metadata for p in e.formats)
+
+
+@pytest.mark.parametrize(
+    "order_by",
+    [
+        [],
+        [OrderBy(field=InternalCalibreField.authors)],
+        [OrderBy(field=InternalCalibreField.formats, descending=True)],
+        [OrderBy(field=InternalCalibreField.tags)],
+    ],
+)
+def test_meta_view_sql(library_calibresql: CalibreSql, order_by: List[OrderBy]):
+    search_params = SearchParams(fields=list(CalibreField), order_by=order_by)
+    library_meta_view = CalibreSql(
+        library_path=library_calibresql.library_path, use_meta_view=True
+    )
+
+    assert library_calibresql.list_books(
+        params=search_params
+    ) == library_meta_view.list_books(params=search_params)
+    assert library_calibresql.count_books(
+        params=search_params
+    ) == library_meta_view.count_books(params=search_params)
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_order_by_sql(
+    library_calibredb: CalibreDB, library_calibresql: CalibreSql, descending: bool
+):
+    search_params = SearchParams(
+        fields=[CalibreField.timestamp],
+        order_by=[OrderBy(field=InternalCalibreField.timestamp, descending=descending)],
+    )
+    books_metadata_expected = library_calibredb.list_books(params=search_params)
+
+    books_metadata = library_calibresql.list_books(params=search_params)
+
+    assert [e.id for e in books_metadata_expected] == [e.id for e in books_metadata]
+
+
+@pytest.mark.parametrize("limit", [1, 3, 10])
+@pytest.mark.parametrize(
+    "order_by",
+    [
+        [],
+        [OrderBy(field=InternalCalibreField.series)],
+        [OrderBy(field=InternalCalibreField.timestamp, descending=True)],
+    ],
+)
+def test_list_page_sql(
+    library_calibresql: CalibreSql, limit: int, order_by: List[OrderBy]
+):
+    books_metadata_expected = library_calibresql.list_books(
+        params=SearchParams(order_by=order_by)
+    )
+
+    books_metadata = []
+    cursor = None
+    while True:
+        page = library_calibresql.list_page(
+            params=SearchParams(order_by=order_by, limit=limit, cursor=cursor)
+        )
+        assert len(page.books) <= limit
+        books_metadata.extend(page.books)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+    assert books_metadata_expected == books_metadata
+    assert library_calibresql.count_books() == len(books_metadata)
+
+
+def test_list_page_invalid_cursor(library_calibresql: CalibreSql):
+    page = library_calibresql.list_page(params=SearchParams(limit=1))
+
+    with pytest.raises(ValueError):
+        library_calibresql.list_page(
+            params=SearchParams(
+                order_by=[OrderBy(field=InternalCalibreField.title)],
+                cursor=page.next_cursor,
+            )
+        )
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+def test_iter_books(
+    library_calibredb: CalibreDB, library_calibresql: CalibreSql, batch_size: int
+):
+    search_params = SearchParams(
+        fields=[CalibreField.authors, CalibreField.timestamp],
+        order_by=[OrderBy(field=InternalCalibreField.timestamp)],
+    )
+    books_metadata_expected = library_calibresql.list_books(params=search_params)
+
+    for library in [library_calibredb, library_calibresql]:
+        batches = list(library.iter_batches(search_params, batch_size=batch_size))
+
+        assert all(len(e) <= batch_size for e in batches)
+        assert [e for batch in batches for e in batch] == books_metadata_expected
+        assert (
+            list(library.iter_books(search_params, batch_size=batch_size))
+            == books_metadata_expected
+        )
+
+
+def test_search_sql(library_calibresql: CalibreSql):
+    for book in library_calibresql.list_books():
+        res = library_calibresql.search(f'"{book.title}"')
+        assert res[0].id == book.id
+
+        filtered = library_calibresql.list_books(
+            params=SearchParams(filters=[FullTextFilter(query=f'"{book.title}"')])
+        )
+        assert sorted(e.id for e in filtered) == sorted(e.id for e in res)
+
+
+def test_list_changes(tmp_path: Path, ebook_paths: List[Path]):
+    library = CalibreDB.new_empty_library(tmp_path / "library").add(
+        ebooks=ebook_paths[:2]
+    )
+    library_sql = CalibreSql(library_path=library.library_path)
+
+    data_version = library_sql.data_version()
+    checkpoint = library_sql.checkpoint()
+    known_ids = [e.id for e in library_sql.list_books()]
+
+    library.add(ebooks=ebook_paths[2:]).remove_from_ids(known_ids[:1])
+
+    assert library_sql.data_version() != data_version
+
+    changes = library_sql.list_changes(checkpoint=checkpoint, known_ids=known_ids)
+
+    assert changes.deleted_ids == known_ids[:1]
+    assert len(changes.updated) == len(ebook_paths) - 2
+    assert changes.checkpoint > checkpoint
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        [],
+        [EqualityFilter.with_id(1)],
+        [FacetFilter(field=FacetField.tags, values=["fiction", "poetry"])],
+    ],
+)
+def test_facets_sql(
+    library_calibredb: CalibreDB, library_calibresql: CalibreSql, filters: List[Filter]
+):
+    facets_expected = library_calibredb.facets(filters=filters)
+
+    facets = library_calibresql.facets(filters=filters)
+
+    assert facets == facets_expected
+    assert library_calibresql.facets(filters=filters) is facets
+
+
+def test_facet_filter_sql(library_calibresql: CalibreSql):
+    authors = library_calibresql.facets(fields=[FacetField.authors])[FacetField.authors]
+
+    for author in authors:
+        books = library_calibresql.list_books(
+            params=SearchParams(
+                fields=[CalibreField.authors],
+                filters=[FacetFilter(field=FacetField.authors, values=[author.value])],
+            )
+        )
+        assert len(books) == author.count
+        assert all(author.value in e.authors.split(" & ") for e in books)
@@ -0,0 +1,105 @@
+import sqlite3
+
+import pytest
+
+from calibre.calibre_sql import CalibreSql
+from calibre.filters import FacetFilter, FullTextFilter
+from calibre.library_index import LibraryIndex
+from calibre.objects import CalibreField, FacetField, InternalCalibreField
+from calibre.query_cache import QueryCache
+from calibre.search_params import OrderBy, SearchParams
+from calibre.synthetic import generate_library
+
+FIELDS = [
+    CalibreField.authors,
+    CalibreField.series,
+    CalibreField.series_index,
+    CalibreField.timestamp,
+]
+
+
+@pytest.fixture(scope="module")
+def library(tmp_path_factory) -> CalibreSql:
+    path = generate_library(
+        tmp_path_factory.mktemp("index") / "library", 300, seed=3, with_files=False
+    )
+    # Books without authors are sorted first
+    connection = sqlite3.connect(path / "metadata.db")
+    connection.execute("DELETE FROM books_authors_link WHERE book IN (4, 20)")
+    connection.commit()
+    connection.close()
+
+    library = CalibreSql(path, query_cache=QueryCache(max_entries=0))
+    yield library
+    library.close()
+    library.pool.close()
+
+
+def _all_ids(source, params: SearchParams):
+    ids, cursor = [], None
+    while True:
+        page = source.list_page(params.model_copy(update={"cursor": cursor}))
+        ids.extend(e.id for e in page.books)
+        cursor = page.next_cursor
+        if cursor is None:
+            return ids
+
+
+def test_same_results_as_sql(library: CalibreSql):
+    index = LibraryIndex(library.list_books(SearchParams(fields=FIELDS)), FIELDS)
+    fields = [FacetField.authors, FacetField.series]
+    facets = library.facets(fields=fields)
+    assert index.facets(fields=fields) == facets
+
+    authors = [e.value for e in facets[FacetField.authors]]
+    series = [e.value for e in facets[FacetField.series]]
+    for filters in [
+        [],
+        [FacetFilter(field=FacetField.authors, values=authors[:3])],
+        [
+            FacetFilter(field=FacetField.authors, values=authors[:40]),
+            FacetFilter(field=FacetField.series, values=series[:10]),
+        ],
+    ]:
+        assert index.count_books(filters) == library.count_books(
+            SearchParams(filters=filters)
+        )
+        assert index.facets(fields, filters) == library.facets(fields, filters)
+        for field in [
+            InternalCalibreField.authors,
+            InternalCalibreField.series,
+            InternalCalibreField.series_index,
+            InternalCalibreField.timestamp,
+        ]:
+            for descending in [False, True]:
+                params = SearchParams(
+                    fields=FIELDS,
+                    filters=filters,
+                    order_by=[OrderBy(field=field, descending=descending)],
+                    limit=25,
+                )
+                assert _all_ids(index, params) == _all_ids(library, params)
+
+
+def test_supports(library: CalibreSql):
+    books = library.list_books(SearchParams(fields=FIELDS))
+    index = LibraryIndex(books, FIELDS)
+    assert index.get(books[-1].id) == books[-1]
+    assert index.get(books[-1].id + 1) is None
+
+    assert index.supports(SearchParams(fields=[CalibreField.authors]))
+    assert not index.supports(SearchParams(fields=[CalibreField.formats]))
+    assert not index.supports(SearchParams(filters=[FullTextFilter(query="a")]))
+    with pytest.raises(ValueError):
+        index.list_page(SearchParams(filters=[FullTextFilter(query="a")]))
+
+    # Nor sorts, filters and facets on fields the books were not read with
+    index = LibraryIndex(books, [CalibreField.series])
+    timestamp = OrderBy(field=InternalCalibreField.timestamp)
+    assert not index.supports(SearchParams(order_by=[timestamp]))
+    assert index.supports(SearchParams(order_by=[OrderBy(field="title")]))
+    authors = FacetFilter(field=FacetField.authors, values=["a"])
+    assert not index.supports(SearchParams(filters=[authors]))
+    assert index.supports_facets([FacetField.series], [])
+    assert not index.supports_facets([FacetField.authors], [])
+    assert not index.supports_facets([FacetField.series], [authors])
@@ -0,0 +1,121 @@
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from calibre.library_lock import LibraryLock, LibraryLockTimeoutError
+
+# Holds the lock exclusive in another process until its stdin is closed
+HOLDER = """
+import sys
+from pathlib import Path
+from calibre.library_lock import LibraryLock
+
+with LibraryLock(Path(sys.argv[1])).exclusive_lock():
+    print("locked", flush=True)
+    sys.stdin.read()
+"""
+
+
+def test_shared(tmp_path: Path):
+    lock = LibraryLock(tmp_path / "library.lock", timeout=1)
+    inside = threading.Barrier(3, timeout=5)
+
+    def read():
+        with lock.shared_lock():
+            inside.wait()
+
+    threads = [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    # Every reader holds the lock at the same time
+    inside.wait()
+    for thread in threads:
+        thread.join()
+
+    assert lock.stats().shared_acquisitions == 2
+
+
+def test_exclusive(tmp_path: Path):
+    lock = LibraryLock(tmp_path / "library.lock", timeout=0.1)
+    errors = []
+
+    def read():
+        try:
+            with lock.shared_lock():
+                pass
+        except LibraryLockTimeoutError as e:
+            errors.append(e)
+
+    with lock.exclusive_lock():
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+
+    assert len(errors) == 1
+    stats = lock.stats()
+    assert (stats.timeouts, stats.writers) == (1, 0)
+
+    # Available again once released
+    with lock.shared_lock():
+        pass
+
+
+def test_writer_waits_for_readers(tmp_path: Path):
+    lock = LibraryLock(tmp_path / "library.lock", timeout=5)
+    events = []
+
+    def write():
+        with lock.exclusive_lock():
+            events.append("write")
+
+    with lock.shared_lock():
+        thread = threading.Thread(target=write)
+        thread.start()
+        time.sleep(0.05)
+        events.append("read")
+    thread.join()
+
+    assert events == ["read", "write"]
+    assert lock.stats().contentions == 1
+
+
+def test_reentrant(tmp_path: Path):
+    lock = LibraryLock(tmp_path / "library.lock", timeout=0.1)
+
+    with lock.exclusive_lock(), lock.exclusive_lock(), lock.shared_lock():
+        assert lock.stats().writers == 1
+
+    with lock.shared_lock(), lock.shared_lock():
+        with pytest.raises(RuntimeError):
+            with lock.exclusive_lock():
+                pass
+
+    assert lock.stats().readers == 0
+
+
+def test_other_process(tmp_path: Path):
+    lock = LibraryLock(tmp_path / "library.lock", timeout=0.1)
+    holder = subprocess.Popen(
+        [sys.executable, "-c", HOLDER, str(lock.lock_path)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        env={"PYTHONPATH": ":".join(sys.path)},
+    )
+    try:
+        assert holder.stdout.readline() == "locked\n"
+        with pytest.raises(LibraryLockTimeoutError):
+            with lock.shared_lock():
+                pass
+    finally:
+        holder.communicate("")
+
+    with lock.exclusive_lock():
+        pass
+
+
+def test_shared_instance(tmp_path: Path):
+    assert LibraryLock.shared(tmp_path) is LibraryLock.shared(tmp_path / ".")
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pytest
+
+from calibre.calibre_sql import CalibreSql
+from calibre.metrics import (
+    MATERIALIZATION_SECONDS,
+    SQL_QUERY_SECONDS,
+    MetricsRegistry,
+)
+
+
+def test_render():
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests.", ["route"])
+    histogram = registry.histogram(
+        "duration_seconds", "Durations.", ["route"], buckets=[0.1, 1]
+    )
+    counter.inc(labels=("/",))
+    counter.inc(2, labels=("/",))
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(value, ("/",))
+
+    assert registry.render() == (
+        "# HELP duration_seconds Durations.\n"
+        "# TYPE duration_seconds histogram\n"
+        'duration_seconds_bucket{route="/",le="0.1"} 2\n'
+        'duration_seconds_bucket{route="/",le="1.0"} 3\n'
+        'duration_seconds_bucket{route="/",le="+Inf"} 4\n'
+        'duration_seconds_sum{route="/"} 3.65\n'
+        'duration_seconds_count{route="/"} 4\n'
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{route="/"} 3.0\n'
+    )
+
+    registry.reset()
+    assert counter.value(("/",)) == 0
+    assert histogram.count(("/",)) == 0
+
+
+def test_registry():
+    registry = MetricsRegistry()
+    counter = registry.counter("total", "Total.", ["kind"])
+    assert registry.counter("total", "Total.", ["kind"]) is counter
+    with pytest.raises(ValueError):
+        registry.histogram("total", "Total.", ["kind"])
+    with pytest.raises(ValueError):
+        counter.inc(labels=("a", "b"))
+
+    histogram = registry.histogram("escaped", "Escaped.", ["path"])
+    with pytest.raises(RuntimeError):
+        with histogram.time(('a "quoted"\\path',)):
+            raise RuntimeError()
+    assert 'escaped_count{path="a \\"quoted\\"\\\\path"} 1' in registry.render()
+
+
+def test_sql_instrumentation(tmp_path: Path):
+    library = CalibreSql.new_empty_library(tmp_path / "library")
+    queries = SQL_QUERY_SECONDS.count(("books",))
+    materializations = MATERIALIZATION_SECONDS.count(("records",))
+
+    library.list_records()
+    assert SQL_QUERY_SECONDS.count(("books",)) == queries + 1
+    assert MATERIALIZATION_SECONDS.count(("records",)) == materializations + 1
+
+    library.close()
+    library.pool.close()
@@ -0,0 +1,81 @@
+from calibre.filters.filter import ContainsFilter, EqualityFilter
+from calibre.objects import BookMetadata, InternalCalibreField
+from calibre.query_cache import QueryCache, estimate_size, query_key
+from calibre.search_params import SearchParams
+
+
+def test_query_key():
+    params = SearchParams(filters=[EqualityFilter.with_id(1)])
+
+    assert query_key(params) == query_key(
+        SearchParams(filters=[EqualityFilter.with_id(1)])
+    )
+    assert query_key(params) != query_key(
+        SearchParams(filters=[EqualityFilter.with_id(2)])
+    )
+    # Filters with the same fields but of different types
+    assert query_key(
+        SearchParams(
+            filters=[ContainsFilter(field=InternalCalibreField.title, value="a")]
+        )
+    ) != query_key(
+        SearchParams(
+            filters=[EqualityFilter(field=InternalCalibreField.title, value="a")]
+        )
+    )
+
+
+def test_hit_miss():
+    cache = QueryCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [1, 2]
+
+    assert cache.get_or_compute("a", 1, compute) == [1, 2]
+    assert cache.get_or_compute("a", 1, compute) == [1, 2]
+    assert len(calls) == 1
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (1, 1, 1)
+
+
+def test_invalidation():
+    cache = QueryCache()
+
+    cache.get_or_compute("a", 1, lambda: "v1")
+
+    assert cache.get_or_compute("a", 2, lambda: "v2") == "v2"
+    assert cache.stats().invalidations == 1
+
+
+def test_lru_eviction():
+    cache = QueryCache(max_entries=2)
+
+    cache.get_or_compute("a", 1, lambda: "a")
+    cache.get_or_compute("b", 1, lambda: "b")
+    cache.get_or_compute("a", 1, lambda: "a")
+    cache.get_or_compute("c", 1, lambda: "c")
+
+    assert cache.get_or_compute("a", 1, lambda: "new") == "a"
+    assert cache.get_or_compute("b", 1, lambda: "new") == "new"
+    assert cache.stats().evictions == 2
+
+
+def test_max_bytes():
+    books = [BookMetadata(id=i, title="t" * 100) for i in range(100)]
+    size = estimate_size(books)
+    cache = QueryCache(max_bytes=size * 2)
+
+    cache.get_or_compute("a", 1, lambda: books)
+    cache.get_or_compute("b", 1, lambda: list(books))
+    cache.get_or_compute("c", 1, lambda: list(books))
+
+    stats = cache.stats()
+    assert stats.entries == 2
+    assert stats.size_bytes <= size * 2
+
+    # Never cached as it is bigger than the whole cache
+    cache.get_or_compute("d", 1, lambda: books * 3)
+    assert cache.stats().entries == 2
@@ -0,0 +1,69 @@
+import sqlite3
+from pathlib import Path
+
+from calibre.calibre_sql import CalibreSql
+from calibre.filters import FacetFilter
+from calibre.objects import CalibreField, FacetField
+from calibre.query_cache import QueryCache
+from calibre.query_log import QueryLog, explain_query_plan
+from calibre.search_params import SearchParams
+
+
+def test_ring_buffer():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+    log = QueryLog(max_entries=3, slow_threshold=0.5)
+
+    for i in range(5):
+        log.record(connection, "select", "SELECT * FROM t WHERE id = ?", [i], 0.1, 0)
+    log.record(connection, "select", "SELECT * FROM t WHERE name = ?", [b"x"], 1, 0)
+
+    entries = log.entries()
+    assert [e.parameters for e in entries] == [[3], [4], ["<1 bytes>"]]
+    assert [e.plan is not None for e in entries] == [False, False, True]
+    assert log.entries(slow_only=True) == entries[2:]
+    assert QueryLog.load(log.dump()) == entries
+
+    log.clear()
+    assert log.entries() == []
+
+
+def test_explain_query_plan():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+    plan = explain_query_plan(
+        connection,
+        "SELECT * FROM t WHERE id IN (SELECT id FROM t WHERE name = ?)",
+        ["a"],
+    )
+    assert plan[0].startswith("SEARCH t")
+    # Steps of the subquery are indented below it
+    assert plan[1].startswith("LIST SUBQUERY")
+    assert plan[2].startswith("  SCAN t")
+
+
+def test_calibre_sql(tmp_path: Path):
+    log = QueryLog(slow_threshold=0)
+    library = CalibreSql.new_empty_library(tmp_path / "library")
+    library = CalibreSql(
+        library.library_path, query_cache=QueryCache(max_entries=0), query_log=log
+    )
+    filters = [FacetFilter(field=FacetField.authors, values=["Victor Hugo"])]
+
+    library.list_books(
+        params=SearchParams(fields=[CalibreField.authors], filters=filters, limit=10)
+    )
+    library.count_books(params=SearchParams(filters=filters))
+    for batch in library.iter_batches(params=SearchParams(filters=filters)):
+        pass
+
+    books, count, batches = log.entries()
+    assert books.query == "books"
+    assert books.parameters == ["Victor Hugo", 11]
+    assert "LIMIT ?" in books.sql
+    assert books.plan
+    assert (count.query, count.rows) == ("count", 1)
+    assert (batches.query, batches.parameters) == ("books", ["Victor Hugo"])
+
+    library.close()
+    library.pool.close()
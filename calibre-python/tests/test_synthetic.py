@@ -0,0 +1,51 @@
+from pathlib import Path
+
+from calibre.calibre_sql import CalibreSql
+from calibre.epub import read_epub_metadata
+from calibre.objects import CalibreField, FacetField
+from calibre.search_params import SearchParams
+from calibre.synthetic import generate_library
+
+
+def test_generate_library(tmp_path: Path):
+    path = generate_library(tmp_path / "library", 200, seed=1)
+    with CalibreSql(path, cache_dir=tmp_path / "cache", verify_files=True) as library:
+        books = library.list_books(
+            params=SearchParams(
+                fields=[
+                    CalibreField.authors,
+                    CalibreField.series,
+                    CalibreField.formats,
+                    CalibreField.cover,
+                ]
+            )
+        )
+        assert [e.id for e in books] == list(range(1, 201))
+        assert all(e.title and e.authors and e.formats for e in books)
+        assert any(e.series for e in books)
+        assert any(e.cover for e in books)
+
+        facets = library.facets(fields=[FacetField.authors])[FacetField.authors]
+        counts = sorted(e.count for e in facets)
+        # A few authors wrote most of the books
+        assert counts[-1] > 5 * counts[0]
+
+        epub = next(e for e in books[0].formats if e.suffix == ".epub")
+        metadata = read_epub_metadata(epub)
+        assert metadata.title == books[0].title
+        assert " & ".join(metadata.authors) == books[0].authors
+    library.pool.close()
+
+
+def test_generate_library_deterministic(tmp_path: Path):
+    params = SearchParams(fields=[CalibreField.authors])
+    libraries = [
+        generate_library(tmp_path / name, 50, seed=7, with_files=False)
+        for name in ["first", "second"]
+    ]
+    books = []
+    for path in libraries:
+        with CalibreSql(path, cache_dir=tmp_path / "cache") as library:
+            books.append([(e.title, e.authors) for e in library.list_books(params)])
+        library.pool.close()
+    assert books[0] == books[1]
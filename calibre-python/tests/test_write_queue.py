@@ -0,0 +1,122 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+from calibre.calibredb import CalibreDB
+from calibre.errors import CalibreRuntimeError
+from calibre.write_queue import JobStatus, WriteQueue
+
+
+@pytest.fixture
+def library(calibredb: CalibreDB) -> CalibreDB:
+    """Jobs pile up in the queue behind the first one until `release`."""
+    calibredb.release.clear()
+    calibredb.failing.add("bad.epub")
+    return calibredb
+
+
+def test_coalesce(library: CalibreDB):
+    queue = WriteQueue(library)
+
+    first = queue.add([Path("a.epub")])
+    library.started.wait(timeout=10)
+    jobs = [
+        queue.add([Path("b.epub")]),
+        queue.add([Path("c.epub"), Path("d.epub")]),
+        queue.remove([1, 2]),
+        queue.remove([3]),
+        queue.add([Path("e.epub")]),
+    ]
+    library.release.set()
+    queue.close()
+
+    assert first.status == JobStatus.done
+    assert all(e.status == JobStatus.done for e in jobs)
+    assert library.commands[1:] == [
+        ["add", "b.epub", "c.epub", "d.epub"],
+        ["remove", "1,2,3"],
+        ["add", "e.epub"],
+    ]
+
+
+def test_max_batch_size(library: CalibreDB):
+    queue = WriteQueue(library, max_batch_size=2)
+
+    queue.remove([1])
+    library.started.wait(timeout=10)
+    for i in range(2, 6):
+        queue.remove([i])
+    library.release.set()
+    queue.close()
+
+    assert library.commands == [["remove", "1"], ["remove", "2,3"], ["remove", "4,5"]]
+
+
+def test_failed_batch(library: CalibreDB):
+    queue = WriteQueue(library)
+
+    queue.remove([1])
+    library.started.wait(timeout=10)
+    good = queue.add([Path("good.epub")])
+    bad = queue.add([Path("bad.epub")])
+    library.release.set()
+    assert queue.join(timeout=10)
+
+    # The batch is retried job by job, only the faulty one fails
+    assert good.status == JobStatus.done
+    assert good.future.result() is None
+    assert bad.status == JobStatus.failed
+    assert isinstance(bad.error, CalibreRuntimeError)
+    with pytest.raises(CalibreRuntimeError):
+        bad.future.result()
+
+    # The queue keeps running the next jobs
+    later = queue.remove([2])
+    later.future.result(timeout=10)
+    assert later.status == JobStatus.done
+    assert library.commands[-1] == ["remove", "2"]
+    queue.close()
+
+
+def test_cancelled_job(library: CalibreDB):
+    queue = WriteQueue(library)
+
+    queue.remove([1])
+    library.started.wait(timeout=10)
+    cancelled = queue.add([Path("a.epub")])
+    assert cancelled.future.cancel()
+    later = queue.add([Path("b.epub")])
+    library.release.set()
+
+    # Cancelled jobs are skipped without stopping the worker
+    later.future.result(timeout=10)
+    assert queue.join(timeout=10)
+    assert cancelled.status == JobStatus.cancelled
+    assert later.status == JobStatus.done
+    assert library.commands == [["remove", "1"], ["add", "b.epub"]]
+    queue.close()
+
+
+def test_closed(library: CalibreDB):
+    queue = WriteQueue(library)
+    queue.close()
+
+    with pytest.raises(ValueError):
+        queue.remove([1])
+
+
+def test_add_remove(tmp_path: Path, ebook_paths: List[Path]):
+    library = CalibreDB.new_empty_library(tmp_path / "library")
+    queue = WriteQueue(library)
+
+    jobs = [queue.add([e]) for e in ebook_paths]
+    assert queue.join(timeout=60)
+    assert all(e.status == JobStatus.done for e in jobs)
+
+    books_metadata = library.list_books()
+    assert len(books_metadata) == len(ebook_paths)
+
+    queue.remove([books_metadata[0].id]).future.result(timeout=60)
+    queue.close()
+
+    assert len(library.list_books()) == len(ebook_paths) - 1
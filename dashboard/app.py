@@ -1,11 +1,23 @@
 import logging
+from pathlib import Path
 
 import dash
 import dash_bootstrap_components as dbc
 from app_config import APP_CONFIG
-from calibre import CalibreSql, CalibreField, SearchParams
-from dash import Dash, Input, Output, State, callback, dcc, html
-from flask import Flask, send_from_directory
+from calibre import ImportProgress, ImportStatus
+from core.download import library_file_response
+from core.ingestion import import_progress, start_import
+from core.metrics import install_metrics
+from core.library_store import LIBRARY_STORE
+from core.thumbnails import (
+    CARD_HEIGHT,
+    THUMBNAIL_CACHE,
+    THUMBNAIL_HEIGHTS,
+    cover_version,
+)
+from dash import Dash, Input, Output, State, callback, ctx, dcc, html
+from flask import Flask, Response, abort, request, send_file
+from werkzeug.security import safe_join
 
 logger = logging.getLogger(__name__)
 
@@ -17,17 +29,63 @@ app = Dash(
     external_stylesheets=[dbc.themes.COSMO, dbc.icons.BOOTSTRAP, dbc_css],
     suppress_callback_exceptions=True,
 )
+install_metrics(app)
 
 
 @server.route("/download-from-library/<path:path>")
 def download_from_library(path):
-    return send_from_directory(
+    return library_file_response(
         APP_CONFIG.library_path,
         path,
-        as_attachment=True,
+        cover_max_age=APP_CONFIG.cover_max_age,
+        ebook_max_age=APP_CONFIG.ebook_max_age,
     )
 
 
+@server.route("/query-log")
+def query_log():
+    """Last SQL statements run on the library, oldest first, or only the slow ones
+    with `?slow=1`. Print them with `python -m calibre.query_log show`."""
+    log = LIBRARY_STORE.library.query_log
+    if log is None:
+        abort(404)
+    return Response(
+        log.dump(slow_only=request.args.get("slow") == "1"),
+        mimetype="application/json",
+    )
+
+
+@server.route("/thumbnail/<int:height>/<path:path>")
+def thumbnail(height: int, path: str):
+    """Resized cover. Thumbnails requested with the version of their cover, as in
+    the URLs of `thumbnail_url`, never change and are cached for a year."""
+    cover_path = safe_join(str(APP_CONFIG.library_path), path)
+    if height not in THUMBNAIL_HEIGHTS or cover_path is None:
+        abort(404)
+    cover_path = Path(cover_path)
+
+    try:
+        thumbnail_path = THUMBNAIL_CACHE.get(cover_path, height)
+    except FileNotFoundError:
+        abort(404)
+
+    if request.args.get("v") == str(cover_version(cover_path)):
+        max_age, immutable = 365 * 24 * 3600, True
+    else:
+        max_age, immutable = 3600, False
+
+    if thumbnail_path is None:
+        # Not an image Pillow can read, the browser may do better
+        response = send_file(cover_path, max_age=max_age)
+    else:
+        response = send_file(
+            thumbnail_path, mimetype=THUMBNAIL_CACHE.mimetype, max_age=max_age
+        )
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable
+    return response
+
+
 navbar_right = dbc.Nav(
     [
         dbc.Button(html.I(className="bi bi-upload", id="upload-button")),
@@ -82,27 +140,143 @@ navbar = dbc.Navbar(
 )
 
 
-app.layout = html.Div([dcc.Store(id="library"), navbar, dash.page_container])
+def import_status(progress: ImportProgress):
+    if progress.status == ImportStatus.checking:
+        value, total, label = progress.checked, progress.total, "Checking the files"
+    else:
+        value, total = progress.added + progress.failed, progress.queued
+        label = "Adding the books" if not progress.finished else "Done"
+    if progress.status == ImportStatus.failed:
+        label = "Import failed"
+
+    summary = (
+        f"{progress.added} books added, {progress.duplicates} already in the "
+        f"library, {progress.invalid + progress.failed} not added"
+    )
+    return html.Div(
+        [
+            dbc.Progress(
+                value=100 * value / total if total else 100,
+                label=label,
+                striped=not progress.finished,
+                animated=not progress.finished,
+                color="danger" if progress.status == ImportStatus.failed else None,
+            ),
+            html.P(summary, className="mt-2"),
+            html.Ul([html.Li(e) for e in progress.errors], className="small"),
+        ]
+    )
 
 
-@callback(Output("library", "data"), Input("reload-library", "n_clicks"))
-def load_library(_n_clicks):
-    logger.info("Loading library...")
-    calibre_library = CalibreSql(APP_CONFIG.library_path)
-    books_metadata = calibre_library.list_books(
-        params=SearchParams(
-            fields=[
-                CalibreField.authors,
-                CalibreField.cover,
-                CalibreField.formats,
-                CalibreField.series,
-                CalibreField.series_index,
-                CalibreField.timestamp,
+upload_modal = dbc.Modal(
+    [
+        dbc.ModalHeader(dbc.ModalTitle("Upload ebooks")),
+        dbc.ModalBody(
+            [
+                dcc.Upload(
+                    html.Div(["Drag and drop or ", html.A("select ebooks")]),
+                    id="upload-ebooks",
+                    multiple=True,
+                    style={
+                        "lineHeight": "4rem",
+                        "borderWidth": "1px",
+                        "borderStyle": "dashed",
+                        "borderRadius": "5px",
+                        "textAlign": "center",
+                    },
+                ),
+                html.Div(id="import-status", className="mt-3"),
             ]
-        )
+        ),
+    ],
+    id="upload-modal",
+    is_open=False,
+)
+
+
+app.layout = html.Div(
+    [
+        dcc.Store(id="library"),
+        dcc.Store(id="import-id"),
+        dcc.Interval(id="import-refresh", interval=1000, disabled=True),
+        dcc.Interval(
+            id="library-refresh",
+            interval=max(APP_CONFIG.library_refresh_interval, 1) * 1000,
+            disabled=APP_CONFIG.library_refresh_interval <= 0,
+        ),
+        navbar,
+        upload_modal,
+        dash.page_container,
+    ]
+)
+
+
+@callback(
+    Output("library", "data"),
+    Input("reload-library", "n_clicks"),
+    Input("library-refresh", "n_intervals"),
+    State("library", "data"),
+)
+def load_library(_n_clicks, _n_intervals, library_version):
+    # Only the version token of the snapshot is sent to the browser, the books
+    # themselves stay in the process-side store.
+    if ctx.triggered_id == "library-refresh":
+        snapshot = LIBRARY_STORE.refresh()
+        if snapshot.version == library_version:
+            return dash.no_update
+    else:
+        snapshot = LIBRARY_STORE.reload()
+
+    # Only the covers of the books added or modified since the previous snapshot
+    THUMBNAIL_CACHE.update(
+        [e.cover for e in snapshot.updated if e.cover], heights=(CARD_HEIGHT,)
     )
+    # Built here rather than by the first search of the new snapshot
+    snapshot.build_index()
+    return snapshot.version
+
+
+@callback(
+    Output("upload-modal", "is_open"),
+    Input("upload-button", "n_clicks"),
+    prevent_initial_call=True,
+)
+def open_upload_modal(_n_clicks):
+    return True
+
+
+@callback(
+    Output("import-id", "data"),
+    Output("import-refresh", "disabled"),
+    Output("upload-ebooks", "contents"),
+    Input("upload-ebooks", "contents"),
+    State("upload-ebooks", "filename"),
+    prevent_initial_call=True,
+)
+def upload_ebooks(contents, filenames):
+    if not contents:
+        return dash.no_update, dash.no_update, dash.no_update
+    # The files are checked and added in the background, followed by show_import
+    return start_import(contents, filenames), False, None
+
+
+@callback(
+    Output("import-status", "children"),
+    Output("import-refresh", "disabled", allow_duplicate=True),
+    Output("library", "data", allow_duplicate=True),
+    Input("import-refresh", "n_intervals"),
+    State("import-id", "data"),
+    prevent_initial_call=True,
+)
+def show_import(_n_intervals, import_id):
+    progress = import_progress(import_id) if import_id else None
+    if progress is None:
+        return dash.no_update, True, dash.no_update
+    if not progress.finished:
+        return import_status(progress), False, dash.no_update
 
-    return [e.model_dump_json() for e in books_metadata]
+    # Show the new books without waiting for the next refresh of the library
+    return import_status(progress), True, LIBRARY_STORE.refresh().version
 
 
 # add callback for toggling the collapse on small screens
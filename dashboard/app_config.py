@@ -1,10 +1,41 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import Optional
 
 
 class AppConfig(BaseSettings):
     library_path: Path = Path("/home/garvys/Documents/calibre-dashboard/library")
     debug: bool = True
+    # Where the search index and other caches are stored, in the temporary
+    # directory by default
+    cache_dir: Optional[Path] = None
+    # Seconds between two checks for changes made to the library, 0 to disable
+    library_refresh_interval: int = 30
+    # Number of books displayed at once on the home page
+    page_size: int = 60
+    # Maximum memory used to cache the results of the queries to the library
+    query_cache_max_bytes: int = 64 * 1024 * 1024
+    # Last SQL statements kept to be inspected on /query-log, 0 to disable the log,
+    # and seconds above which their query plan is captured too
+    query_log_size: int = 0
+    query_log_slow_threshold: float = 0.1
+    # Seconds between two copies of metadata.db into a snapshot the reads are
+    # served from, made only when the library changed, 0 to read the library
+    # directly. Snapshots are kept in snapshot_dir, /dev/shm by default
+    snapshot_refresh_interval: float = 0
+    snapshot_dir: Optional[Path] = None
+    # Seconds the covers and the ebooks downloaded from the library are cached for
+    # without being revalidated, 0 to always revalidate them
+    cover_max_age: int = 24 * 3600
+    ebook_max_age: int = 0
+    # Format of the cover thumbnails, "webp" or "jpeg"
+    thumbnail_format: str = "webp"
+    # Threads making the thumbnails ahead of time, 0 to only make them on request
+    thumbnail_workers: int = 2
+    # Processes checking and hashing the uploaded files, all the CPUs by default
+    import_workers: Optional[int] = None
+    # Uploaded files added to the library by each calibredb invocation
+    import_chunk_size: int = 50
 
     class Config:
         env_prefix = "COLIBRY_"
@@ -0,0 +1,81 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import calibre
+import pytest
+from PIL import Image
+
+# The configuration of the dashboard is read when it is imported, so the library it
+# serves during the tests is made beforehand
+_TESTS_DIR = Path(tempfile.mkdtemp(prefix="colibry-dashboard-tests-"))
+_EMPTY_LIBRARY = Path(calibre.__file__).resolve().parent / "empty_library"
+_AUTHORS = ["Alphonse Daudet", "Hector Malot", "Jules Verne"]
+
+
+def _make_library(library_path: Path, nb_books: int) -> Path:
+    """Library of `nb_books` books, each with a cover and an EPUB file."""
+    shutil.copytree(_EMPTY_LIBRARY, library_path)
+    connection = sqlite3.connect(library_path / "metadata.db")
+    # Functions called by the triggers of calibre
+    connection.create_function("title_sort", 1, lambda e: e)
+    connection.create_function("uuid4", 0, lambda: "uuid")
+    with connection:
+        connection.executemany(
+            "INSERT INTO authors(id, name, sort) VALUES (?, ?, ?)",
+            [(idx + 1, e, e) for idx, e in enumerate(_AUTHORS)],
+        )
+        for book_id in range(1, nb_books + 1):
+            author = _AUTHORS[book_id % len(_AUTHORS)]
+            title = f"Book {book_id}"
+            path = f"{author}/{title} ({book_id})"
+            name = f"{title} - {author}"
+            connection.execute(
+                "INSERT INTO books(id, title, series_index, author_sort, path, "
+                "has_cover, timestamp, last_modified) "
+                "VALUES (?, ?, 1, ?, ?, 1, '2024-01-01', '2024-01-01')",
+                [book_id, title, author, path],
+            )
+            connection.execute(
+                "INSERT INTO books_authors_link(book, author) VALUES (?, ?)",
+                [book_id, book_id % len(_AUTHORS) + 1],
+            )
+            connection.execute(
+                "INSERT INTO data(book, format, uncompressed_size, name) "
+                "VALUES (?, 'EPUB', 0, ?)",
+                [book_id, name],
+            )
+
+            folder = library_path / path
+            folder.mkdir(parents=True)
+            Image.new("RGB", (200, 300), "blue").save(folder / "cover.jpg")
+            (folder / f"{name}.epub").write_bytes(f"{title}\n".encode() * 100)
+    connection.close()
+    return library_path
+
+
+os.environ["COLIBRY_LIBRARY_PATH"] = str(_make_library(_TESTS_DIR / "library", 5))
+os.environ["COLIBRY_CACHE_DIR"] = str(_TESTS_DIR / "cache")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_TESTS_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def dash_app():
+    import app
+
+    return app.app
+
+
+@pytest.fixture
+def client(dash_app):
+    return dash_app.server.test_client()
+
+
+@pytest.fixture(scope="session")
+def library_path() -> Path:
+    return _TESTS_DIR / "library"
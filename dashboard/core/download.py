@@ -1,6 +1,11 @@
 from pathlib import Path
 from urllib.parse import quote as urlquote
 
+from flask import Response, send_from_directory
+
+# Name given by calibre to the cover of every book
+COVER_FILENAME = "cover.jpg"
+
 
 def ebook_download_link(children, library_path: Path, ebook_path: str):
     """Create a Plotly Dash 'A' element that downloads a file from the app."""
@@ -8,3 +13,33 @@ def ebook_download_link(children, library_path: Path, ebook_path: str):
     p = p.relative_to(library_path)
 
     return "/download-from-library/{}".format(urlquote(str(p)))
+
+
+def library_file_response(
+    library_path: Path, path: str, cover_max_age: int, ebook_max_age: int
+) -> Response:
+    """Send a file of the library, honoring the conditional (If-None-Match,
+    If-Modified-Since) and range (Range, If-Range) headers of the request.
+
+    Covers are shown inline and may be cached by shared caches such as a reverse
+    proxy. Ebooks are downloaded as attachments and only cached by the browser,
+    which revalidates them with their ETag after `ebook_max_age` seconds.
+    """
+    is_cover = Path(path).name == COVER_FILENAME
+    response = send_from_directory(
+        library_path,
+        path,
+        as_attachment=not is_cover,
+        max_age=cover_max_age if is_cover else ebook_max_age,
+    )
+
+    # Let download managers know that interrupted downloads can be resumed
+    response.accept_ranges = "bytes"
+    if is_cover:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+        if ebook_max_age <= 0:
+            response.cache_control.max_age = None
+            response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,77 @@
+import base64
+import logging
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+from app_config import APP_CONFIG
+from calibre import BulkImport, CalibreDB, ImportProgress, WriteQueue
+from core.library_store import LIBRARY_STORE
+
+logger = logging.getLogger(__name__)
+
+# Imports are run by the process that received the files, their progress is saved
+# where every gunicorn worker can read it
+UPLOADS_DIR = LIBRARY_STORE.library.cache_dir / "uploads"
+IMPORTS_DIR = LIBRARY_STORE.library.cache_dir / "imports"
+
+_IMPORT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+WRITE_QUEUE = WriteQueue(CalibreDB(APP_CONFIG.library_path))
+
+
+def _upload_name(filename: str, taken: set) -> str:
+    """Name under which an uploaded file is saved, without any directory."""
+    name = Path(filename.replace("\\", "/")).name
+    if name in ("", ".", ".."):
+        name = "ebook"
+    stem, suffix = Path(name).stem, Path(name).suffix
+    index = 1
+    while name in taken:
+        name = f"{stem} ({index}){suffix}"
+        index += 1
+    taken.add(name)
+    return name
+
+
+def _remove_upload(bulk_import: BulkImport) -> None:
+    if bulk_import.paths:
+        shutil.rmtree(bulk_import.paths[0].parent, ignore_errors=True)
+
+
+def start_import(contents: List[str], filenames: List[str]) -> str:
+    """Save the files of a dcc.Upload and import them in the background.
+
+    Returns the id of the import, to follow it with `import_progress`.
+    """
+    UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    upload_dir = Path(tempfile.mkdtemp(dir=UPLOADS_DIR))
+
+    paths = []
+    taken: set = set()
+    for content, filename in zip(contents, filenames):
+        path = upload_dir / _upload_name(filename, taken)
+        # dcc.Upload gives data URLs: "data:<mimetype>;base64,<content>"
+        path.write_bytes(base64.b64decode(content.split(",", 1)[1]))
+        paths.append(path)
+
+    bulk_import = BulkImport(
+        paths,
+        write_queue=WRITE_QUEUE,
+        library=LIBRARY_STORE.library,
+        workers=APP_CONFIG.import_workers,
+        chunk_size=APP_CONFIG.import_chunk_size,
+        progress_dir=IMPORTS_DIR,
+        on_finished=_remove_upload,
+    ).start()
+
+    logger.info("Importing %d files (import %s)", len(paths), bulk_import.id)
+    return bulk_import.id
+
+
+def import_progress(import_id: str) -> Optional[ImportProgress]:
+    if not _IMPORT_ID.match(import_id):
+        return None
+    return ImportProgress.load(IMPORTS_DIR / f"{import_id}.json")
@@ -0,0 +1,283 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app_config import APP_CONFIG
+from calibre import (
+    BookMetadata,
+    BookPage,
+    CalibreField,
+    CalibreSql,
+    DatabaseSnapshot,
+    FacetField,
+    FacetValue,
+    Filter,
+    LibraryChanges,
+    LibraryIndex,
+    LibraryLock,
+    QueryCache,
+    SearchParams,
+)
+from calibre.calibre_sql import register_functions
+from calibre.query_log import QueryLog
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_FIELDS = [
+    CalibreField.authors,
+    CalibreField.cover,
+    CalibreField.formats,
+    CalibreField.series,
+    CalibreField.series_index,
+    CalibreField.timestamp,
+]
+
+
+class LibrarySnapshot:
+    """Immutable view of the whole library at a given version."""
+
+    def __init__(
+        self,
+        version: str,
+        books: List[BookMetadata],
+        checkpoint: Optional[str],
+        updated: Optional[List[BookMetadata]] = None,
+    ):
+        self.version = version
+        self.books = books
+        self.books_by_id: Dict[int, BookMetadata] = {e.id: e for e in books}
+        # Most recent `last_modified` of the books contained in the snapshot
+        self.checkpoint = checkpoint
+        # Books added or modified since the previous snapshot, all of them for the
+        # first one
+        self.updated = books if updated is None else updated
+        self._index: Optional[LibraryIndex] = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self) -> LibraryIndex:
+        """Index of the books, built on first use."""
+        return self.build_index()
+
+    def build_index(self) -> LibraryIndex:
+        """Build the index of the books unless already built, and return it."""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = LibraryIndex(self.books, fields=LIBRARY_FIELDS)
+        return self._index
+
+    def patch(self, version: str, changes: LibraryChanges) -> "LibrarySnapshot":
+        """Build a new snapshot by applying `changes` on top of this one."""
+        books_by_id = dict(self.books_by_id)
+        for book_id in changes.deleted_ids:
+            books_by_id.pop(book_id, None)
+        for book in changes.updated:
+            books_by_id[book.id] = book
+
+        return LibrarySnapshot(
+            version=version,
+            books=[books_by_id[e] for e in sorted(books_by_id)],
+            checkpoint=changes.checkpoint,
+            updated=changes.updated,
+        )
+
+    def __len__(self) -> int:
+        return len(self.books)
+
+
+class LibraryStore:
+    """Process-side cache of the library.
+
+    The browser only holds the version token of a snapshot (in the `library`
+    dcc.Store) and callbacks look the books up here instead of round-tripping
+    the whole library through the client.
+    """
+
+    def __init__(
+        self,
+        library_path: Path,
+        cache_dir: Optional[Path] = None,
+        max_snapshots: int = 2,
+        query_cache_max_bytes: int = 64 * 1024 * 1024,
+        query_log: Optional[QueryLog] = None,
+        snapshot_refresh_interval: float = 0,
+        snapshot_dir: Optional[Path] = None,
+    ):
+        self.library_path = library_path
+        self.cache_dir = cache_dir
+        self.max_snapshots = max_snapshots
+        self._snapshots: OrderedDict[str, LibrarySnapshot] = OrderedDict()
+        self._lock = threading.Lock()
+        # Copy of metadata.db refreshed in the background, so that the callbacks
+        # never wait for calibre or for a slow library folder
+        self.database_snapshot: Optional[DatabaseSnapshot] = None
+        if snapshot_refresh_interval > 0:
+            self.database_snapshot = DatabaseSnapshot(
+                self.library_path / "metadata.db",
+                snapshot_dir=snapshot_dir,
+                lock=LibraryLock.shared(self.library_path),
+                setup=register_functions,
+            ).start(interval=snapshot_refresh_interval)
+            # Copies in /dev/shm would otherwise outlive the process
+            atexit.register(self.database_snapshot.close)
+        # Reads go through the connection pool of the library, so the library can
+        # be queried concurrently by the callbacks, outside of the lock
+        self.library = CalibreSql(
+            self.library_path,
+            cache_dir=self.cache_dir,
+            query_cache=QueryCache(max_bytes=query_cache_max_bytes),
+            query_log=query_log,
+            snapshot=self.database_snapshot,
+        )
+        self._data_version: Optional[int] = None
+
+    def _new_version(self) -> str:
+        return f"{time.time_ns():x}"
+
+    def _latest(self) -> Optional[LibrarySnapshot]:
+        if not self._snapshots:
+            return None
+        return next(reversed(self._snapshots.values()))
+
+    def _add_snapshot(self, snapshot: LibrarySnapshot) -> LibrarySnapshot:
+        self._snapshots[snapshot.version] = snapshot
+        while len(self._snapshots) > self.max_snapshots:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    def reload(self) -> LibrarySnapshot:
+        """Re-read the whole library and publish it as a new snapshot."""
+        logger.info("Loading library %s...", self.library_path)
+        with self._lock:
+            library = self.library
+            self._data_version = library.data_version()
+            checkpoint = library.checkpoint()
+            books_metadata = library.list_books(
+                params=SearchParams(fields=LIBRARY_FIELDS)
+            )
+            previous = self._latest()
+            updated = None
+            if previous is not None:
+                updated = [
+                    e for e in books_metadata if previous.books_by_id.get(e.id) != e
+                ]
+            return self._add_snapshot(
+                LibrarySnapshot(
+                    version=self._new_version(),
+                    books=books_metadata,
+                    checkpoint=checkpoint,
+                    updated=updated,
+                )
+            )
+
+    def refresh(self) -> LibrarySnapshot:
+        """Apply the changes made to the library since the last snapshot.
+
+        Only the books added or modified since then are read again, nothing is
+        done at all when SQLite reports that the database was not written to.
+        """
+        with self._lock:
+            snapshot = self._latest()
+            if snapshot is not None:
+                library = self.library
+                data_version = library.data_version()
+                if data_version == self._data_version:
+                    return snapshot
+
+                changes = library.list_changes(
+                    checkpoint=snapshot.checkpoint,
+                    known_ids=snapshot.books_by_id.keys(),
+                    params=SearchParams(fields=LIBRARY_FIELDS),
+                )
+                self._data_version = data_version
+                if changes.is_empty():
+                    return snapshot
+
+                logger.info(
+                    "Library changed: %d books updated, %d books deleted",
+                    len(changes.updated),
+                    len(changes.deleted_ids),
+                )
+                return self._add_snapshot(
+                    snapshot.patch(version=self._new_version(), changes=changes)
+                )
+
+        return self.reload()
+
+    def current(self) -> LibrarySnapshot:
+        with self._lock:
+            snapshot = self._latest()
+        if snapshot is not None:
+            return snapshot
+        return self.reload()
+
+    def list_books(self, params: SearchParams) -> List[BookMetadata]:
+        """Query the library directly, e.g. to filter and sort it in SQL."""
+        return self.library.list_books(params=params)
+
+    # Searches on the fields of the snapshots filtered by authors and series are
+    # answered by the index of `snapshot`, the current one by default, the others
+    # in SQL. A callback making several searches resolves its snapshot once with
+    # `get` and passes it to each, so that they all answer from the same books.
+
+    def list_page(
+        self, params: SearchParams, snapshot: Optional[LibrarySnapshot] = None
+    ) -> BookPage:
+        index = (snapshot or self.current()).index
+        if index.supports(params):
+            return index.list_page(params=params)
+        return self.library.list_page(params=params)
+
+    def count_books(
+        self, params: SearchParams, snapshot: Optional[LibrarySnapshot] = None
+    ) -> int:
+        index = (snapshot or self.current()).index
+        if index.supports(params):
+            return index.count_books(filters=params.filters)
+        return self.library.count_books(params=params)
+
+    def facets(
+        self,
+        fields: List[FacetField],
+        filters: List[Filter],
+        snapshot: Optional[LibrarySnapshot] = None,
+    ) -> Dict[FacetField, List[FacetValue]]:
+        index = (snapshot or self.current()).index
+        if index.supports_facets(fields, filters):
+            return index.facets(fields=fields, filters=filters)
+        return self.library.facets(fields=fields, filters=filters)
+
+    def get(self, version: Optional[str] = None) -> LibrarySnapshot:
+        """Return the snapshot matching `version`.
+
+        Falls back to the most recent snapshot when the version is unknown to
+        this process (e.g. it was produced by another gunicorn worker).
+        """
+        if version is not None:
+            with self._lock:
+                snapshot = self._snapshots.get(version)
+            if snapshot is not None:
+                return snapshot
+        return self.current()
+
+
+LIBRARY_STORE = LibraryStore(
+    APP_CONFIG.library_path,
+    cache_dir=APP_CONFIG.cache_dir,
+    query_cache_max_bytes=APP_CONFIG.query_cache_max_bytes,
+    snapshot_refresh_interval=APP_CONFIG.snapshot_refresh_interval,
+    snapshot_dir=APP_CONFIG.snapshot_dir,
+    query_log=(
+        QueryLog(
+            max_entries=APP_CONFIG.query_log_size,
+            slow_threshold=APP_CONFIG.query_log_slow_threshold,
+        )
+        if APP_CONFIG.query_log_size > 0
+        else None
+    ),
+)
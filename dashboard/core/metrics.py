@@ -0,0 +1,79 @@
+import functools
+import time
+
+import dash
+from calibre.metrics import REGISTRY
+from dash import Dash
+from flask import Response, g, request
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "colibry_http_request_seconds",
+    "Duration of the requests served by the dashboard, per route.",
+    ["method", "route", "status"],
+)
+CALLBACK_SECONDS = REGISTRY.histogram(
+    "colibry_dash_callback_seconds",
+    "Duration of the Dash callbacks and of the page layouts.",
+    ["callback"],
+)
+
+_CALLBACK_ROUTE = "/_dash-update-component"
+
+
+def _callback_name(app: Dash) -> str:
+    """Name of the function of the callback run by the current request."""
+    body = request.get_json(silent=True) or {}
+    output = body.get("output", "")
+    func = app.callback_map.get(output, {}).get("callback")
+    if func is None:
+        # Not the output of the request, any client could make up series
+        return "unknown"
+    # Callbacks are wrapped by Dash with functools.wraps
+    return f"{func.__module__}.{func.__name__}"
+
+
+def _timed_layout(module: str, layout):
+    @functools.wraps(layout)
+    def wrapper(*args, **kwargs):
+        with CALLBACK_SECONDS.time((f"{module}.layout",)):
+            return layout(*args, **kwargs)
+
+    return wrapper
+
+
+def install_metrics(app: Dash) -> None:
+    """Time the requests of the server of `app`, its callbacks and the layouts of
+    its pages, and serve all the metrics of the process on `/metrics`."""
+    server = app.server
+
+    @server.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def observe_request(response: Response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        duration = time.perf_counter() - start
+
+        # Routes and not paths, so that the number of series stays bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            duration, (request.method, route, str(response.status_code))
+        )
+        if route.endswith(_CALLBACK_ROUTE):
+            CALLBACK_SECONDS.observe(duration, (_callback_name(app),))
+        return response
+
+    # Pages are rendered by the callback of the router of Dash, their layouts are
+    # timed on their own to tell them apart
+    for module, page in dash.page_registry.items():
+        if callable(page.get("layout")):
+            page["layout"] = _timed_layout(module, page["layout"])
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(
+            REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -0,0 +1,199 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import quote as urlquote
+
+from app_config import APP_CONFIG
+from core.library_store import LIBRARY_STORE
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Heights of the thumbnails that can be requested, in pixels. The home grid shows
+# covers 15rem (240px) tall, they are made twice as big for high-DPI screens.
+THUMBNAIL_HEIGHTS = (480, 960)
+CARD_HEIGHT = 480
+PAGE_HEIGHT = 960
+
+# Number of covers handled by each background task
+_PREFETCH_CHUNK_SIZE = 64
+
+_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True}),
+}
+
+
+def cover_version(cover_path: Path) -> Optional[int]:
+    try:
+        return cover_path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def thumbnail_url(library_path: Path, cover_path: Path, height: int) -> str:
+    """URL of the thumbnail of a cover. It contains the modification time of the
+    cover so that it can be cached for good by the browsers."""
+    path = urlquote(str(cover_path.relative_to(library_path)))
+    version = THUMBNAIL_CACHE.cover_version(cover_path)
+    if version is None:
+        return f"/thumbnail/{height}/{path}"
+    return f"/thumbnail/{height}/{path}?v={version}"
+
+
+class ThumbnailCache:
+    """On-disk cache of resized covers.
+
+    Thumbnails are content-addressed by the path and the modification time of their
+    cover, so a cover modified in calibre gets a new thumbnail. They are made on
+    first request, or ahead of time by `prefetch` in a pool of background workers.
+
+    The versions of the covers used in the URLs of the thumbnails are looked up once
+    per process, `update` tells which covers may have changed since.
+    """
+
+    def __init__(self, cache_dir: Path, image_format: str = "webp", workers: int = 2):
+        if image_format not in _FORMATS:
+            raise ValueError(f"Thumbnail format not supported: {image_format}")
+        self.cache_dir = cache_dir
+        self.image_format = image_format
+        self.mimetype = _FORMATS[image_format][1]
+
+        self._executor = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+            if workers > 0
+            else None
+        )
+        # Thumbnails being made, so that each one is only made once at a time
+        self._pending: Dict[Path, Future] = {}
+        self._lock = threading.Lock()
+        self._versions: Dict[Path, int] = {}
+
+    def cover_version(self, cover_path: Path) -> Optional[int]:
+        """Version of the cover when it was first looked up or last updated."""
+        version = self._versions.get(cover_path)
+        if version is None:
+            version = cover_version(cover_path)
+            if version is not None:
+                self._versions[cover_path] = version
+        return version
+
+    def update(
+        self, cover_paths: Iterable[Path], heights: Tuple[int, ...] = THUMBNAIL_HEIGHTS
+    ) -> None:
+        """Look the versions of covers added or modified up again, and make their
+        missing thumbnails in the background."""
+        cover_paths = list(cover_paths)
+        for cover_path in cover_paths:
+            self._versions.pop(cover_path, None)
+        self.prefetch(cover_paths, heights=heights)
+
+    def _thumbnail_path(self, cover_path: Path, version: int, height: int) -> Path:
+        key = f"{cover_path.resolve()}\0{version}\0{height}\0{self.image_format}"
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return self.cache_dir / digest[:2] / f"{digest}.{self.image_format}"
+
+    def get(self, cover_path: Path, height: int) -> Optional[Path]:
+        """Path of the thumbnail of the cover, made if it does not exist yet.
+
+        Returns None when the cover can't be read as an image.
+        """
+        if height not in THUMBNAIL_HEIGHTS:
+            raise ValueError(f"Thumbnail height not supported: {height}")
+        version = cover_version(cover_path)
+        if version is None:
+            raise FileNotFoundError(cover_path)
+
+        thumbnail_path = self._thumbnail_path(cover_path, version, height)
+        if thumbnail_path.exists():
+            return thumbnail_path
+
+        with self._lock:
+            future = self._pending.get(thumbnail_path)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pending[thumbnail_path] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._make(cover_path, thumbnail_path, height)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(thumbnail_path, None)
+
+    def _make(
+        self, cover_path: Path, thumbnail_path: Path, height: int
+    ) -> Optional[Path]:
+        pil_format, _, options = _FORMATS[self.image_format]
+        try:
+            with Image.open(cover_path) as image:
+                width = max(1, round(image.width * height / image.height))
+                # Let the JPEG decoder downscale while decoding, much faster
+                image.draft("RGB", (width, height))
+                image = image.convert("RGB")
+                if image.height > height:
+                    image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+                thumbnail_path.parent.mkdir(parents=True, exist_ok=True)
+                # Written aside then renamed, so that a partial file is never served
+                fd, tmp = tempfile.mkstemp(dir=thumbnail_path.parent, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        image.save(f, pil_format, **options)
+                    os.replace(tmp, thumbnail_path)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+        except (UnidentifiedImageError, OSError) as e:
+            logger.warning("Can't make the thumbnail of %s: %s", cover_path, e)
+            return None
+
+        return thumbnail_path
+
+    def prefetch(
+        self, cover_paths: Iterable[Path], heights: Tuple[int, ...] = THUMBNAIL_HEIGHTS
+    ) -> None:
+        """Make the missing thumbnails of the covers in the background."""
+        if self._executor is None:
+            return
+        cover_paths = list(cover_paths)
+        for start in range(0, len(cover_paths), _PREFETCH_CHUNK_SIZE):
+            chunk = cover_paths[start : start + _PREFETCH_CHUNK_SIZE]
+            self._executor.submit(self._prefetch, chunk, heights)
+
+    def _prefetch(self, cover_paths: Iterable[Path], heights: Tuple[int, ...]) -> None:
+        nb_made = 0
+        for cover_path in cover_paths:
+            for height in heights:
+                try:
+                    version = cover_version(cover_path)
+                    if version is None:
+                        continue
+                    if self._thumbnail_path(cover_path, version, height).exists():
+                        continue
+                    self.get(cover_path, height)
+                    nb_made += 1
+                except Exception:
+                    logger.exception("Error making the thumbnail of %s", cover_path)
+        if nb_made:
+            logger.info("%d thumbnails made ahead of time", nb_made)
+
+
+THUMBNAIL_CACHE = ThumbnailCache(
+    LIBRARY_STORE.library.cache_dir / "thumbnails",
+    image_format=APP_CONFIG.thumbnail_format,
+    workers=APP_CONFIG.thumbnail_workers,
+)
@@ -1,12 +1,12 @@
 import os
-from pathlib import Path
-from urllib.parse import quote as urlquote
 
 import dash
 import dash_bootstrap_components as dbc
 from app_config import APP_CONFIG
-from calibre import BookMetadata, CalibreField, CalibreSql, EqualityFilter, SearchParams
+from calibre import BookMetadata, CalibreField, EqualityFilter, SearchParams
 from core.download import ebook_download_link
+from core.library_store import LIBRARY_STORE
+from core.thumbnails import PAGE_HEIGHT, thumbnail_url
 from dash import html
 
 dash.register_page(__name__, path_template="/book/<book_id>")
@@ -90,8 +90,7 @@ def generate_download_buttons(book: BookMetadata):
 
 
 def layout(book_id: str = 0, **kwargs):
-    lib = CalibreSql(APP_CONFIG.library_path)
-    books = lib.list_books(
+    books = LIBRARY_STORE.list_books(
         params=SearchParams(
             fields=[
                 CalibreField.cover,
@@ -108,7 +107,9 @@ def layout(book_id: str = 0, **kwargs):
     # TODO: Add error check
     book = books[0]
 
-    cover_path = Path(book.cover).relative_to(APP_CONFIG.library_path)
+    cover_src = None
+    if book.cover is not None:
+        cover_src = thumbnail_url(APP_CONFIG.library_path, book.cover, PAGE_HEIGHT)
 
     return html.Div(
         [
@@ -120,7 +121,7 @@ def layout(book_id: str = 0, **kwargs):
                             [
                                 dbc.Col(
                                     html.Img(
-                                        src=f"/download-from-library/{urlquote(str(cover_path))}",
+                                        src=cover_src,
                                         className="img-responsive rounded ebook-cover",
                                         style={"maxWidth": "100%"},
                                     ),
@@ -1,23 +1,43 @@
 import logging
-from pathlib import Path
 from typing import List, Optional
-from urllib.parse import quote as urlquote
 
 import dash
 import dash_bootstrap_components as dbc
 from app_config import APP_CONFIG
-from calibre.calibredb import BookMetadata
-from dash import Input, Output, State, callback, dcc, html
+from calibre import (
+    BookMetadata,
+    BookPage,
+    FacetField,
+    FacetFilter,
+    FacetValue,
+    Filter,
+    FullTextFilter,
+    OrderBy,
+    SearchParams,
+)
+from calibre.objects import InternalCalibreField
+from core.library_store import LIBRARY_FIELDS, LIBRARY_STORE
+from core.thumbnails import CARD_HEIGHT, thumbnail_url
+from dash import Input, Output, Patch, State, callback, dcc, html
 
 dash.register_page(__name__, path="/", name="Home")
 logger = logging.getLogger(__name__)
 
+SORT_BY = {
+    "Authors A->Z": OrderBy(field=InternalCalibreField.authors),
+    "Authors Z->A": OrderBy(field=InternalCalibreField.authors, descending=True),
+    "Newest first": OrderBy(field=InternalCalibreField.timestamp, descending=True),
+    "Oldest first": OrderBy(field=InternalCalibreField.timestamp),
+}
+
 
-def display_library(books_metadata):
+def book_cards(books_metadata: List[BookMetadata]) -> List[dbc.Col]:
     cards = []
 
     for entry in books_metadata:
-        cover_path = Path(entry.cover).relative_to(APP_CONFIG.library_path)
+        cover_src = None
+        if entry.cover is not None:
+            cover_src = thumbnail_url(APP_CONFIG.library_path, entry.cover, CARD_HEIGHT)
 
         text = ""
         if entry.series:
@@ -27,7 +47,7 @@ def display_library(books_metadata):
             [
                 dcc.Link(
                     children=dbc.CardImg(
-                        src=f"/download-from-library/{urlquote(str(cover_path))}",
+                        src=cover_src,
                         top=True,
                         className="rounded ebook-cover",
                         style={"height": "15rem"},
@@ -66,16 +86,70 @@ def display_library(books_metadata):
 
         cards.append(dbc.Col(card, className="d-flex flex-wrap"))
 
-    if len(books_metadata) <= 1:
-        t = f"{len(books_metadata)} e-book found :"
+    return cards
+
+
+def load_more_style(page: BookPage) -> dict:
+    return {} if page.next_cursor else {"display": "none"}
+
+
+def display_library(page: BookPage, nb_books: int):
+    if nb_books <= 1:
+        t = f"{nb_books} e-book found :"
     else:
-        t = f"{len(books_metadata)} e-books found :"
+        t = f"{nb_books} e-books found :"
 
-    res = html.Div([html.P(t, className="p-2"), dbc.Row(cards, className="")])
+    res = html.Div(
+        [
+            html.P(t, className="p-2"),
+            dbc.Row(book_cards(page.books), className="", id="books-grid"),
+            html.Div(
+                dbc.Button("Load more", color="primary", id="load-more-button"),
+                className="d-flex justify-content-center m-4",
+                id="load-more",
+                style=load_more_style(page),
+            ),
+        ]
+    )
 
     return res
 
 
+def search_filters(
+    text_search: Optional[str],
+    authors_filter: Optional[List[str]],
+    series_filter: Optional[List[str]],
+) -> List[Filter]:
+    filters = []
+    if authors_filter:
+        filters.append(FacetFilter(field=FacetField.authors, values=authors_filter))
+    if series_filter:
+        filters.append(FacetFilter(field=FacetField.series, values=series_filter))
+    if text_search and text_search.strip():
+        filters.append(FullTextFilter(query=text_search.strip()))
+    return filters
+
+
+def search_params(
+    text_search: Optional[str],
+    authors_filter: Optional[List[str]],
+    series_filter: Optional[List[str]],
+    sort_by: str,
+    cursor: Optional[str] = None,
+) -> SearchParams:
+    filters = search_filters(text_search, authors_filter, series_filter)
+    if sort_by not in SORT_BY:
+        raise ValueError(f"Sort not supported: {sort_by}")
+
+    return SearchParams(
+        fields=LIBRARY_FIELDS,
+        filters=filters,
+        order_by=[SORT_BY[sort_by]],
+        limit=APP_CONFIG.page_size,
+        cursor=cursor,
+    )
+
+
 def add_search():
     authors_dropdown = dbc.Col(
         [
@@ -98,8 +172,12 @@ def add_search():
     authors_and_series = dbc.Row([authors_dropdown, series_dropdown])
     title_search = html.Div(
         [
-            dbc.Label("Title"),
-            dbc.Input(id="text-search", placeholder="Title", type="text"),
+            dbc.Label("Search"),
+            dbc.Input(
+                id="text-search",
+                placeholder='Title, authors, series, tags, comments or "a phrase"',
+                type="text",
+            ),
         ],
         className="mt-1",
     )
@@ -138,6 +216,7 @@ layout = html.Div(
                         [
                             html.H1("Home", className="m-2 pt-3 pb-3"),
                             add_search(),
+                            dcc.Store(id="books-query"),
                             html.Div(children=[], id="books-library"),
                         ]
                     ),
@@ -149,32 +228,58 @@ layout = html.Div(
 )
 
 
-@callback(
-    Output("authors-filter", "options"),
-    Input("library", "data"),
-    prevent_initial_call=True,
-)
-def update_authors_list(library):
-    books_metadata = [BookMetadata.model_validate_json(e) for e in library]
-
-    authors = set(e.authors for e in books_metadata if e.authors)
-    return sorted(list(authors))
+def facet_options(
+    values: List[FacetValue], selected: Optional[List[str]]
+) -> List[dict]:
+    options = [{"label": f"{e.value} ({e.count})", "value": e.value} for e in values]
+    # Keep the selected values even when no book matches them anymore
+    available = set(e.value for e in values)
+    options.extend(
+        {"label": f"{e} (0)", "value": e} for e in selected or [] if e not in available
+    )
+    return options
 
 
 @callback(
+    Output("authors-filter", "options"),
     Output("series-filter", "options"),
+    State("text-search", "value"),
+    State("authors-filter", "value"),
+    State("series-filter", "value"),
     Input("library", "data"),
+    Input("search-button", "n_clicks"),
     prevent_initial_call=True,
 )
-def update_series_list(library):
-    books_metadata = [BookMetadata.model_validate_json(e) for e in library]
+def update_facets(
+    text_search: Optional[str],
+    authors_filter: Optional[List[str]],
+    series_filter: Optional[List[str]],
+    library_version: str,
+    _n_clicks,
+):
+    snapshot = LIBRARY_STORE.get(library_version)
+    # The counts of each dropdown take into account the other filters only, so
+    # that more values can still be selected in it
+    authors = LIBRARY_STORE.facets(
+        fields=[FacetField.authors],
+        filters=search_filters(text_search, None, series_filter),
+        snapshot=snapshot,
+    )[FacetField.authors]
+    series = LIBRARY_STORE.facets(
+        fields=[FacetField.series],
+        filters=search_filters(text_search, authors_filter, None),
+        snapshot=snapshot,
+    )[FacetField.series]
 
-    authors = set(e.series for e in books_metadata if e.series)
-    return sorted(list(authors))
+    return (
+        facet_options(authors, authors_filter),
+        facet_options(series, series_filter),
+    )
 
 
 @callback(
     Output("books-library", "children"),
+    Output("books-query", "data"),
     State("text-search", "value"),
     State("authors-filter", "value"),
     State("series-filter", "value"),
@@ -187,7 +292,7 @@ def output_text(
     authors_filter: Optional[List[str]],
     series_filter: List[str],
     sort_by: str,
-    library,
+    library_version: str,
     _n_clicks,
 ):
     logger.debug(
@@ -197,23 +302,39 @@ def output_text(
         series_filter,
         sort_by,
     )
-    books_metadata = [BookMetadata.model_validate_json(e) for e in library]
-    if authors_filter:
-        books_metadata = [b for b in books_metadata if b.authors in authors_filter]
-    if series_filter:
-        books_metadata = [b for b in books_metadata if b.series in series_filter]
-    if text_search:
-        books_metadata = [
-            b for b in books_metadata if text_search.lower() in b.title.lower()
-        ]
-    if sort_by == "Authors A->Z":
-        books_metadata = sorted(books_metadata, key=lambda x: x.authors)
-    elif sort_by == "Authors Z->A":
-        books_metadata = sorted(books_metadata, key=lambda x: x.authors, reverse=True)
-    elif sort_by == "Oldest first":
-        books_metadata = sorted(books_metadata, key=lambda x: x.timestamp)
-    elif sort_by == "Newest first":
-        books_metadata = sorted(books_metadata, key=lambda x: x.timestamp, reverse=True)
-    else:
-        raise ValueError(f"Sort not supported: {sort_by}")
-    return display_library(books_metadata)
+    params = search_params(text_search, authors_filter, series_filter, sort_by)
+    snapshot = LIBRARY_STORE.get(library_version)
+    page = LIBRARY_STORE.list_page(params, snapshot=snapshot)
+    nb_books = LIBRARY_STORE.count_books(params, snapshot=snapshot)
+
+    # Remember the search so that the next pages are loaded with the same one
+    query = {
+        "text_search": text_search,
+        "authors_filter": authors_filter,
+        "series_filter": series_filter,
+        "sort_by": sort_by,
+        "cursor": page.next_cursor,
+    }
+    return display_library(page, nb_books), query
+
+
+@callback(
+    Output("books-grid", "children"),
+    Output("books-query", "data", allow_duplicate=True),
+    Output("load-more", "style"),
+    Input("load-more-button", "n_clicks"),
+    State("books-query", "data"),
+    State("library", "data"),
+    prevent_initial_call=True,
+)
+def load_more(_n_clicks, query, library_version):
+    if not query or not query["cursor"]:
+        return dash.no_update, dash.no_update, {"display": "none"}
+
+    page = LIBRARY_STORE.list_page(
+        search_params(**query), snapshot=LIBRARY_STORE.get(library_version)
+    )
+
+    cards = Patch()
+    cards.extend(book_cards(page.books))
+    return cards, {**query, "cursor": page.next_cursor}, load_more_style(page)
@@ -1,2 +1,51 @@
-def test_ok():
-    pass
+from pathlib import Path
+
+from core.download import library_file_response
+
+
+def _relative_path(library_path: Path, pattern: str) -> str:
+    return next(library_path.glob(pattern)).relative_to(library_path).as_posix()
+
+
+def test_download_conditional_and_range(client, library_path: Path):
+    url = f"/download-from-library/{_relative_path(library_path, '*/*/*.epub')}"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.accept_ranges == "bytes"
+    etag = response.headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get(url, headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert len(response.data) == 10
+    assert response.headers["Content-Range"].startswith("bytes 0-9/")
+
+    assert client.get("/download-from-library/missing.epub").status_code == 404
+
+
+def test_download_cache_control(client, dash_app, library_path: Path):
+    cover = client.get(
+        f"/download-from-library/{_relative_path(library_path, '*/*/cover.jpg')}"
+    )
+    assert cover.cache_control.public
+    assert cover.cache_control.max_age == 24 * 3600
+    assert "attachment" not in cover.headers.get("Content-Disposition", "")
+
+    # Ebooks are revalidated every time by default
+    ebook_path = _relative_path(library_path, "*/*/*.epub")
+    ebook = client.get(f"/download-from-library/{ebook_path}")
+    assert ebook.cache_control.private
+    assert ebook.cache_control.no_cache
+    assert ebook.cache_control.max_age is None
+    assert ebook.headers["Content-Disposition"].startswith("attachment")
+
+    with dash_app.server.test_request_context():
+        ebook = library_file_response(
+            library_path, ebook_path, cover_max_age=0, ebook_max_age=60
+        )
+    assert ebook.cache_control.private
+    assert not ebook.cache_control.no_cache
+    assert ebook.cache_control.max_age == 60
@@ -0,0 +1,55 @@
+import base64
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+from app_config import APP_CONFIG
+from calibre import CalibreDB
+from core.ingestion import _upload_name, import_progress, start_import
+
+EBOOKS_DIR = Path(__file__).resolve().parents[2] / "data" / "ebooks"
+
+
+def test_upload_name():
+    taken: set = set()
+    names = ["..", ".", "", "dir/../book.epub", "C:\\books\\book.epub"]
+    assert [_upload_name(e, taken) for e in names] == [
+        "ebook",
+        "ebook (1)",
+        "ebook (2)",
+        "book.epub",
+        "book (1).epub",
+    ]
+
+
+def test_start_import(monkeypatch: pytest.MonkeyPatch):
+    commands: List[List[str]] = []
+    monkeypatch.setattr(
+        CalibreDB, "_run_calibredb", lambda self, params: commands.append(params)
+    )
+    monkeypatch.setattr(APP_CONFIG, "import_workers", 0)
+
+    ebooks = sorted(EBOOKS_DIR.glob("*.epub"))[:2]
+    contents = [
+        "data:application/epub+zip;base64," + base64.b64encode(e.read_bytes()).decode()
+        for e in ebooks
+    ]
+    import_id = start_import(contents, ["..", "book.epub"])
+
+    deadline = time.monotonic() + 30
+    progress = import_progress(import_id)
+    while not progress.finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+        progress = import_progress(import_id)
+    # Saved under another name, the file without extension is not an ebook
+    assert (progress.total, progress.added, progress.invalid) == (2, 1, 1)
+    assert progress.errors[0].startswith("ebook:")
+
+    added = [Path(e) for command in commands for e in command[1:]]
+    assert [e.name for e in added] == ["book.epub"]
+    # The uploaded files are removed once added
+    assert not any(e.exists() for e in added)
+
+    assert import_progress("0" * 32) is None
+    assert import_progress("../" + import_id) is None
@@ -0,0 +1,44 @@
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pytest
+from calibre import FacetField, SearchParams
+from core.library_store import LIBRARY_FIELDS, LibraryStore
+
+
+@pytest.fixture
+def store(tmp_path: Path, library_path: Path) -> LibraryStore:
+    path = Path(shutil.copytree(library_path, tmp_path / "library"))
+    store = LibraryStore(path, cache_dir=tmp_path / "cache")
+    yield store
+    store.library.close()
+    store.library.pool.close()
+
+
+def test_build_index(store: LibraryStore):
+    snapshot = store.reload()
+    index = snapshot.build_index()
+    assert snapshot.build_index() is index
+    assert snapshot.index is index
+    assert index.count_books([]) == len(snapshot)
+
+
+def test_search_snapshot(store: LibraryStore):
+    previous = store.reload()
+    connection = sqlite3.connect(store.library_path / "metadata.db")
+    connection.execute("DELETE FROM books WHERE id = 3")
+    connection.commit()
+    connection.close()
+    current = store.refresh()
+    assert store.get(previous.version) is previous
+
+    # Searches answer from the snapshot they are given, the current one otherwise
+    params = SearchParams(fields=LIBRARY_FIELDS)
+    for snapshot, ids in [(previous, [1, 2, 3, 4, 5]), (current, [1, 2, 4, 5])]:
+        page = store.list_page(params, snapshot=snapshot)
+        assert [e.id for e in page.books] == ids
+        assert store.count_books(params, snapshot=snapshot) == len(ids)
+        facets = store.facets([FacetField.authors], [], snapshot=snapshot)
+        assert sum(e.count for e in facets[FacetField.authors]) == len(ids)
+    assert store.count_books(params) == 4
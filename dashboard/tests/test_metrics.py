@@ -0,0 +1,43 @@
+from core.metrics import CALLBACK_SECONDS, HTTP_REQUEST_SECONDS
+
+
+def _callback_body(output: str, input_id: str, prop: str, value) -> dict:
+    return {
+        "output": output,
+        "outputs": {"id": output.split(".")[0], "property": output.split(".")[1]},
+        "inputs": [{"id": input_id, "property": prop, "value": value}],
+        "state": [{"id": output.split(".")[0], "property": "is_open", "value": False}],
+        "changedPropIds": [f"{input_id}.{prop}"],
+    }
+
+
+def test_requests_and_callbacks_timed(client):
+    pages = HTTP_REQUEST_SECONDS.count(("GET", "/", "200"))
+    toggles = CALLBACK_SECONDS.count(("app.toggle_navbar_collapse",))
+    unknown = CALLBACK_SECONDS.count(("unknown",))
+
+    assert client.get("/").status_code == 200
+    response = client.post(
+        "/_dash-update-component",
+        json=_callback_body("navbar-collapse.is_open", "navbar-toggler", "n_clicks", 1),
+    )
+    assert response.status_code == 200
+    # Outputs that are not callbacks are not turned into series
+    client.post(
+        "/_dash-update-component",
+        json=_callback_body("made-up.output", "navbar-toggler", "n_clicks", 1),
+    )
+
+    assert HTTP_REQUEST_SECONDS.count(("GET", "/", "200")) == pages + 1
+    assert CALLBACK_SECONDS.count(("app.toggle_navbar_collapse",)) == toggles + 1
+    assert CALLBACK_SECONDS.count(("unknown",)) == unknown + 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == "text/plain; version=0.0.4; charset=utf-8"
+    text = response.get_data(as_text=True)
+    assert (
+        'colibry_http_request_seconds_count{method="GET",route="/",status="200"}'
+        in text
+    )
+    assert "made-up" not in text
@@ -0,0 +1,96 @@
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pytest
+from core.thumbnails import ThumbnailCache, cover_version, thumbnail_url
+from PIL import Image
+
+
+@pytest.fixture
+def cover(tmp_path: Path) -> Path:
+    path = tmp_path / "cover.jpg"
+    Image.new("RGB", (400, 1200), "red").save(path)
+    return path
+
+
+def test_thumbnail_cache(tmp_path: Path, cover: Path):
+    cache = ThumbnailCache(tmp_path / "thumbnails", image_format="jpeg", workers=0)
+
+    thumbnail = cache.get(cover, 480)
+    with Image.open(thumbnail) as image:
+        assert image.size == (160, 480)
+    assert cache.get(cover, 480) == thumbnail
+
+    # A modified cover gets a new thumbnail
+    os.utime(cover, ns=(0, cover.stat().st_mtime_ns + 10**9))
+    assert cache.get(cover, 480) != thumbnail
+
+    (tmp_path / "text.jpg").write_text("not an image")
+    assert cache.get(tmp_path / "text.jpg", 480) is None
+    with pytest.raises(FileNotFoundError):
+        cache.get(tmp_path / "missing.jpg", 480)
+    with pytest.raises(ValueError):
+        cache.get(cover, 100)
+
+
+def test_cover_version(tmp_path: Path, cover: Path):
+    cache = ThumbnailCache(tmp_path / "thumbnails", workers=0)
+    version = cache.cover_version(cover)
+    assert version == cover_version(cover)
+
+    # Covers are only looked up again once updated
+    os.utime(cover, ns=(0, version + 10**9))
+    assert cache.cover_version(cover) == version
+    cache.update([cover])
+    assert cache.cover_version(cover) == version + 10**9
+    assert cache.cover_version(tmp_path / "missing.jpg") is None
+
+
+def test_thumbnail_route(client, library_path: Path):
+    cover = next(library_path.glob("*/*/cover.jpg"))
+
+    url = thumbnail_url(library_path, cover, 480)
+    assert "?v=" in url
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.cache_control.public
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365 * 24 * 3600
+
+    # Without the version of the cover, the thumbnail may still change
+    response = client.get(url.split("?")[0])
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
+    assert response.cache_control.max_age == 3600
+
+    relative = cover.relative_to(library_path).as_posix()
+    assert client.get(f"/thumbnail/100/{relative}").status_code == 404
+    assert client.get("/thumbnail/480/missing/cover.jpg").status_code == 404
+    assert client.get("/thumbnail/480/../../etc/passwd").status_code == 404
+
+
+def test_updated_books(tmp_path: Path, library_path: Path):
+    from core.library_store import LibraryStore
+
+    path = Path(shutil.copytree(library_path, tmp_path / "library"))
+    store = LibraryStore(path, cache_dir=tmp_path / "cache")
+    snapshot = store.reload()
+    assert snapshot.updated == snapshot.books
+
+    # Only the books that changed are updated by the next snapshots
+    assert store.reload().updated == []
+
+    connection = sqlite3.connect(path / "metadata.db")
+    # Functions called by the triggers of calibre
+    connection.create_function("title_sort", 1, lambda e: e)
+    connection.create_function("uuid4", 0, lambda: "uuid")
+    connection.execute(
+        "UPDATE books SET series_index = 42, last_modified = '2100-01-01' "
+        "WHERE id = 3"
+    )
+    connection.commit()
+    connection.close()
+    assert [e.id for e in store.refresh().updated] == [3]
+    store.library.pool.close()